@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of convert() for every input format, on synthetic files (see generators.py)
+
+Usage:
+python benchmarks/conversions.py [--sizes 1000 10000 100000] [--samples 1 10] [--formats decon varank]
+                                 [--processes 1 2 4] [--output results.json] [--compare previous_results.json]
+
+Each conversion runs in a new process, so that its peak RSS is measured alone.
+Results (seconds, rows/sec, peak RSS) are written to a JSON file, along with the git commit.
+With --compare, the ratio to the results of another run (e.g. on a previous commit) is printed:
+ratio > 1 means the current commit is slower.
+With several --processes values, tsv and annotsv conversions are also run with
+convert --processes N (see variantconvert/sharding.py), to measure their scaling.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from os.path import join as osj
+
+import generators
+
+REPO = os.path.abspath(osj(os.path.dirname(__file__), ".."))
+
+# converter input formats supporting convert --processes
+SHARDED_FORMATS = ("tsv", "annotsv")
+
+# name: (converter input format, config in configs/, multisample format)
+FORMATS = {
+    "decon": ("tsv", "config_decon.json", True),
+    "canoes": ("tsv", "config_canoes_bed.json", True),
+    "annotsv": ("annotsv", "config_annotsv3.json", True),
+    "annotsv_bed": ("annotsv", "config_annotsv3_from_bed.json", True),
+    "varank": ("varank", "config_varank.json", False),
+    "starfusion": ("breakpoints", "config_starfusion.json", False),
+    "arriba": ("breakpoints", "config_arriba.json", False),
+}
+
+
+def generate_input(name, directory, rows, samples):
+    """
+    Returns (input file, coordinates conversion file or None)
+    """
+    path = osj(directory, name + ".tsv")
+    if name == "decon":
+        return generators.write_decon(path, rows, n_samples=samples), None
+    if name == "canoes":
+        return generators.write_canoes_bed(path, rows, n_samples=samples), None
+    if name == "annotsv":
+        return generators.write_annotsv(path, rows, n_samples=samples), None
+    if name == "annotsv_bed":
+        return (
+            generators.write_annotsv(path, rows, n_samples=samples, from_bed=True),
+            None,
+        )
+    if name == "varank":
+        files, coords_file = generators.write_varank(directory, rows, n_samples=1)
+        return files[0], coords_file
+    if name == "starfusion":
+        return generators.write_starfusion(path, rows), None
+    if name == "arriba":
+        return generators.write_arriba(path, rows), None
+    raise ValueError("Unknown benchmark format: " + name)
+
+
+def count_rows(path):
+    """
+    data lines: without the ## comments and the column names
+    """
+    with open(path, "rb") as f:
+        return sum(1 for line in f if not line.startswith(b"##")) - 1
+
+
+def run_conversion(
+    queue, input_format, input_file, config, output, coords_file, processes
+):
+    """
+    Runs in its own process: puts (seconds, peak RSS in MB) in the queue
+    """
+    sys.path.insert(0, osj(REPO, "variantconvert"))
+    from converter_factory import ConverterFactory
+
+    # converters' own output (debug prints, warnings) would be mixed with the results
+    sys.stdout = open(os.devnull, "w")
+    sys.stderr = sys.stdout
+
+    converter = ConverterFactory().get_converter(input_format, "vcf", config)
+    if coords_file is not None:
+        converter.set_coord_conversion_file(coords_file)
+    converter.set_processes(processes)
+    start = time.perf_counter()
+    converter.convert(input_file, output)
+    seconds = time.perf_counter() - start
+    # kilobytes on Linux, bytes on macOS ; worker processes are not included
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak_rss /= 1024
+    queue.put((seconds, peak_rss / 1024))
+
+
+def measure(input_format, input_file, config, output, coords_file, processes=1):
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(
+        target=run_conversion,
+        args=(queue, input_format, input_file, config, output, coords_file, processes),
+    )
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError("Conversion failed: " + input_file)
+    return queue.get()
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=REPO,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous_path):
+    with open(previous_path, "r") as f:
+        previous = {
+            (r["format"], r["rows"], r["samples"], r.get("processes", 1)): r
+            for r in json.load(f)["results"]
+        }
+    print("format\trows\tsamples\tprocesses\ttime ratio\tpeak RSS ratio")
+    for r in results:
+        old = previous.get((r["format"], r["rows"], r["samples"], r["processes"]))
+        if old is None:
+            continue
+        print(
+            "%s\t%d\t%d\t%d\t%.2f\t%.2f"
+            % (
+                r["format"],
+                r["rows"],
+                r["samples"],
+                r["processes"],
+                r["seconds"] / old["seconds"],
+                r["peak_rss_mb"] / old["peak_rss_mb"],
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 100000],
+        help="number of generated rows (variants for annotsv) [default: 1000 10000 100000]",
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        nargs="+",
+        default=[1, 10],
+        help="number of samples of multisample formats [default: 1 10]",
+    )
+    parser.add_argument(
+        "--formats", nargs="+", default=list(FORMATS), choices=list(FORMATS)
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        nargs="+",
+        default=[1],
+        help="convert --processes values, only used by tsv and annotsv formats [default: 1]",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="runs per benchmark, the fastest one is kept",
+    )
+    parser.add_argument(
+        "--output", default="benchmark_results.json", help="JSON results file"
+    )
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fasta = generators.write_fasta(osj(tmp_dir, "genome.fa"))
+        print("format\trows\tsamples\tprocesses\tseconds\trows/sec\tpeak RSS (MB)")
+        for name in args.formats:
+            input_format, config_name, multisample = FORMATS[name]
+            config = generators.write_config(
+                osj(REPO, "configs", config_name), osj(tmp_dir, config_name), fasta
+            )
+            for rows in args.sizes:
+                for samples in args.samples if multisample else [1]:
+                    directory = osj(tmp_dir, "%s_%d_%d" % (name, rows, samples))
+                    os.makedirs(directory)
+                    input_file, coords_file = generate_input(
+                        name, directory, rows, samples
+                    )
+                    n_rows = count_rows(input_file)
+                    for processes in (
+                        args.processes if input_format in SHARDED_FORMATS else [1]
+                    ):
+                        runs = [
+                            measure(
+                                input_format,
+                                input_file,
+                                config,
+                                osj(directory, "output.vcf"),
+                                coords_file,
+                                processes,
+                            )
+                            for _ in range(args.repeat)
+                        ]
+                        seconds = min(r[0] for r in runs)
+                        peak_rss = max(r[1] for r in runs)
+                        results.append(
+                            {
+                                "format": name,
+                                "rows": rows,
+                                "samples": samples,
+                                "processes": processes,
+                                "input_rows": n_rows,
+                                "seconds": seconds,
+                                "rows_per_sec": n_rows / seconds,
+                                "peak_rss_mb": peak_rss,
+                            }
+                        )
+                        print(
+                            "%s\t%d\t%d\t%d\t%.3f\t%.0f\t%.1f"
+                            % (
+                                name,
+                                rows,
+                                samples,
+                                processes,
+                                seconds,
+                                n_rows / seconds,
+                                peak_rss,
+                            )
+                        )
+                    # keeps the temporary folder small with large sizes
+                    for f in os.listdir(directory):
+                        os.remove(osj(directory, f))
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "commit": get_git_commit(),
+                "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "results": results,
+            },
+            f,
+            indent=4,
+        )
+    print("Results written to " + args.output)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark of the GENOME backends (pyfaidx vs mmap)
+
+Usage:
+python benchmarks/fasta_backends.py [--fasta hg19.fa] [--lookups 200000]
+
+Without --fasta, a random genome is generated in a temporary folder.
+Measures random single base lookups (genome[contig][pos].seq, what the
+row by row HELPER_FUNCTIONs do) and commons.fetch_reference_bases() (batch helpers).
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import numpy
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "variantconvert"))
+from commons import fetch_reference_bases, get_genome
+
+
+def write_random_fasta(path, n_contigs, contig_length, line_length=60, seed=0):
+    rng = numpy.random.default_rng(seed)
+    alphabet = numpy.frombuffer(b"ACGTacgtN", dtype=numpy.uint8)
+    with open(path, "wb") as f:
+        for i in range(n_contigs):
+            f.write(b">chr" + str(i + 1).encode() + b"\n")
+            seq = alphabet[rng.integers(0, len(alphabet), contig_length)].tobytes()
+            for start in range(0, contig_length, line_length):
+                f.write(seq[start : start + line_length] + b"\n")
+
+
+def random_lookups(genome, n, seed=0):
+    rng = numpy.random.default_rng(seed)
+    contigs = list(genome.keys())
+    chosen = [contigs[i] for i in rng.integers(0, len(contigs), n)]
+    positions = [int(rng.integers(1, len(genome[contig]) + 1)) for contig in chosen]
+    return chosen, positions
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--fasta", help="existing FASTA file (a random one is generated otherwise)"
+    )
+    parser.add_argument(
+        "--lookups", type=int, default=200000, help="number of positions to fetch"
+    )
+    parser.add_argument(
+        "--contigs", type=int, default=5, help="generated genome: number of contigs"
+    )
+    parser.add_argument(
+        "--length", type=int, default=5000000, help="generated genome: contig length"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fasta_path = args.fasta
+        if fasta_path is None:
+            fasta_path = os.path.join(tmp_dir, "genome.fa")
+            write_random_fasta(fasta_path, args.contigs, args.length)
+        contigs, positions = random_lookups(get_genome(fasta_path), args.lookups)
+
+        print("backend\tbenchmark\tseconds\tlookups/sec")
+        results = {}
+        for backend in ("pyfaidx", "mmap"):
+            get_genome.cache_clear()
+            genome = get_genome(fasta_path, backend)
+            elapsed, results[(backend, "scalar")] = timed(
+                lambda: [genome[c][p - 1].seq for c, p in zip(contigs, positions)]
+            )
+            print(
+                "%s\tscalar\t%.3f\t%.0f" % (backend, elapsed, len(positions) / elapsed)
+            )
+            elapsed, results[(backend, "batch")] = timed(
+                lambda: fetch_reference_bases(genome, contigs, positions)
+            )
+            print(
+                "%s\tbatch\t%.3f\t%.0f" % (backend, elapsed, len(positions) / elapsed)
+            )
+        get_genome.cache_clear()
+
+    if len(set(tuple(bases) for bases in results.values())) != 1:
+        raise ValueError("Backends returned different bases")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,466 @@
+# -*- coding: utf-8 -*-
+"""
+Deterministic synthetic inputs for every format variantconvert can read
+Same seed and size -> same file, so benchmark results can be compared between commits.
+Generated files follow the columns expected by the configs in configs/
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import json
+import random
+
+from os.path import join as osj
+
+CONTIGS = [str(i) for i in range(1, 23)] + ["X", "Y", "M"]
+BASES = "ACGT"
+
+
+def write_fasta(path, contig_length=200000, line_width=60, seed=0):
+    """
+    One chr<contig> sequence per contig of CONTIGS
+    """
+    rng = random.Random(seed)
+    with open(path, "w") as f:
+        for contig in CONTIGS:
+            f.write(">chr" + contig + "\n")
+            seq = "".join(rng.choices(BASES, k=contig_length))
+            for i in range(0, contig_length, line_width):
+                f.write(seq[i : i + line_width] + "\n")
+    return path
+
+
+def _pos(rng, contig_length):
+    return rng.randint(1, contig_length - 20000)
+
+
+def write_decon(path, n_rows, n_samples=5, contig_length=200000, seed=1):
+    """
+    DECoN lists variant-sample associations: a CNV spans 1 to 3 lines
+    """
+    rng = random.Random(seed)
+    samples = [
+        "S%04d" % i + (".bwamem" if i % 3 == 0 else "") for i in range(n_samples)
+    ]
+    cols = [
+        "CNV.ID",
+        "Sample",
+        "Correlation",
+        "N.comp",
+        "Start.b",
+        "End.b",
+        "CNV.type",
+        "N.exons",
+        "Start",
+        "End",
+        "Chromosome",
+        "Genomic.ID",
+        "BF",
+        "Reads.expected",
+        "Reads.observed",
+        "Reads.ratio",
+        "Gene",
+    ]
+    with open(path, "w") as f:
+        f.write("\t".join(cols) + "\n")
+        cnv_id = 1
+        while cnv_id <= n_rows:
+            chrom = rng.choice(CONTIGS[:-1])
+            start = _pos(rng, contig_length)
+            end = start + rng.randint(100, 10000)
+            cnv_type = rng.choice(["deletion", "duplication"])
+            carriers = rng.sample(samples, rng.randint(1, min(3, n_samples)))
+            for sample in carriers:
+                if cnv_id > n_rows:
+                    break
+                bf = "%.3f" % rng.uniform(5, 50)
+                observed = rng.randint(10, 2000)
+                expected = rng.randint(10, 2000)
+                gene = rng.choice(["BRCA1", "TTN;TTN-AS1", "", "DMD", "NF1"])
+                f.write(
+                    "\t".join(
+                        [
+                            str(cnv_id),
+                            sample,
+                            "%.4f" % rng.uniform(0.9, 1),
+                            str(rng.randint(5, 10)),
+                            str(rng.randint(1, 500)),
+                            str(rng.randint(500, 900)),
+                            cnv_type,
+                            str(rng.randint(1, 30)),
+                            str(start),
+                            str(end),
+                            chrom,
+                            "chr%s:%d-%d" % (chrom, start, end),
+                            bf if rng.random() > 0.05 else "",
+                            str(expected),
+                            str(observed),
+                            "%.5f" % (observed / expected),
+                            gene,
+                        ]
+                    )
+                    + "\n"
+                )
+                cnv_id += 1
+    return path
+
+
+def write_canoes_bed(path, n_rows, n_samples=5, contig_length=200000, seed=2):
+    rng = random.Random(seed)
+    samples = ["C%04d" % i for i in range(n_samples)]
+    with open(path, "w") as f:
+        f.write(
+            "\t".join(["#Chrom", "Start", "End", "SV type", "Samples_ID", "Q_SOME"])
+            + "\n"
+        )
+        for _ in range(n_rows):
+            chrom = rng.choice(CONTIGS[:22])
+            start = _pos(rng, contig_length)
+            f.write(
+                "\t".join(
+                    [
+                        chrom,
+                        str(start),
+                        str(start + rng.randint(100, 5000)),
+                        rng.choice(["DEL", "DUP"]),
+                        rng.choice(samples),
+                        str(rng.randint(0, 99)),
+                    ]
+                )
+                + "\n"
+            )
+    return path
+
+
+ANNOTSV_ANNOT_COLS = [
+    "Gene_name",
+    "Gene_count",
+    "Tx",
+    "Location",
+    "Frameshift",
+    "OMIM_ID",
+    "GC_content_left",
+    "ACMG_class",
+    "AnnotSV_ranking_criteria",
+]
+
+
+def write_annotsv(
+    path, n_svs, n_samples=3, from_bed=False, contig_length=200000, seed=3
+):
+    """
+    One "full" line per SV, followed by 0 to 3 "split" lines
+    from_bed: AnnotSV run on a BED file (no VCF columns)
+    """
+    rng = random.Random(seed)
+    samples = ["A%03d" % i for i in range(n_samples)]
+    cols = [
+        "AnnotSV_ID",
+        "SV_chrom",
+        "SV_start",
+        "SV_end",
+        "SV_length",
+        "SV_type",
+        "Samples_ID",
+    ]
+    if not from_bed:
+        cols += ["ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT"] + samples
+    cols += ["Annotation_mode"] + ANNOTSV_ANNOT_COLS
+    with open(path, "w") as f:
+        f.write("\t".join(cols) + "\n")
+        for i in range(n_svs):
+            chrom = rng.choice(CONTIGS[:-1])
+            start = _pos(rng, contig_length)
+            end = start + rng.randint(100, 10000)
+            sv_type = rng.choice(["DEL", "DUP"])
+            carriers = rng.sample(samples, rng.randint(1, n_samples))
+            sv_id = "%s_%d_%d_%s_%d" % (chrom, start, end, sv_type, i)
+            base = [
+                sv_id,
+                chrom,
+                str(start),
+                str(end),
+                str(end - start),
+                sv_type,
+                ",".join(carriers),
+            ]
+            if not from_bed:
+                base += [
+                    "sv%d" % i,
+                    "N",
+                    "<%s>" % sv_type,
+                    str(rng.randint(1, 100)),
+                    rng.choice(["PASS", "LowQual"]),
+                    "END=%d;SVTYPE=%s" % (end, sv_type),
+                    "GT:CN",
+                ]
+                base += [
+                    (
+                        "%s:%d" % (rng.choice(["0/1", "1/1"]), rng.randint(0, 4))
+                        if s in carriers
+                        else "./.:."
+                    )
+                    for s in samples
+                ]
+            n_split = rng.randint(0, 3)
+            modes = ["full"] + ["split"] * n_split
+            for mode in modes:
+                annots = [
+                    rng.choice(["GENE%d" % rng.randint(1, 50), ""]),
+                    str(rng.randint(0, 5)),
+                    "NM_%06d" % rng.randint(1, 999999) if mode == "split" else "",
+                    (
+                        rng.choice(["txStart-exon1", "intron2-intron3", ""])
+                        if mode == "split"
+                        else ""
+                    ),
+                    rng.choice(["yes", "no", ""]),
+                    rng.choice(["123456;654321", "", "111111"]),
+                    "%.3f" % rng.uniform(0.3, 0.7),
+                    str(rng.randint(1, 5)) if mode == "full" else "",
+                    "1A;2B" if mode == "full" else "",
+                ]
+                f.write("\t".join(base + [mode] + annots) + "\n")
+    return path
+
+
+VARANK_EXTRA_COLS = [
+    "gene",
+    "geneDesc",
+    "transLen",
+    "cNomen",
+    "pNomen",
+    "rsMAF",
+    "phyloP",
+    "HI_percent",
+    "codingEffect",
+    "gnomadAltFreq_all",
+    "clinVarPhenotypes",
+]
+
+
+def write_varank(directory, n_rows, n_samples=2, seed=4):
+    """
+    n_samples ranking files of n_rows variants each, sharing a VCF_Coordinates_Conversion.tsv
+    Returns (list of ranking files, coordinate conversion file)
+    """
+    rng = random.Random(seed)
+    coords = {}
+    variants = []
+    for i in range(max(n_rows, 1) * 2):
+        chrom = rng.choice(CONTIGS[:-1])
+        pos = rng.randint(1, 150000)
+        ref = rng.choice(BASES)
+        alt = rng.choice([b for b in BASES if b != ref])
+        vid = "%s_%d_%s_%s" % (chrom, pos, ref, alt)
+        if vid in coords:
+            continue
+        coords[vid] = (chrom, pos, ref, alt)
+        variants.append(vid)
+    coord_file = osj(directory, "VCF_Coordinates_Conversion.tsv")
+    with open(coord_file, "w") as f:
+        f.write("variantID\t#CHROM\tPOS\tREF\tALT\n")
+        for vid in variants:
+            c = coords[vid]
+            f.write("%s\t%s\t%d\t%s\t%s\n" % (vid, c[0], c[1], c[2], c[3]))
+
+    cols = [
+        "variantID",
+        "chr",
+        "start",
+        "end",
+        "ref",
+        "alt",
+        "rsId",
+        "QUALphred",
+        "zygosity",
+        "totalReadDepth",
+        "varReadDepth",
+        "varReadPercent",
+        "genes",
+    ] + VARANK_EXTRA_COLS
+    files = []
+    for s in range(n_samples):
+        path = osj(directory, "fam01_SAMPLE%02d_allVariants.rankingByVar.tsv" % s)
+        with open(path, "w") as f:
+            f.write("## Barcode: SAMPLE%02d\n## FamilyBarcode: fam01\n" % s)
+            f.write("\t".join(cols) + "\n")
+            chosen = rng.sample(variants, n_rows)
+            for vid in chosen:
+                chrom, pos, ref, alt = coords[vid]
+                total = rng.randint(10, 300)
+                var = rng.randint(1, total)
+                row = [
+                    vid,
+                    chrom,
+                    str(pos),
+                    str(pos),
+                    ref,
+                    alt,
+                    rng.choice(["rs%d" % rng.randint(1, 10**7), ""]),
+                    "%.2f" % rng.uniform(10, 3000),
+                    rng.choice(["hom", "het"]),
+                    str(total),
+                    str(var),
+                    str(round(var * 100.0 / total)) if rng.random() > 0.05 else "",
+                    rng.choice(["GENE%d" % rng.randint(1, 100), "GENE1"]),
+                    "GENE%d" % rng.randint(1, 100),
+                    "desc; with “quotes” and ‘ticks’",
+                    str(rng.randint(500, 9000)),
+                    "NM_000%d.3:c.%dA>G" % (rng.randint(1, 99), rng.randint(1, 900)),
+                    "p.(Arg%dGly)" % rng.randint(1, 300),
+                    "0,0%d" % rng.randint(1, 99),
+                    "%d,%d" % (rng.randint(-5, 5), rng.randint(0, 999)),
+                    "%d%%" % rng.randint(0, 100),
+                    rng.choice(["missense", "synonymous", ""]),
+                    "%.5f" % rng.uniform(0, 0.01),
+                    rng.choice(["", "Breast-ovarian cancer; familial"]),
+                ]
+                # duplicate lines happen in real Varank files
+                f.write("\t".join(row) + "\n")
+                if rng.random() < 0.02:
+                    f.write("\t".join(row) + "\n")
+        files.append(path)
+    return files, coord_file
+
+
+def write_starfusion(path, n_rows, contig_length=200000, seed=5):
+    rng = random.Random(seed)
+    cols = [
+        "#FusionName",
+        "JunctionReadCount",
+        "SpanningFragCount",
+        "est_J",
+        "est_S",
+        "SpliceType",
+        "LeftGene",
+        "LeftBreakpoint",
+        "RightGene",
+        "RightBreakpoint",
+        "LargeAnchorSupport",
+        "FFPM",
+        "LeftBreakDinuc",
+        "LeftBreakEntropy",
+        "RightBreakDinuc",
+        "RightBreakEntropy",
+        "annots",
+    ]
+    with open(path, "w") as f:
+        f.write("\t".join(cols) + "\n")
+        for _ in range(n_rows):
+            lg, rg = "G%d" % rng.randint(1, 500), "G%d" % rng.randint(1, 500)
+            lc, rc = rng.choice(CONTIGS[:-1]), rng.choice(CONTIGS[:-1])
+            lbp = "chr%s:%d:%s" % (lc, _pos(rng, contig_length), rng.choice("+-"))
+            rbp = "chr%s:%d:%s" % (rc, _pos(rng, contig_length), rng.choice("+-"))
+            f.write(
+                "\t".join(
+                    [
+                        lg + "--" + rg,
+                        str(rng.randint(0, 100)),
+                        str(rng.randint(0, 100)),
+                        "%.2f" % rng.uniform(0, 100),
+                        "%.2f" % rng.uniform(0, 100),
+                        rng.choice(["ONLY_REF_SPLICE", "INCL_NON_REF_SPLICE"]),
+                        lg + "^ENSG%08d.1" % rng.randint(1, 99999),
+                        lbp,
+                        rg + "^ENSG%08d.1" % rng.randint(1, 99999),
+                        rbp,
+                        rng.choice(["YES_LDAS", "NO_LDAS"]),
+                        "%.4f" % rng.uniform(0, 10),
+                        "GT",
+                        "%.4f" % rng.uniform(1, 2),
+                        "AG",
+                        "%.4f" % rng.uniform(1, 2),
+                        '["Mitelman","INTERCHROMOSOMAL[chr%s--chr%s]"]' % (lc, rc),
+                    ]
+                )
+                + "\n"
+            )
+    return path
+
+
+def write_arriba(path, n_rows, contig_length=200000, seed=6):
+    rng = random.Random(seed)
+    cols = [
+        "#gene1",
+        "gene2",
+        "strand1(gene/fusion)",
+        "strand2(gene/fusion)",
+        "breakpoint1",
+        "breakpoint2",
+        "site1",
+        "site2",
+        "type",
+        "split_reads1",
+        "split_reads2",
+        "discordant_mates",
+        "coverage1",
+        "coverage2",
+        "confidence",
+        "reading_frame",
+        "tags",
+        "retained_protein_domains",
+        "closest_genomic_breakpoint1",
+        "closest_genomic_breakpoint2",
+        "gene_id1",
+        "gene_id2",
+        "transcript_id1",
+        "transcript_id2",
+        "direction1",
+        "direction2",
+        "filters",
+        "fusion_transcript",
+    ]
+    with open(path, "w") as f:
+        f.write("\t".join(cols) + "\n")
+        for _ in range(n_rows):
+            lc, rc = rng.choice(CONTIGS[:-1]), rng.choice(CONTIGS[:-1])
+            f.write(
+                "\t".join(
+                    [
+                        "G%d" % rng.randint(1, 500),
+                        "G%d" % rng.randint(1, 500),
+                        "+/+",
+                        "-/-",
+                        "%s:%d" % (lc, _pos(rng, contig_length)),
+                        "%s:%d" % (rc, _pos(rng, contig_length)),
+                        rng.choice(["CDS", "intron", "5'UTR"]),
+                        "exon",
+                        "translocation",
+                        str(rng.randint(0, 50)),
+                        str(rng.randint(0, 50)),
+                        str(rng.randint(0, 50)),
+                        str(rng.randint(0, 500)),
+                        str(rng.randint(0, 500)),
+                        rng.choice(["high", "medium", "low"]),
+                        rng.choice(["in-frame", "out-of-frame", "."]),
+                        ".",
+                        ".",
+                        ".",
+                        ".",
+                        "ENSG%d" % rng.randint(1, 9999),
+                        "ENSG%d" % rng.randint(1, 9999),
+                        "ENST%d" % rng.randint(1, 9999),
+                        "ENST%d" % rng.randint(1, 9999),
+                        rng.choice(["upstream", "downstream"]),
+                        rng.choice(["upstream", "downstream"]),
+                        "duplicates(3);low_entropy(1)",
+                        "ACGT|TTGA",
+                    ]
+                )
+                + "\n"
+            )
+    return path
+
+
+def write_config(src_config, dest_config, fasta_path):
+    """
+    Copy of a config of configs/ using the generated genome
+    """
+    with open(src_config) as f:
+        config = json.load(f)
+    config["GENOME"]["path"] = fasta_path
+    with open(dest_config, "w") as f:
+        json.dump(config, f, indent="\t")
+    return dest_config
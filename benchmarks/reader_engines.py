@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark of the reader engines (see variantconvert/readers.py)
+
+Usage:
+python benchmarks/reader_engines.py [--sizes 100 1000 10000 100000] [--formats decon annotsv varank] [--repeat 3]
+
+Times readers.read_tsv() with each engine on synthetic inputs (see generators.py),
+and prints the fastest engine for each format and size.
+The pyarrow engine is skipped if pyarrow is not installed.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from os.path import join as osj
+
+import generators
+
+REPO = os.path.abspath(osj(os.path.dirname(__file__), ".."))
+sys.path.append(osj(REPO, "variantconvert"))
+from commons import stringify_dataframe
+from readers import READER_ENGINES, read_tsv
+
+FORMATS = {
+    "decon": "config_decon.json",
+    "annotsv": "config_annotsv3.json",
+    "varank": "config_varank.json",
+}
+
+
+def generate_input(name, directory, rows):
+    if name == "decon":
+        return generators.write_decon(osj(directory, "decon.tsv"), rows, n_samples=10)
+    if name == "annotsv":
+        return generators.write_annotsv(
+            osj(directory, "annotsv.tsv"), rows, n_samples=1
+        )
+    if name == "varank":
+        files, _ = generators.write_varank(directory, rows, n_samples=1)
+        return files[0]
+    raise ValueError("Unknown benchmark format: " + name)
+
+
+def get_engines():
+    engines = list(READER_ENGINES)
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        engines.remove("pyarrow")
+    return engines
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[100, 1000, 10000, 100000],
+        help="number of generated rows (variants for annotsv) [default: 100 1000 10000 100000]",
+    )
+    parser.add_argument(
+        "--formats", nargs="+", default=list(FORMATS), choices=list(FORMATS)
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="runs per benchmark, the fastest one is kept",
+    )
+    args = parser.parse_args()
+
+    engines = get_engines()
+    winners = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print("format\trows\tengine\tseconds")
+        for name in args.formats:
+            with open(osj(REPO, "configs", FORMATS[name]), "r") as f:
+                config = json.load(f)
+            for rows in args.sizes:
+                directory = osj(tmp_dir, "%s_%d" % (name, rows))
+                os.makedirs(directory)
+                input_file = generate_input(name, directory, rows)
+                times = {}
+                frames = {}
+                for engine in engines:
+                    runs = []
+                    for _ in range(args.repeat):
+                        start = time.perf_counter()
+                        df = read_tsv(input_file, config, engine)
+                        runs.append(time.perf_counter() - start)
+                    times[engine] = min(runs)
+                    frames[engine] = stringify_dataframe(df.fillna("."))
+                    print("%s\t%d\t%s\t%.4f" % (name, rows, engine, times[engine]))
+                for engine in engines[1:]:
+                    if not frames[engine].equals(frames[engines[0]]):
+                        raise ValueError(
+                            "Engines %s and %s read %s differently"
+                            % (engines[0], engine, input_file)
+                        )
+                winners.append((name, rows, min(times, key=times.get)))
+
+    print("\nformat\trows\tfastest engine")
+    for name, rows, engine in winners:
+        print("%s\t%d\t%s" % (name, rows, engine))
+
+
+if __name__ == "__main__":
+    main()
@@ -18,6 +18,7 @@ project_folder
 For testing purposes, GENOME["path"] was changed in configs. Normally it is:
 "path": "/home1/data/STARK/databases/genomes/current/hg19.fa"
 """
+
 from __future__ import division
 from __future__ import print_function
 
@@ -99,6 +100,110 @@ def test_decon_to_vcf():
     assert os.path.exists(decon_tester.outputFile)
 
 
+def test_tsv_to_vcf_streaming(tmp_path, monkeypatch):
+    import functools
+    import json
+    import pytest
+    import random
+    from commons import merge_sorted_runs
+    from converters import vcf_from_tsv
+
+    with open(
+        osj(os.path.dirname(__file__), "..", "configs", "config_decon.json")
+    ) as f:
+        config = json.load(f)
+    # no reference genome needed
+    config["VCF_COLUMNS"]["REF"] = "Ref"
+
+    random.seed(1)
+    lines = [
+        "\t".join(
+            [
+                "CNV.ID",
+                "Sample",
+                "Correlation",
+                "N.comp",
+                "Start.b",
+                "End.b",
+                "CNV.type",
+                "N.exons",
+            ]
+            + [
+                "Start",
+                "End",
+                "Chromosome",
+                "Genomic.ID",
+                "BF",
+                "Reads.expected",
+                "Reads.observed",
+            ]
+            + ["Reads.ratio", "Ref"]
+        )
+    ]
+    for i in range(60):
+        chrom = random.choice(["1", "2", "10", "X"])
+        start = random.randint(1, 5) * 100
+        cnv_type = random.choice(["deletion", "duplication"])
+        sample = random.choice(["S1", "S2", "S3.bwamem"])
+        fields = [i, sample, 0.99, 5, 1, 2, cnv_type, 3, start, start + 50, chrom]
+        fields += ["chr%s:%d-%d" % (chrom, start, start + 50), 10.5, 100, i, 0.5, "N"]
+        lines.append("\t".join(str(v) for v in fields))
+    tsv = tmp_path / "decon.tsv"
+    tsv.write_text("\n".join(lines) + "\n")
+
+    expected_path = str(tmp_path / "expected.vcf")
+    vcf_from_tsv.VcfFromTsv(config).convert(str(tsv), expected_path)
+    with open(expected_path) as f:
+        expected = f.read()
+
+    # 15 sorted runs of 4 lines, merged 3 by 3
+    monkeypatch.setattr(
+        vcf_from_tsv,
+        "merge_sorted_runs",
+        functools.partial(merge_sorted_runs, fan_in=3),
+    )
+    converter = vcf_from_tsv.VcfFromTsv(config)
+    converter.set_chunksize(4)
+    output_path = str(tmp_path / "streaming.vcf")
+    converter.convert(str(tsv), output_path)
+    with open(output_path) as f:
+        assert f.read() == expected
+    # temporary runs are removed
+    assert sorted(os.listdir(tmp_path)) == [
+        "decon.tsv",
+        "expected.vcf",
+        "streaming.vcf",
+    ]
+
+    converter.set_reader("csv")
+    with pytest.raises(ValueError):
+        converter.convert(str(tsv), output_path)
+
+
+def test_tsv_to_vcf_numeric_info_cleaned(tmp_path):
+    import json
+    from converters.vcf_from_tsv import VcfFromTsv
+
+    with open(
+        osj(os.path.dirname(__file__), "..", "configs", "config_decon.json")
+    ) as f:
+        config = json.load(f)
+    config["VCF_COLUMNS"]["REF"] = "Ref"
+    # N.exons is declared as an Integer, but a ';' makes it a text column
+    tsv = tmp_path / "decon.tsv"
+    tsv.write_text(
+        "CNV.ID\tSample\tCorrelation\tN.comp\tStart.b\tEnd.b\tCNV.type\tN.exons\tStart\tEnd\t"
+        "Chromosome\tGenomic.ID\tBF\tReads.expected\tReads.observed\tReads.ratio\tRef\n"
+        "1\tS1\t0.99\t5\t1\t2\tdeletion\t3;4\t100\t150\t1\tchr1:100-150\t10.5\t100\t50\t0.5\tN\n"
+    )
+    output_path = str(tmp_path / "decon.vcf")
+    VcfFromTsv(config).convert(str(tsv), output_path)
+    with open(output_path) as f:
+        info = [l.split("\t")[7] for l in f if not l.startswith("#")]
+    assert len(info) == 1
+    assert "N.exons=3,4" in info[0].split(";")
+
+
 def test_annotsv_to_vcf():
     annotsv_tester = type(
         "obj",
@@ -131,6 +236,36 @@ def test_annotsv_to_vcf():
     assert os.path.exists(annotsv_tester.outputFile)
 
 
+def test_merge_full_and_split():
+    import json
+    import pandas as pd
+    from converters.vcf_from_annotsv import VcfFromAnnotsv
+
+    with open(
+        osj(os.path.dirname(__file__), "..", "configs", "config_annotsv3.json")
+    ) as f:
+        config = json.load(f)
+    # v2: full and split lines ; v1: full line only ; v3: split lines only
+    df = pd.DataFrame(
+        [
+            ["v2", "full", ".", "exon1"],
+            ["v1", "full", ".", "intron2"],
+            ["v2", "split", "GENE_A", "txStart"],
+            ["v3", "split", "GENE_C", "."],
+            ["v2", "split", "GENE_B", "."],
+            ["v3", "split", "GENE_D", "."],
+        ],
+        columns=["AnnotSV_ID", "Annotation_mode", "Gene_name", "Location"],
+    )
+    merged = VcfFromAnnotsv(config)._merge_full_and_split(df)
+    assert merged.index.tolist() == ["v1", "v2", "v3"]
+    assert merged["has_split"].tolist() == [False, True, True]
+    assert merged["Annotation_mode"].tolist() == ["full", "full&split", "full&split"]
+    # empty full annotations are filled with the split values, in file order
+    assert merged["Gene_name"].tolist() == [".", "GENE_A,GENE_B", "GENE_C,GENE_D"]
+    assert merged["Location"].tolist() == ["intron2", "exon1", ".,."]
+
+
 def test_bed_to_vcf():
     bed_tester = type(
         "obj",
@@ -228,12 +363,19 @@ def test_bed_based_annotsv3_to_vcf():
                 "test.41_SV.annotated.tsv",
             ),
             "outputFile": osj(
-                os.path.dirname(__file__), "..", "..", "examples", "annotsv3_from_bed.vcf"
+                os.path.dirname(__file__),
+                "..",
+                "..",
+                "examples",
+                "annotsv3_from_bed.vcf",
             ),
             "inputFormat": "annotsv",
             "outputFormat": "vcf",
             "configFile": osj(
-                os.path.dirname(__file__), "..", "configs", "config_annotsv3_from_bed.json"
+                os.path.dirname(__file__),
+                "..",
+                "configs",
+                "config_annotsv3_from_bed.json",
             ),
             "verbosity": "debug",
         },
@@ -243,5 +385,500 @@ def test_bed_based_annotsv3_to_vcf():
     assert os.path.exists(breakpoints_tester.outputFile)
 
 
+def test_mmap_fasta_backend(tmp_path):
+    from commons import fetch_reference_bases, get_genome
+
+    fasta_path = str(tmp_path / "genome.fa")
+    with open(fasta_path, "w") as f:
+        f.write(">chr1 description\nACGTacgtNN\nGGCCAATT\n>chr2\nTTTTT\nCCCCC\nAA\n")
+    pyfaidx_genome = get_genome(fasta_path)
+    mmap_genome = get_genome(fasta_path, "mmap", 4, 2)
+    for contig in ("chr1", "chr2"):
+        expected, record = pyfaidx_genome[contig], mmap_genome[contig]
+        assert len(record) == len(expected)
+        for i in range(-len(expected), len(expected) + 3):
+            assert record[i].seq == expected[i].seq
+        for start, end in ((None, None), (0, 5), (3, 11), (-4, None), (7, 100)):
+            assert record[start:end].seq == expected[start:end].seq
+    contigs = ["chr2", "chr1", "chr1", "chr2", "chr1"]
+    positions = [12, 1, "18", 3, 30]
+    assert fetch_reference_bases(
+        mmap_genome, contigs, positions
+    ) == fetch_reference_bases(pyfaidx_genome, contigs, positions)
+
+
+def test_varank_sample_records(tmp_path):
+    import json
+    import pandas as pd
+    import pytest
+    from commons import stringify_dataframe
+    from converters.vcf_from_varank import VcfFromVarank
+
+    with open(
+        osj(os.path.dirname(__file__), "..", "configs", "config_varank.json")
+    ) as f:
+        config = json.load(f)
+    coords_file = tmp_path / "VCF_Coordinates_Conversion.tsv"
+    coords_file.write_text(
+        "variantID\t#CHROM\tPOS\tREF\tALT\n"
+        "1_100_A_T\t1\t100\tA\tT\n"
+        "1_200_G_C\t1\t200\tG\tC\n"
+        "2_50_C_G\t2\t50\tC\tG\n"
+    )
+    header = (
+        "## Barcode: S1\n## FamilyBarcode: fam01\n"
+        "variantID\tchr\tstart\tend\tref\talt\trsId\tQUALphred\tzygosity\t"
+        "totalReadDepth\tvarReadDepth\tvarReadPercent\tgenes\tphyloP\n"
+    )
+    varank_tsv = tmp_path / "fam01_S1_allVariants.rankingByVar.tsv"
+    varank_tsv.write_text(
+        header
+        + "1_100_A_T\t1\t100\t100\tA\tT\trs1\t50.00\thet\t20\t5\t25\tGENE1\t-3,274\n"
+        + "2_50_C_G\t2\t50\t50\tC\tG\t.\t12\thet\t10\t4\t40\tGENE2\t1;2\n"
+        + "1_200_G_C\t1\t200\t200\tG\tC\trs2\t30\thom\t30\t30\t\tGENE1\t0,5\n"
+    )
+
+    converter = VcfFromVarank(config)
+    converter.set_coord_conversion_file(str(coords_file))
+    columns = converter.get_vcf_columns(str(varank_tsv))
+    assert converter.sample_name == "S1"
+    assert columns["variantID"] == ["1_100_A_T", "1_200_G_C", "2_50_C_G"]
+    assert columns["#CHROM"] == ["chr1", "chr1", "chr2"]
+    assert columns["POS"] == ["100", "200", "50"]
+    assert columns["ID"] == ["rs1", "rs2", "."]
+    assert columns["FORMAT"] == ["GT:DP:AD:VAF:GMC"] * 3
+    # GT:DP:AD:VAF:GMC, the VAF of the hom variant is missing, GENE1 has 2 variants
+    assert columns["SAMPLE"] == [
+        "0/1:20:15,5:0.25:2",
+        "1/1:30:0,30:.:2",
+        "0/1:10:6,4:0.4:1",
+    ]
+    # Float column: french commas become dots, and ';' is cleaned
+    assert [info.split(";")[-1] for info in columns["INFO"]] == [
+        "phyloP=-3.274",
+        "phyloP=0.5",
+        "phyloP=1,2",
+    ]
+
+    # AD of depth columns read as text
+    converter.df = pd.DataFrame(
+        {"totalReadDepth": ["20", "7"], "varReadDepth": ["5", "7"]}, dtype=object
+    )
+    assert converter._get_allelic_depths(stringify_dataframe(converter.df)) == [
+        "15,5",
+        "0,7",
+    ]
+
+    varank_tsv.write_text(
+        header + "1_100_A_T\t1\t100\t100\tA\tT\trs1\t50\themi\t20\t5\t25\tGENE1\t1\n"
+    )
+    with pytest.raises(ValueError, match="Unexpected zygosity in Varank file: hemi"):
+        converter.get_sample_records(str(varank_tsv))
+
+
+def test_varank_coords_index(tmp_path):
+    from commons import varank_to_vcf_coords
+
+    coords_file = tmp_path / "VCF_Coordinates_Conversion.tsv"
+    coords_file.write_text(
+        "variantID\t#CHROM\tPOS\tREF\tALT\n"
+        "1_100_A_T\t1\t100\tA\tT\n"
+        "X_5_G_C\tX\t5\tG\tC\n"
+        "1_100_A_T\t1\t101\tA\tG\n"
+    )
+    id_to_coords = varank_to_vcf_coords(str(coords_file))
+    assert os.path.exists(str(coords_file) + ".idx")
+    assert id_to_coords["X_5_G_C"] == {
+        "#CHROM": "chrX",
+        "POS": "5",
+        "REF": "G",
+        "ALT": "C",
+    }
+    # like the dict it replaces, the last duplicate wins
+    assert id_to_coords.get_columns(["1_100_A_T", "X_5_G_C"]) == {
+        "#CHROM": ["chr1", "chrX"],
+        "POS": ["101", "5"],
+        "REF": ["A", "G"],
+        "ALT": ["G", "C"],
+    }
+    assert "2_1_A_T" not in id_to_coords
+
+    # the index is rebuilt when the file changes
+    coords_file.write_text("variantID\t#CHROM\tPOS\tREF\tALT\n2_1_A_T\t2\t1\tA\tT\n")
+    os.utime(str(coords_file), ns=(0, 0))
+    id_to_coords = varank_to_vcf_coords(str(coords_file))
+    assert len(id_to_coords) == 1
+    assert id_to_coords["2_1_A_T"]["POS"] == "1"
+
+
+def test_bgzf_output(tmp_path):
+    import gzip
+
+    from commons import open_output
+
+    header = "##fileformat=VCFv4.3\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+    records = "".join(
+        "chr"
+        + chrom
+        + "\t"
+        + str(pos)
+        + "\t.\tA\tT\t.\tPASS\tEND="
+        + str(pos + 10)
+        + "\n"
+        for chrom in ("1", "2")
+        for pos in range(1, 200000, 7)
+    )
+    output = str(tmp_path / "sorted.vcf.gz")
+    with open_output(output, compression_threads=2) as vcf:
+        vcf.write(header)
+        vcf.write(records)
+    with gzip.open(output, "rt") as f:
+        assert f.read() == header + records
+    assert os.path.exists(output + ".tbi")
+
+    output = str(tmp_path / "unsorted.vcf.gz")
+    with open_output(output) as vcf:
+        vcf.write(header)
+        vcf.write("chr1\t20\t.\tA\tT\t.\tPASS\t.\nchr1\t10\t.\tA\tT\t.\tPASS\t.\n")
+    assert not os.path.exists(output + ".tbi")
+
+
+def test_cohort_builder(tmp_path):
+    from cohort import CohortBuilder
+    from commons import open_output, varank_to_vcf_coords
+
+    config = {
+        "GENOME": {
+            "vcf_header": [
+                "##contig=<ID=chr2,length=10>",
+                "##contig=<ID=chr1,length=10>",
+            ]
+        }
+    }
+    coords_file = tmp_path / "VCF_Coordinates_Conversion.tsv"
+    coords_file.write_text(
+        "variantID\tchr\tpos\tref\talt\nv1\t1\t5\tA\tT\nv2\t2\t8\tA\tG\n"
+    )
+
+    def sample(variants):
+        records = {
+            key: []
+            for key in ["variantID", "ID", "QUAL", "FILTER", "INFO", "FORMAT", "SAMPLE"]
+        }
+        for variant_id, id, qual, gt in variants:
+            for key, value in zip(
+                records, [variant_id, id, qual, "PASS", "DP=1", "GT:DP", gt + ":1"]
+            ):
+                records[key].append(value)
+        return records
+
+    header = [
+        "##fileformat=VCFv4.3",
+        "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS",
+    ]
+    cohort = CohortBuilder(config, varank_to_vcf_coords(str(coords_file)))
+    cohort.add_sample(
+        "S2", header, sample([("v1", "rs1", "30", "1/1"), ("v2", ".", "1", "0/1")])
+    )
+    cohort.add_sample("S1", header, sample([("v1", "rs2", "10", "0/1")]))
+    output = str(tmp_path / "cohort.vcf")
+    with open_output(output) as vcf:
+        cohort.write(vcf)
+    assert vcf.records == 2
+    with open(output) as f:
+        lines = f.read().splitlines()
+    assert lines[1:] == [
+        "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\tS2",
+        "chr2\t8\t.\tA\tG\t1\tPASS\tDP=1\tGT:DP\t./.:.\t0/1:1",
+        "chr1\t5\trs2;rs1\tA\tT\t30\tPASS\tDP=1\tGT:DP\t0/1:1\t1/1:1",
+    ]
+
+
+def test_profiler_report(tmp_path):
+    import json
+
+    from profiling import Profiler
+
+    profiler = Profiler()
+    with profiler.span("ignored"):
+        profiler.count("ignored")
+    profiler.enable()
+    with profiler.span("convert"):
+        with profiler.span("read_csv"):
+            profiler.count("input_rows", 10)
+    profiler.write_report(str(tmp_path / "report.json"))
+    with open(str(tmp_path / "report.json")) as f:
+        report = json.load(f)
+    assert [span["name"] for span in report["spans"]] == ["convert/read_csv", "convert"]
+    assert report["counters"] == {"input_rows": 10}
+
+    # report of a worker process, see sharding.convert_shards()
+    worker = Profiler()
+    worker.enable()
+    with worker.span("shard"):
+        worker.count("input_rows", 5)
+    with profiler.span("sharded_records"):
+        profiler.merge(worker.pop_report())
+        profiler.merge(
+            {"spans": [{"name": "shard", "calls": 2, "seconds": 0.5}], "counters": {}}
+        )
+    assert worker.get_report() == {"spans": [], "counters": {}}
+    report = profiler.get_report()
+    assert [
+        span["calls"]
+        for span in report["spans"]
+        if span["name"] == "sharded_records/shard"
+    ] == [3]
+    assert report["counters"] == {"input_rows": 15}
+
+
+def test_cli_startup():
+    import subprocess
+
+    main_path = os.path.join(
+        os.path.dirname(__file__), "..", "variantconvert", "__main__.py"
+    )
+    # converters and their dependencies are only imported when a conversion needs them
+    code = (
+        "import runpy, sys; runpy.run_path(sys.argv[1], run_name='cli'); "
+        "assert 'pandas' not in sys.modules and 'converters' not in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code, main_path], check=True)
+
+    subprocess.run(
+        [sys.executable, main_path, "--help"], check=True, stdout=subprocess.DEVNULL
+    )
+
+    from converter_factory import ConverterFactory
+    from converters.vcf_from_tsv import VcfFromTsv
+
+    factory = ConverterFactory()
+    assert factory.get_converter_class("tsv", "vcf") is VcfFromTsv
+    factory.register_converter("custom", "vcf", "converters.vcf_from_tsv:VcfFromTsv")
+    assert factory.get_converter_class("custom", "vcf") is VcfFromTsv
+
+
+def test_contig_sort_order():
+    from commons import get_contig_order, get_sort_order
+
+    contig_order = get_contig_order(
+        [
+            "##contig=<ID=chr2,length=10>",
+            "##contig=<ID=chr10,length=10>",
+            "##contig=<ID=chr1,length=10>",
+        ]
+    )
+    assert contig_order == {"chr2": 0, "chr10": 1, "chr1": 2}
+    contigs = ["chr1", "unknown", "10", "chr2", "chr1", "chr2"]
+    positions = ["5", "1", "3", 7, "2", "7"]
+    assert get_sort_order(contigs, positions, contig_order).tolist() == [
+        3,
+        5,
+        2,
+        4,
+        0,
+        1,
+    ]
+
+
+def test_read_tsv_categoricals(tmp_path):
+    import pandas as pd
+    from commons import stringify_dataframe
+    from readers import read_tsv
+
+    tsv = tmp_path / "input.tsv"
+    rows = ["chrom\tpos\tsample\tgene\tscore\tid"]
+    rows += [
+        "chr%d\t%d\tS%d\tGENE%d\t%d,5\tvar%d" % (i % 2 + 1, i, i % 3, i % 2, i, i)
+        for i in range(20)
+    ]
+    rows.append("chr1\t21\t\t\t\tvar21")
+    tsv.write_text("\n".join(rows) + "\n")
+    config = {
+        "GENERAL": {"skip_rows": 0},
+        "VCF_COLUMNS": {
+            "#CHROM": "chrom",
+            "POS": "pos",
+            "SAMPLE": "sample",
+            "INFO": {"SCORE": "score"},
+        },
+        "COLUMNS_DESCRIPTION": {
+            "INFO": {"SCORE": {"Type": "Float", "Description": "."}}
+        },
+    }
+    df = read_tsv(str(tsv), config)
+    assert [col for col in df.columns if df[col].dtype == "category"] == [
+        "chrom",
+        "sample",
+        "gene",
+    ]
+    df.fillna(".", inplace=True)
+    expected = pd.read_csv(str(tsv), sep="\t").fillna(".").astype(str)
+    assert stringify_dataframe(df).equals(expected)
+
+
+def test_reader_engines(tmp_path):
+    import importlib.util
+    from commons import stringify_dataframe
+    from readers import read_tsv
+
+    tsv = tmp_path / "input.tsv"
+    tsv.write_text(
+        "## comment\n"
+        "chrom\tpos\tflag\tdepth\tratio\tempty\tname\tname\tdate\n"
+        'chr1\t10\tTrue\t5\t0.50\t\t"a\tb"\tx\t2021-01-01\n'
+        "chr2\t 20\t\tNA\tinf\t\tN/A\tx\t2021-01-02\n"
+        "\n"
+        "chr1\t30\tfalse\t7\t1e3\t\tc\ty\t2021-01-03\n"
+    )
+    config = {
+        "GENERAL": {"skip_rows": 1},
+        "VCF_COLUMNS": {"#CHROM": "chrom"},
+        "COLUMNS_DESCRIPTION": {},
+    }
+    expected = stringify_dataframe(read_tsv(str(tsv), config, "pandas").fillna("."))
+    assert expected.columns.tolist()[-3:] == ["name", "name.1", "date"]
+    engines = ["csv"]
+    if importlib.util.find_spec("pyarrow") is not None:
+        engines.append("pyarrow")
+    for engine in engines:
+        assert stringify_dataframe(
+            read_tsv(str(tsv), config, engine).fillna(".")
+        ).equals(expected)
+
+
+def test_get_shards():
+    from sharding import get_shard_bounds, get_shards
+
+    contigs = ["chr1"] * 6 + ["chr2"] * 2 + ["chr3"]
+    # chr1 is split in two, other contigs get a shard each
+    assert get_shard_bounds(contigs, 3) == [0, 3, 6, 8]
+    # the variant of rows 1 and 4 goes with its first line
+    keys = ["a", "b", "c", "d", "b", "e", "f", "g", "h"]
+    shards = get_shards(contigs, keys, 3)
+    assert [shard.tolist() for shard in shards] == [[0, 1, 2, 4], [3, 5], [6, 7], [8]]
+    assert [shard.tolist() for shard in get_shards([], None, 3)] == []
+
+
+def test_batch_helper_functions():
+    import pandas as pd
+    import pytest
+    from commons import compile_field
+    from helper_functions import HelperFunctions
+
+    helper = HelperFunctions({})
+    df = pd.DataFrame(
+        {
+            "decon_type": ["deletion", "duplication", "deletion"],
+            "canoes_type": ["DUP", "DEL", "DEL"],
+            "start": ["100", "250", "7"],
+            "end": ["150", "1250", "8"],
+            "sv_type": ["DEL", "INV", "DUP"],
+            "left": ["chr1:100:+", "2:3000:-", "chrX:5:+"],
+            "right": ["chr2:200:-", "chr2:4000:+", "chr1:6:-"],
+        }
+    )
+    calls = [
+        ("get_alt_from_decon", ["decon_type"]),
+        ("get_alt_from_canoes_bed", ["canoes_type"]),
+        ("get_svlen_from_decon", ["start", "end"]),
+        ("get_info_from_annotsv", ["sv_type"]),
+        ("get_alt_for_bed_based_annotsv", ["sv_type"]),
+        ("get_chr_from_breakpoint", ["left", "right"]),
+        ("get_pos_from_breakpoint", ["left", "right"]),
+    ]
+    for name, args in calls:
+        assert helper.get_batch(name) is not None
+        expected = [helper.get(name)(*row) for row in df[args].itertuples(index=False)]
+        assert (
+            compile_field(["HELPER_FUNCTION", name] + args, helper).evaluate(df)
+            == expected
+        )
+
+    with pytest.raises(ValueError, match="Unexpected CNV.type value:inversion"):
+        helper.get_alt_from_decon_batch(pd.Series(["deletion", "inversion"]))
+    with pytest.raises(ValueError, match="Unexpected CNV.type value:deletion"):
+        helper.get_alt_from_canoes_bed_batch(["DEL", "deletion"])
+
+    # a helper without batch version is called row by row
+    helper.dispatcher["get_interval"] = lambda start, end: start + "-" + end
+    field = compile_field(["HELPER_FUNCTION", "get_interval", "start", "end"], helper)
+    assert field.batch_func is None
+    assert field.evaluate(df) == ["100-150", "250-1250", "7-8"]
+
+
+def test_get_multisample_fields():
+    import pandas as pd
+    from commons import compile_config, get_multisample_fields
+    from helper_functions import HelperFunctions
+
+    vcf_columns = {"#CHROM": "", "POS": "", "ID": "", "REF": "", "ALT": "", "QUAL": ""}
+    vcf_columns["FORMAT"] = {"GT": "", "DP": "depth"}
+    vcf_columns["SAMPLE"] = "sample"
+    config = {"VCF_COLUMNS": vcf_columns, "COLUMNS_DESCRIPTION": {}}
+    plan = compile_config(config, HelperFunctions(config))
+    df = pd.DataFrame(
+        {
+            "id": ["v1", "v2", "v1", "v3"],
+            "sample": ["s2", "s1", "s3", "s1"],
+            "depth": ["10", "20", "30", "40"],
+        }
+    )
+    # v3 is not output
+    assert get_multisample_fields(df, ["v2", "v1"], "id", ["s1", "s2", "s3"], plan) == [
+        "0/1:20\t./.:.\t./.:.",
+        "./.:.\t0/1:10\t0/1:30",
+    ]
+
+
+def test_clean_dataframe():
+    import pandas as pd
+    from commons import SEPARATOR_TABLE, clean_column, clean_dataframe, clean_string
+
+    assert clean_string("a;b“c”") == 'a,b"c"'
+    values = ["a;b", "c", "‘d’"]
+    assert clean_column(values) == [clean_string(v) for v in values]
+    # a value containing the join separator
+    assert clean_column(["a\x00;", "b"]) == ["a\x00,", "b"]
+    unchanged = ["a", "b"]
+    assert clean_column(unchanged) is unchanged
+
+    df = pd.DataFrame(
+        {
+            "text": ["a;b", None, "c’"],
+            "category": pd.Categorical(["x;y", "x,y", None]),
+            "number": [1.5, 2.0, 3.0],
+        }
+    )
+    cleaned = clean_dataframe(df, SEPARATOR_TABLE)
+    assert cleaned["text"].tolist() == ["a,b", None, "c’"]
+    # both categories become "x,y"
+    assert cleaned["category"].cat.categories.tolist() == ["x,y"]
+    assert cleaned["category"].tolist()[:2] == ["x,y", "x,y"]
+    assert cleaned["number"].tolist() == [1.5, 2.0, 3.0]
+    assert df["text"].tolist() == ["a;b", None, "c’"]
+
+
+def test_sort_variants():
+    import pandas as pd
+    from commons import sort_variants
+
+    header = ["##contig=<ID=chr%s,length=10>" % c for c in ["1", "2", "10", "X"]]
+    df = pd.DataFrame(
+        {
+            "chrom": [10, 2, None, 1, 2, 1],
+            "pos": [1, 30, 5, 200, 4, None],
+        }
+    )
+    assert sort_variants(df, "chrom", "pos", header).index.tolist() == [
+        3,
+        5,
+        4,
+        1,
+        0,
+        2,
+    ]
+
+
 if __name__ == "__main__":
     test_varank_to_vcf()
@@ -20,16 +20,19 @@ python /home1/L/NGS/BIO_INFO/BIO_INFO_Sam/scripts/tsvConversion/file_converter.p
 Configfile guidelines (JSON)
 ----------------------------
 1)[GENERAL] has 3 important fields.
-	#source format name: will show up in VCF meta fields
-	#skip_rows: how many rows to skip before we reach indexes.
-	This script cannot handle a tsv with unnamed columns (beds are fine)
-	#unique_variant_id: useful in multisample files. List the
-	columns that are needed to uniquely identify a variant.
+    #source format name: will show up in VCF meta fields
+    #skip_rows: how many rows to skip before we reach indexes.
+    This script cannot handle a tsv with unnamed columns (beds are fine)
+    #unique_variant_id: useful in multisample files. List the
+    columns that are needed to uniquely identify a variant.
 2) [VCF_COLUMNS] describe the columns that will go in your VCF
-	key: column name in VCF ; value: column name in source format
+    key: column name in VCF ; value: column name in source format
 3) [COLUMNS_DESCRIPTION] describe the tsv columns
-	Type and Description fields will be used in the VCF header
+    Type and Description fields will be used in the VCF header
 4) read HelperFunctions docstring
+5) [GENOME] path to the reference FASTA, and the contigs for the VCF header.
+    Optional "backend": "pyfaidx" (default) or "mmap" (faster lookups, see mmap_fasta.py)
+    with "block_size" and "cache_blocks" to bound the mmap backend memory use
 
 If you need a place to store variables unrelated to the vcf file (e.g number of CPUs) put them in [GENERAL]
 
@@ -37,32 +40,44 @@ If you need a place to store variables unrelated to the vcf file (e.g number of
 #TODO: add argument mode to deal with an entire folder of varank files (or varank files in general)
 #TODO: refactor with a Variant class and a VCF class
 """
+
 from __future__ import division
 from __future__ import print_function
 
 import argparse
+import logging as log
 import os
 import sys
 
 from os.path import join as osj
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "."))
-from commons import set_log_level
 from converter_factory import ConverterFactory
-from varank_batch import main_varank_batch
+from profiling import PROFILER
+
+# commons and varank_batch load pandas & co: they are only imported by the subcommands
+# needing them, so that --help and argument errors stay fast
 
 
 def main_convert(args):
+    from commons import set_log_level
+
     set_log_level(args.verbosity)
     if args.inputFormat.lower() == "decon":
         raise ValueError(
             "DECON is handled as a TSV conversion. Use 'tsv' as input format"
         )
 
+    profile = getattr(args, "profile", "")
+    cprofile = getattr(args, "cProfile", "")
+    if profile or cprofile:
+        PROFILER.enable(cprofile=bool(cprofile))
+
     factory = ConverterFactory()
-    converter = factory.get_converter(
-        args.inputFormat.lower(), args.outputFormat.lower(), args.configFile
-    )
+    with PROFILER.span("load_config"):
+        converter = factory.get_converter(
+            args.inputFormat.lower(), args.outputFormat.lower(), args.configFile
+        )
 
     if args.inputFormat == "varank":
         if args.coordConversionFile == "":
@@ -75,7 +90,38 @@ def main_convert(args):
             )
         converter.set_coord_conversion_file(args.coordConversionFile)
 
-    converter.convert(args.inputFile, args.outputFile)
+    chunksize = getattr(args, "chunksize", 0)
+    if chunksize > 0:
+        if args.inputFormat.lower() != "tsv":
+            raise ValueError("--chunksize is only implemented for 'tsv' input format")
+        converter.set_chunksize(chunksize)
+
+    processes = getattr(args, "processes", 1)
+    if processes > 1:
+        if args.inputFormat.lower() not in ("tsv", "annotsv"):
+            raise ValueError(
+                "--processes is only implemented for 'tsv' and 'annotsv' input formats"
+            )
+        if chunksize > 0:
+            raise ValueError("--processes can not be used with --chunksize")
+        converter.set_processes(processes)
+
+    if getattr(args, "reader", ""):
+        converter.set_reader(args.reader)
+    converter.set_output_options(
+        getattr(args, "compressionThreads", 1),
+        getattr(args, "indexFormat", "auto"),
+        getattr(args, "outputCompression", "auto"),
+    )
+    with PROFILER.span("convert"):
+        converter.convert(args.inputFile, args.outputFile)
+
+    if profile:
+        PROFILER.write_report(profile)
+        log.info("Wrote profiling report: " + profile)
+    if cprofile:
+        PROFILER.dump_cprofile(cprofile)
+        log.info("Wrote cProfile stats: " + cprofile)
 
 
 def main():
@@ -88,7 +134,11 @@ def main():
         "-i", "--inputFile", type=str, required=True, help="Input file"
     )
     parser_convert.add_argument(
-        "-o", "--outputFile", type=str, required=True, help="Output file"
+        "-o",
+        "--outputFile",
+        type=str,
+        required=True,
+        help="Output file, or - for stdout. Ending it with .gz gives a bgzip compressed VCF, indexed if its records are sorted",
     )
     parser_convert.add_argument(
         "-fi", "--inputFormat", type=str, required=True, help="Input file format"
@@ -110,6 +160,57 @@ def main():
         default="",
         help="Varank coordinate conversion file (only useful if inputFormat=varank)",
     )
+    parser_convert.add_argument(
+        "--chunksize",
+        type=int,
+        default=0,
+        help="Stream the input by chunks of N rows to bound memory usage (only useful if inputFormat=tsv). Chunks are always read with the pandas reader engine, without categorical columns: can not be used with another --reader [default: 0, load the whole file]",
+    )
+    parser_convert.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Build the VCF records in N processes, from shards of the input cut by contig (only useful if inputFormat=tsv or annotsv) [default: 1]",
+    )
+    parser_convert.add_argument(
+        "--compressionThreads",
+        type=int,
+        default=1,
+        help="Number of threads compressing the output (only useful if outputFile ends with .gz) [default: 1]",
+    )
+    parser_convert.add_argument(
+        "--indexFormat",
+        type=str,
+        default="auto",
+        choices=["auto", "tbi", "csi", "none"],
+        help="Index written next to a .gz outputFile: 'auto' is tbi, or csi for positions >= 2^29 [default: auto]",
+    )
+    parser_convert.add_argument(
+        "--profile",
+        type=str,
+        default="",
+        help="Write a report of the time spent in each conversion step, helper function calls and FASTA fetches. JSON if the path ends with .json, TSV otherwise. With --processes, the time of the worker processes is summed under the span converting the shards",
+    )
+    parser_convert.add_argument(
+        "--cProfile",
+        type=str,
+        default="",
+        help="Write cProfile stats of the conversion to this path (readable with python -m pstats)",
+    )
+    parser_convert.add_argument(
+        "--outputCompression",
+        type=str,
+        default="auto",
+        choices=["auto", "bgzf", "gzip", "none"],
+        help="'auto' is bgzf if outputFile ends with .gz or .bgz, none otherwise. gzip output can not be indexed [default: auto]",
+    )
+    parser_convert.add_argument(
+        "--reader",
+        type=str,
+        default="",
+        choices=["pandas", "pyarrow", "csv"],
+        help="Engine reading the input: 'pyarrow' is multithreaded and requires pyarrow, 'csv' only beats pandas on small files (about 1000 rows or less). See benchmarks/reader_engines.py. Overrides the \"reader\" key of the config GENERAL section. Only pandas can be used with --chunksize [default: pandas]",
+    )
 
     parser_batch = subparsers.add_parser(
         "varankBatch", help="convert an entire folder of Varank files"
@@ -138,26 +239,32 @@ def main():
         default=6,
         help="Number of cores for multiprocessing",
     )
+    parser_batch.add_argument(
+        "--maxTasksPerChild",
+        type=int,
+        default=10,
+        help="Number of files converted by a worker process before it is replaced, to limit memory growth [default: 10]",
+    )
     parser_batch.add_argument(
         "-bc",
         "--bcftools",
         type=str,
-        default="bcftools",
-        help="path to bcftools executable [default : 'bcftools']",
+        default=None,
+        help="Deprecated and ignored: samples are merged natively",
     )
     parser_batch.add_argument(
         "-bg",
         "--bgzip",
         type=str,
-        default="bgzip",
-        help="path to bgzip executable [default: 'bgzip']",
+        default=None,
+        help="Deprecated and ignored: output is compressed natively",
     )
     parser_batch.add_argument(
         "-ta",
         "--tabix",
         type=str,
-        default="tabix",
-        help="path to tabix executable [default: 'tabix']",
+        default=None,
+        help="Deprecated and ignored: output ending with .gz is indexed natively",
     )
 
     parser_config = subparsers.add_parser(
@@ -181,10 +288,12 @@ def main():
     if "verbosity" not in args:
         parser.print_help()
     elif "inputVarankDir" in args:
+        from varank_batch import main_varank_batch
+
         main_varank_batch(args)
     else:
         main_convert(args)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
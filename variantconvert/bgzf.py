@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+"""
+BGZF (blocked gzip) writer with on the fly tabix (.tbi) / CSI (.csi) indexing
+Same output format as bgzip + tabix, see https://samtools.github.io/hts-specs/SAMv1.pdf (section 4.1)
+and https://samtools.github.io/hts-specs/tabix.pdf ; https://samtools.github.io/hts-specs/CSIv1.pdf
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import logging as log
+import os
+import struct
+import zlib
+
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# uncompressed size of a block, same as bgzip
+BLOCK_SIZE = 0xFF00
+EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+INDEX_FORMATS = ("auto", "tbi", "csi", "none")
+
+# tabix binning scheme: 16kb windows, 6 levels. Positions >= 2^29 need a CSI index
+MIN_SHIFT = 14
+TBI_DEPTH = 5
+TBI_MAX_POS = 1 << (MIN_SHIFT + 3 * TBI_DEPTH)
+
+
+def compress_block(data, level=6):
+    """
+    data: at most BLOCK_SIZE bytes -> one complete BGZF block
+    zlib releases the GIL, so several blocks can be compressed in parallel threads
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    header = struct.pack(
+        "<BBBBIBBHBBHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(deflated) + 25
+    )
+    return header + deflated + struct.pack("<II", zlib.crc32(data), len(data))
+
+
+def reg2bin(beg, end, min_shift=MIN_SHIFT, depth=TBI_DEPTH):
+    """
+    Smallest bin containing the 0-based [beg, end) interval
+    """
+    end -= 1
+    level, shift, first = depth, min_shift, ((1 << depth * 3) - 1) // 7
+    while level > 0:
+        if beg >> shift == end >> shift:
+            return first + (beg >> shift)
+        level -= 1
+        shift += 3
+        first -= 1 << level * 3
+    return 0
+
+
+def _bin_first_window(bin, depth):
+    """
+    index of the first linear index window covered by a bin
+    """
+    level = 0
+    parent = bin
+    while parent:
+        parent = (parent - 1) >> 3
+        level += 1
+    return (bin - ((1 << 3 * level) - 1) // 7) << (depth - level) * 3
+
+
+def _compress_binning(bins, depth):
+    """
+    Same as htslib: bins whose chunks span less than 64kb of compressed data are merged into
+    their parent bin (when it exists), then chunks starting in the same BGZF block are merged
+    """
+    for level in range(depth, 0, -1):
+        first = ((1 << 3 * level) - 1) // 7
+        for bin in sorted(b for b in bins if b >= first):
+            chunks = sorted(bins[bin])
+            parent = (bin - 1) >> 3
+            if (chunks[-1][1] >> 16) - (
+                chunks[0][0] >> 16
+            ) < 0x10000 and parent in bins:
+                bins[parent].extend(chunks)
+                del bins[bin]
+    for bin, chunks in bins.items():
+        chunks.sort()
+        merged = [chunks[0]]
+        for start, stop in chunks[1:]:
+            if merged[-1][1] >> 16 >= start >> 16:
+                merged[-1][1] = max(merged[-1][1], stop)
+            else:
+                merged.append([start, stop])
+        bins[bin] = merged
+
+
+def _vcf_interval(fields):
+    """
+    0-based [beg, end) of a VCF record, computed like tabix does:
+    REF length, or INFO/END when present
+    """
+    beg = int(fields[1]) - 1
+    end = beg + max(len(fields[3]), 1) if len(fields) > 3 else beg + 1
+    if len(fields) > 7:
+        info = fields[7]
+        if info.startswith(b"END="):
+            value = info[4:]
+        else:
+            value = info.partition(b";END=")[2]
+        value = value.split(b";", 1)[0]
+        if value.isdigit() and int(value) > beg:
+            end = int(value)
+    return beg, end
+
+
+class TabixIndexer:
+    """
+    Collects the position of each VCF record in the uncompressed stream
+    Records must be grouped by contig and sorted by position, otherwise no index is written
+    """
+
+    def __init__(self):
+        self.names = []
+        self._tids = {}
+        self.sorted = True
+        self.max_end = 0
+        # one entry per record
+        self.tid = array("i")
+        self.beg = array("q")
+        self.end = array("q")
+        self.ustart = array("Q")
+        self.uend = array("Q")
+
+    def add_record(self, line, ustart, uend):
+        if not self.sorted:
+            return
+        fields = line.split(b"\t", 8)
+        name = fields[0].decode("utf-8")
+        try:
+            beg, end = _vcf_interval(fields)
+        except ValueError:
+            # invalid POS: can not be indexed
+            self.sorted = False
+            return
+        tid = self._tids.get(name)
+        if tid is None:
+            tid = len(self.names)
+            self._tids[name] = tid
+            self.names.append(name)
+        elif tid != len(self.names) - 1 or beg < self.beg[-1]:
+            self.sorted = False
+            return
+        self.max_end = max(self.max_end, end)
+        self.tid.append(tid)
+        self.beg.append(beg)
+        self.end.append(end)
+        self.ustart.append(ustart)
+        self.uend.append(uend)
+
+    def write(self, path, block_offsets, index_format="auto"):
+        """
+        block_offsets: compressed offset of each BGZF block, used to turn
+        uncompressed positions into virtual offsets
+        Returns the path of the index, or None if the records were not sorted
+        """
+        if not self.sorted:
+            return None
+        if index_format == "auto":
+            index_format = "tbi" if self.max_end <= TBI_MAX_POS else "csi"
+        if index_format == "tbi" and self.max_end > TBI_MAX_POS:
+            raise ValueError(
+                "Positions above "
+                + str(TBI_MAX_POS)
+                + " can not be indexed with tabix: use a CSI index"
+            )
+        depth = TBI_DEPTH
+        if index_format == "csi":
+            max_len, size = self.max_end + 256, 1 << MIN_SHIFT
+            depth = 0
+            while max_len > size:
+                depth += 1
+                size <<= 3
+
+        def voffset(u):
+            return (block_offsets[u // BLOCK_SIZE] << 16) | (u % BLOCK_SIZE)
+
+        # tabix configuration: VCF preset
+        names = b"".join(name.encode("utf-8") + b"\0" for name in self.names)
+        aux = (
+            struct.pack("<iiiiii", 2, 1, 2, 0, ord("#"), 0)
+            + struct.pack("<i", len(names))
+            + names
+        )
+
+        refs = []
+        i = 0
+        n = len(self.tid)
+        for tid in range(len(self.names)):
+            bins = {}
+            linear = []
+            first = i
+            while i < n and self.tid[i] == tid:
+                beg, end = self.beg[i], self.end[i]
+                start, stop = voffset(self.ustart[i]), voffset(self.uend[i])
+                chunks = bins.setdefault(reg2bin(beg, end, MIN_SHIFT, depth), [])
+                # merge with the previous chunk when they touch, or share a BGZF block
+                if chunks and chunks[-1][1] >> 16 >= start >> 16:
+                    chunks[-1][1] = stop
+                else:
+                    chunks.append([start, stop])
+                # linear index: offset of the first record overlapping each 16kb window
+                # windows without records get the offset of the previous one (first record for leading ones)
+                while len(linear) < beg >> MIN_SHIFT:
+                    linear.append(linear[-1] if linear else start)
+                while len(linear) <= (end - 1) >> MIN_SHIFT:
+                    linear.append(start)
+                i += 1
+            pseudo_bin = ((1 << 3 * (depth + 1)) - 1) // 7 + 1
+            _compress_binning(bins, depth)
+            # pseudo-bin with the range of offsets and the number of records of this contig
+            bins[pseudo_bin] = [
+                [voffset(self.ustart[first]), voffset(self.uend[i - 1])],
+                [i - first, 0],
+            ]
+            refs.append((bins, linear))
+
+        data = bytearray()
+        if index_format == "tbi":
+            data += b"TBI\1" + struct.pack("<i", len(self.names)) + aux
+        else:
+            data += b"CSI\1" + struct.pack("<iii", MIN_SHIFT, depth, len(aux)) + aux
+            data += struct.pack("<i", len(self.names))
+        for bins, linear in refs:
+            data += struct.pack("<i", len(bins))
+            for bin in sorted(bins):
+                chunks = bins[bin]
+                data += struct.pack("<I", bin)
+                if index_format == "csi":
+                    loff = 0
+                    if bin < pseudo_bin:
+                        window = _bin_first_window(bin, depth)
+                        loff = linear[window] if window < len(linear) else 0
+                    data += struct.pack("<Q", loff)
+                data += struct.pack("<i", len(chunks))
+                for start, stop in chunks:
+                    data += struct.pack("<QQ", start, stop)
+            if index_format == "tbi":
+                data += struct.pack("<i", len(linear))
+                data += struct.pack("<%dQ" % len(linear), *linear)
+        # number of unplaced records
+        data += struct.pack("<Q", 0)
+
+        index_path = path + "." + index_format
+        with open(index_path, "wb") as f:
+            for start in range(0, len(data), BLOCK_SIZE):
+                f.write(compress_block(bytes(data[start : start + BLOCK_SIZE])))
+            f.write(EOF_BLOCK)
+        return index_path
+
+
+class BgzfWriter:
+    """
+    Text file-like object writing BGZF (bgzip compatible) output
+    threads > 1: blocks are compressed in a thread pool, and written in order
+    index_format: "auto" (tbi, or csi for positions >= 2^29), "tbi", "csi" or "none"
+    When records are sorted, the index is built in the same pass and written on close()
+    """
+
+    def __init__(self, path, threads=1, index_format="auto", level=6):
+        if index_format not in INDEX_FORMATS:
+            raise ValueError(
+                "Unknown index format: "
+                + str(index_format)
+                + ". Expected one of: "
+                + ", ".join(INDEX_FORMATS)
+            )
+        self.path = path
+        self.level = level
+        self.index_format = index_format
+        self.index_path = None
+        self._file = open(path, "wb")
+        self._buffer = bytearray()
+        self._offset = 0  # compressed offset of the next block
+        self._block_offsets = array("Q")
+        self._pool = ThreadPoolExecutor(threads) if threads > 1 else None
+        self._max_pending = 4 * threads
+        self._pending = deque()
+
+        self._indexer = TabixIndexer() if index_format != "none" else None
+        self._position = 0  # uncompressed position of self._line
+        self._line = bytearray()  # incomplete last line
+
+        for ext in ("tbi", "csi"):
+            # never leave an index describing a previous version of the file
+            if os.path.exists(path + "." + ext):
+                os.remove(path + "." + ext)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, s):
+        """
+        s: str, or utf-8 encoded bytes
+        """
+        data = s.encode("utf-8") if isinstance(s, str) else bytes(s)
+        if self._indexer is not None:
+            self._index_lines(data)
+        self._buffer += data
+        while len(self._buffer) >= BLOCK_SIZE:
+            self._queue_block(bytes(self._buffer[:BLOCK_SIZE]))
+            del self._buffer[:BLOCK_SIZE]
+        return len(s)
+
+    def _index_lines(self, data):
+        start = 0
+        while True:
+            end = data.find(b"\n", start)
+            if end == -1:
+                self._line += data[start:]
+                return
+            if self._line:
+                line = bytes(self._line) + data[start:end]
+                self._line = bytearray()
+            else:
+                line = data[start:end]
+            if not line.startswith(b"#"):
+                self._indexer.add_record(
+                    line, self._position, self._position + len(line) + 1
+                )
+            self._position += len(line) + 1
+            start = end + 1
+
+    def _queue_block(self, data):
+        if self._pool is None:
+            self._write_block(compress_block(data, self.level))
+            return
+        self._pending.append(self._pool.submit(compress_block, data, self.level))
+        while len(self._pending) > self._max_pending:
+            self._write_block(self._pending.popleft().result())
+
+    def _write_block(self, block):
+        self._block_offsets.append(self._offset)
+        self._file.write(block)
+        self._offset += len(block)
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self._buffer:
+            self._queue_block(bytes(self._buffer))
+            self._buffer = bytearray()
+        while self._pending:
+            self._write_block(self._pending.popleft().result())
+        if self._pool is not None:
+            self._pool.shutdown()
+        # virtual offsets pointing at the end of the data point to the EOF block
+        self._block_offsets.append(self._offset)
+        self._file.write(EOF_BLOCK)
+        self._file.close()
+
+        if self._indexer is not None:
+            if self._line and not self._line.startswith(b"#"):
+                self._indexer.add_record(
+                    bytes(self._line), self._position, self._position + len(self._line)
+                )
+            self.index_path = self._indexer.write(
+                self.path, self._block_offsets, self.index_format
+            )
+            if self.index_path is None:
+                log.warning(
+                    "Records are not sorted by position (or have an invalid POS): no index was written for "
+                    + self.path
+                )
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+
+import logging as log
+import numpy
+import pandas as pd
+
+from commons import get_contig_order, get_sort_order, join_columns
+
+# columns of the records given to CohortBuilder.add_sample(), see VcfFromVarank.get_sample_records()
+RECORD_KEYS = ["variantID", "ID", "QUAL", "FILTER", "INFO", "FORMAT", "SAMPLE"]
+# records written at once by CohortBuilder.write()
+WRITE_BLOCK_SIZE = 10000
+
+
+class CohortBuilder:
+    """
+    Builds a multisample VCF from single sample Varank conversions, in memory
+    Same result as bcftools merge -m none on the single sample VCFs:
+    - samples are sorted by name
+    - records with the same variantID are merged. CHROM, POS, REF and ALT come from
+    VCF_Coordinates_Conversion.tsv (coords). Records are sorted by the contig order of
+    config["GENOME"]["vcf_header"], then by position, then by order in that file
+    - ID: all distinct IDs ; QUAL: the highest one ; FILTER, INFO: from the first sample having the variant
+    - samples without the variant get a missing genotype ("./." and "." for other FORMAT keys)
+    Values are kept as strings: there is no float rounding like in bcftools
+
+    Samples can be added in any order, e.g. as their conversions complete.
+    Only their (variant, sample field) records are kept: ID, QUAL, FILTER, INFO and FORMAT
+    are merged into a single set of values per variant as soon as a sample is added.
+    """
+
+    def __init__(self, config, coords):
+        """
+        coords: commons.varank_to_vcf_coords() of the VCF_Coordinates_Conversion.tsv shared by the samples
+        """
+        self.contig_order = get_contig_order(config["GENOME"]["vcf_header"])
+        self.coords = coords
+        self.headers = {}
+        # sample name: (variant numbers, sample fields)
+        self.records = {}
+        # (variantID, occurrence in the sample): variant number
+        self._variant_numbers = {}
+        # one item per variant
+        self.variant_ids = []
+        self.occurrences = []
+        self.ids = []  # {ID: (sample, position in its ID field)}
+        self.quals = []  # (numeric value, sample, QUAL)
+        self.annotations = []  # (sample, FILTER, INFO, FORMAT)
+
+    def add_sample(self, sample_name, header, records):
+        """
+        header: header lines of the single sample VCF (the last one being the #CHROM line)
+        records: {key: list with one value per line} for the RECORD_KEYS,
+        see VcfFromVarank.get_sample_records()
+        """
+        if sample_name in self.records:
+            raise ValueError("Sample found in more than one input file: " + sample_name)
+        self.headers[sample_name] = header
+
+        variant_ids = records["variantID"]
+        # a sample with the same variant twice gets two records, like bcftools does
+        occurrences = (
+            pd.Series(variant_ids, dtype=object)
+            .groupby(variant_ids, sort=False)
+            .cumcount()
+            .tolist()
+        )
+        first_new = len(self.variant_ids)
+        numbers = [
+            self._variant_numbers.setdefault(key, len(self._variant_numbers))
+            for key in zip(variant_ids, occurrences)
+        ]
+        for row, number in enumerate(numbers):
+            if number >= first_new:
+                self.variant_ids.append(variant_ids[row])
+                self.occurrences.append(occurrences[row])
+                self.ids.append({})
+                self.quals.append(None)
+                self.annotations.append(None)
+
+        quals = (
+            pd.to_numeric(pd.Series(records["QUAL"], dtype=object), errors="coerce")
+            .fillna(-numpy.inf)
+            .tolist()
+        )
+        for row, number in enumerate(numbers):
+            annotation = self.annotations[number]
+            if annotation is not None and annotation[3] != records["FORMAT"][row]:
+                raise ValueError(
+                    "All samples are expected to have the same FORMAT for a given variant"
+                )
+            if annotation is None or sample_name < annotation[0]:
+                self.annotations[number] = (
+                    sample_name,
+                    records["FILTER"][row],
+                    records["INFO"][row],
+                    records["FORMAT"][row],
+                )
+            # highest QUAL, the one of the first sample in case of equality
+            qual = self.quals[number]
+            if (
+                qual is None
+                or quals[row] > qual[0]
+                or (quals[row] == qual[0] and sample_name < qual[1])
+            ):
+                self.quals[number] = (quals[row], sample_name, records["QUAL"][row])
+            # distinct IDs, in order of first appearance in the samples
+            if records["ID"][row] != ".":
+                ids = self.ids[number]
+                for i, variant_id in enumerate(records["ID"][row].split(";")):
+                    if variant_id != "." and (
+                        variant_id not in ids or (sample_name, i) < ids[variant_id]
+                    ):
+                        ids[variant_id] = (sample_name, i)
+
+        self.records[sample_name] = (
+            numpy.array(numbers, dtype=numpy.int64),
+            records["SAMPLE"],
+        )
+
+    def get_sample_list(self):
+        return sorted(self.records)
+
+    def create_vcf_header(self):
+        """
+        Header of the first sample, plus the INFO fields only found in other samples
+        """
+        sample_list = self.get_sample_list()
+        header = self.headers[sample_list[0]][:-1]
+        known_ids = set(l.split(",")[0] for l in header if l.startswith("##INFO=<ID="))
+        last_info = max(
+            [i for i, l in enumerate(header) if l.startswith("##INFO=")]
+            + [len(header) - 1]
+        )
+        extra = []
+        for sample in sample_list[1:]:
+            for l in self.headers[sample]:
+                if l.startswith("##INFO=<ID=") and l.split(",")[0] not in known_ids:
+                    known_ids.add(l.split(",")[0])
+                    extra.append(l)
+        header = header[: last_info + 1] + extra + header[last_info + 1 :]
+        header.append(
+            "\t".join(
+                [
+                    "#CHROM",
+                    "POS",
+                    "ID",
+                    "REF",
+                    "ALT",
+                    "QUAL",
+                    "FILTER",
+                    "INFO",
+                    "FORMAT",
+                ]
+                + sample_list
+            )
+        )
+        return header
+
+    def _get_variant_order(self, coords):
+        """
+        Variant numbers in output order: contig rank, position, then line in VCF_Coordinates_Conversion.tsv
+        """
+        file_order = numpy.lexsort(
+            (numpy.array(self.occurrences), self.coords.get_offsets(self.variant_ids))
+        )
+        order = get_sort_order(
+            [coords["#CHROM"][i] for i in file_order],
+            [coords["POS"][i] for i in file_order],
+            self.contig_order,
+        )
+        return file_order[order]
+
+    def _get_sorted_records(self, ranks):
+        """
+        ranks: output rank of each variant number
+        Returns, in sample order, (output ranks, sample fields) of the records of each sample, sorted by rank
+        """
+        sorted_records = []
+        for sample in self.get_sample_list():
+            numbers, fields = self.records[sample]
+            sample_ranks = ranks[numbers]
+            order = numpy.argsort(sample_ranks, kind="stable")
+            sorted_records.append(
+                (sample_ranks[order], [fields[i] for i in order.tolist()])
+            )
+        return sorted_records
+
+    def _build_lines(self, variants, start, sorted_records, coords):
+        """
+        VCF lines of the variants (numbers) of output ranks start to start + len(variants)
+        """
+        columns = [[coords[key][i] for i in variants] for key in ["#CHROM", "POS"]]
+        columns.append(
+            [
+                (
+                    ";".join(sorted(self.ids[i], key=self.ids[i].get))
+                    if self.ids[i]
+                    else "."
+                )
+                for i in variants
+            ]
+        )
+        columns += [[coords[key][i] for i in variants] for key in ["REF", "ALT"]]
+        columns.append([self.quals[i][2] for i in variants])
+        annotations = [self.annotations[i] for i in variants]
+        columns += [[a[key] for a in annotations] for key in (1, 2, 3)]
+
+        # Samples are placed in a matrix of missing genotypes
+        missing = {}
+        matrix = []
+        for annotation in annotations:
+            if annotation[3] not in missing:
+                missing[annotation[3]] = [
+                    "./." + ":." * annotation[3].count(":")
+                ] * len(sorted_records)
+            matrix.append(missing[annotation[3]].copy())
+        end = start + len(variants)
+        for col, (ranks, fields) in enumerate(sorted_records):
+            first, last = numpy.searchsorted(ranks, [start, end]).tolist()
+            for rank, field in zip(ranks[first:last].tolist(), fields[first:last]):
+                matrix[rank - start][col] = field
+        columns.append(list(map("\t".join, matrix)))
+        return join_columns(columns, "\t")
+
+    def write(self, vcf):
+        """
+        vcf: commons.OutputSink, see commons.open_output()
+        """
+        vcf.write_header(self.create_vcf_header())
+        if not self.records:
+            return
+        coords = self.coords.get_columns(self.variant_ids)
+        order = self._get_variant_order(coords)
+        ranks = numpy.empty(len(order), dtype=numpy.int64)
+        ranks[order] = numpy.arange(len(order))
+        sorted_records = self._get_sorted_records(ranks)
+        for start in range(0, len(order), WRITE_BLOCK_SIZE):
+            variants = order[start : start + WRITE_BLOCK_SIZE].tolist()
+            vcf.write_lines(self._build_lines(variants, start, sorted_records, coords))
+        log.info(
+            "Merged "
+            + str(len(self.records))
+            + " samples: "
+            + str(len(order))
+            + " variants"
+        )
@@ -3,13 +3,25 @@
 from __future__ import division
 from __future__ import print_function
 
+import gzip
+import heapq
 import logging as log
+import numpy
 import os
+import pandas as pd
+import pickle
+import sys
+import tempfile
 import time
 
 from functools import lru_cache
 from pyfaidx import Fasta
 
+from bgzf import BgzfWriter
+from coords_index import CoordsIndex
+from mmap_fasta import MmapFasta, MmapFastaRecord
+from profiling import PROFILER
+
 
 def set_log_level(verbosity):
     configs = {
@@ -50,6 +62,7 @@ def rename_duplicates_in_list(input_list):
             output_list.append(e + "_" + str(elt_counts[e_lower]))
     return output_list
 
+
 def is_helper_func(arg):
     if isinstance(arg, list):
         if arg[0] == "HELPER_FUNCTION":
@@ -62,50 +75,754 @@ def is_helper_func(arg):
     return False
 
 
-@lru_cache
-def get_genome(fasta_path):
-    return Fasta(fasta_path)
+GENOME_BACKENDS = ("pyfaidx", "mmap")
 
 
 @lru_cache
+def get_genome(fasta_path, backend="pyfaidx", block_size=65536, cache_blocks=256):
+    """
+    backend: "pyfaidx" (default) or "mmap" (see mmap_fasta.MmapFasta,
+    block_size and cache_blocks are only used by this one)
+    """
+    if backend == "pyfaidx":
+        return Fasta(fasta_path)
+    if backend == "mmap":
+        return MmapFasta(fasta_path, block_size=block_size, cache_blocks=cache_blocks)
+    raise ValueError(
+        "Unknown GENOME backend: "
+        + str(backend)
+        + ". Expected one of: "
+        + ", ".join(GENOME_BACKENDS)
+    )
+
+
+def open_genome(genome_config):
+    """
+    genome_config: GENOME section of a config file. Optional keys:
+    "backend", and for the mmap backend "block_size" and "cache_blocks"
+    """
+    return get_genome(
+        genome_config["path"],
+        genome_config.get("backend", "pyfaidx"),
+        int(genome_config.get("block_size", 65536)),
+        int(genome_config.get("cache_blocks", 256)),
+    )
+
+
+def fetch_reference_bases(genome, contigs, positions, max_gap=65536, max_span=4194304):
+    """
+    Batch equivalent of genome[contig][position - 1].seq
+    genome: as returned by get_genome() or open_genome()
+    contigs, positions: sequences of equal length (positions are 1-based, int or str)
+
+    Positions are grouped by contig and sorted. Positions closer than max_gap
+    are read together as a single region (at most max_span long),
+    so the FASTA is read once, sequentially, instead of once per position.
+    With the mmap backend, bases are directly read from the mapped file instead.
+    Returns a list of bases, in input order
+    """
+    # casting an object array to int64 calls int() on each value, like the scalar version
+    positions = numpy.asarray(positions, dtype=object).astype(numpy.int64)
+    PROFILER.count("fasta_fetches", len(positions))
+    PROFILER.count("fasta_batch_calls")
+    bases = [""] * len(positions)
+    for contig, indexes in (
+        pd.Series(contigs, dtype=object)
+        .groupby(numpy.asarray(contigs, dtype=object), sort=True)
+        .indices.items()
+    ):
+        record = genome[contig]
+        offsets = positions[indexes] - 1
+        # same as pyfaidx: negative offsets count from the end of the contig
+        offsets[offsets < 0] += len(record)
+        if isinstance(record, MmapFastaRecord):
+            for i, base in zip(indexes, record.get_bases(offsets)):
+                bases[i] = base
+            continue
+        order = numpy.argsort(offsets, kind="stable")
+        offsets = offsets[order]
+        indexes = indexes[order]
+
+        # cut where two consecutive offsets are too far apart or the region gets too long
+        region_start = 0
+        for i in range(1, len(offsets) + 1):
+            if (
+                i < len(offsets)
+                and offsets[i] - offsets[i - 1] <= max_gap
+                and offsets[i] - offsets[region_start] < max_span
+            ):
+                continue
+            first = int(offsets[region_start])
+            seq = record[first : int(offsets[i - 1]) + 1].seq
+            for j in range(region_start, i):
+                k = offsets[j] - first
+                # positions past the end of the contig get an empty base, like pyfaidx
+                bases[indexes[j]] = seq[k] if k < len(seq) else ""
+            region_start = i
+    return bases
+
+
 def varank_to_vcf_coords(coord_conversion_file):
     """
     outside of helper class to avoid caching issues
+    Returns a CoordsIndex, used like a {variantID: {"#CHROM", "POS", "REF", "ALT"}} dict
+    but backed by a memory-mapped index built once next to the file (see coords_index.py)
     """
-    id_to_coords = {}
-    with open(coord_conversion_file, "r") as f:
-        next(f)
-        for l in f:
-            l = l.strip().split("\t")
-            id_to_coords[l[0]] = {
-                "#CHROM": "chr" + l[1],
-                "POS": l[2],
-                "REF": l[3],
-                "ALT": l[4],
-            }
-    return id_to_coords
-
-
-def clean_string(s):
-    """
-    replace characters that will crash bcftools and/or cutevariant
-    those in particular come from Varank files
-
-    NB: the "fmt: off/on" comments are used to prevent black
-    from making the replace dict into a one line mess
-    """
-    # fmt: off
-    replace = {
-        ";": ",",
-        "“": '"',
-        "”": '"',
-        "‘": "'",
-        "’": "'"
-    }
-    # fmt: on
-    for k, v in replace.items():
-        s = s.replace(k, v)
-    return s
+    stat = os.stat(coord_conversion_file)
+    return _open_coords_index(coord_conversion_file, stat.st_size, stat.st_mtime_ns)
+
+
+@lru_cache
+def _open_coords_index(coord_conversion_file, size, mtime_ns):
+    """
+    size and mtime_ns are only part of the cache key: a modified file gets a new index
+    """
+    return CoordsIndex(coord_conversion_file)
+
+
+# characters that will crash bcftools and/or cutevariant, those in particular come from Varank files
+# NB: the "fmt: off/on" comments are used to prevent black
+# from making the replace dict into a one line mess
+# fmt: off
+CLEAN_TABLE = str.maketrans({
+    ";": ",",
+    "“": '"',
+    "”": '"',
+    "‘": "'",
+    "’": "'"
+})
+# fmt: on
+# only the INFO field separator
+SEPARATOR_TABLE = str.maketrans({";": ","})
+# separator of the values translated at once by clean_column()
+_CLEAN_JOIN = "\x00"
+
+
+def clean_string(s, table=CLEAN_TABLE):
+    """
+    replace characters that will crash bcftools and/or cutevariant, see CLEAN_TABLE
+    """
+    return s.translate(table)
+
+
+def clean_column(values, table=CLEAN_TABLE):
+    """
+    clean_string() of a list of strings: they are joined and translated in a single call
+    Returns values itself when no character is replaced
+    """
+    text = _CLEAN_JOIN.join(values)
+    cleaned = text.translate(table)
+    if cleaned == text:
+        return values
+    if text.count(_CLEAN_JOIN) == len(values) - 1:
+        return cleaned.split(_CLEAN_JOIN)
+    # the separator is in the values
+    return [v.translate(table) for v in values]
+
+
+def clean_dataframe(df, table=CLEAN_TABLE):
+    """
+    clean_string() of the text cells of df, column by column:
+    only the categories of categorical columns are translated, numeric columns are left as is
+    Returns a new dataframe
+    """
+    df = df.copy()
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            categories = df[col].cat.categories.tolist()
+            if not all(isinstance(v, str) for v in categories):
+                continue
+            cleaned = clean_column(categories, table)
+            if cleaned is categories:
+                continue
+            # different categories can become the same once cleaned
+            codes, new_categories = pd.factorize(pd.Index(cleaned, dtype=object))
+            new_codes = numpy.append(codes, -1)[df[col].cat.codes.to_numpy()]
+            df[col] = pd.Categorical.from_codes(new_codes, new_categories)
+        elif df[col].dtype == object:
+            values = df[col].tolist()
+            if pd.api.types.infer_dtype(df[col].to_numpy(), skipna=False) == "string":
+                cleaned = clean_column(values, table)
+            else:
+                # only the strings of mixed columns are cleaned
+                rows = [i for i, v in enumerate(values) if isinstance(v, str)]
+                strings = [values[i] for i in rows]
+                cleaned = values.copy()
+                for i, v in zip(rows, clean_column(strings, table)):
+                    cleaned[i] = v
+            if cleaned is not values:
+                df[col] = pd.Series(cleaned, index=df.index, dtype=object)
+    return df
+
+
+def stringify_dataframe(df):
+    """
+    Same as df.astype(str), but the cells of categorical columns point to the string of
+    their category, instead of each getting its own copy
+    """
+    columns = {}
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            # missing values (code -1) take the last item, like astype(str) gives them "nan"
+            categories = numpy.append(
+                df[col].cat.categories.astype(str).to_numpy(dtype=object), "nan"
+            )
+            columns[col] = categories[df[col].cat.codes.to_numpy()]
+        else:
+            columns[col] = df[col].astype(str)
+    return pd.DataFrame(columns, index=df.index)
+
+
+def scan_tsv_dtypes(filepath, skip_rows, chunksize):
+    """
+    First pass of a chunked read: returns the dtypes pandas would have
+    inferred had the whole file been read at once (with low_memory=False).
+    Reading each chunk with these dtypes keeps string representations
+    (e.g "12" vs "12.0") identical to a regular, non-chunked conversion.
+    """
+    kinds = {}
+    for chunk in pd.read_csv(
+        filepath, skiprows=skip_rows, sep="\t", chunksize=chunksize
+    ):
+        for col in chunk.columns:
+            kinds.setdefault(col, set())
+            if chunk[col].notna().any():
+                kinds[col].add(chunk[col].dtype.kind)
+            else:
+                kinds[col].add("empty")
+
+    dtypes = {}
+    for col, col_kinds in kinds.items():
+        has_empty = "empty" in col_kinds
+        col_kinds = col_kinds - {"empty"}
+        if not col_kinds:
+            dtypes[col] = "float64"
+        elif col_kinds == {"b"}:
+            # booleans mixed with missing values end up in an object column
+            dtypes[col] = "boolean" if has_empty else "bool"
+        elif col_kinds <= {"i", "u"} and not has_empty:
+            dtypes[col] = "uint64" if "u" in col_kinds else "int64"
+        elif col_kinds <= {"i", "u", "f"}:
+            dtypes[col] = "float64"
+        else:
+            dtypes[col] = str
+    return dtypes
+
+
+# maximum number of runs merged at once by merge_sorted_runs(): each one is an open file
+MAX_MERGE_FAN_IN = 64
+
+
+def spill_sorted_run(records, tmp_dir, batch_size=1000):
+    """
+    records: iterable of (sort_key, values) tuples, already sorted
+    Pickles them in batches to a temporary file and returns its path
+    """
+    fd, path = tempfile.mkstemp(suffix=".run", dir=tmp_dir)
+    with os.fdopen(fd, "wb") as f:
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) == batch_size:
+                pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+                batch = []
+        if batch:
+            pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def _iter_sorted_run(path):
+    with open(path, "rb") as f:
+        while True:
+            try:
+                batch = pickle.load(f)
+            except EOFError:
+                return
+            for record in batch:
+                yield record
+
+
+def _merge_runs(paths):
+    return heapq.merge(*[_iter_sorted_run(p) for p in paths], key=lambda r: r[0])
+
+
+def merge_sorted_runs(paths, fan_in=MAX_MERGE_FAN_IN):
+    """
+    k-way merge of the runs written by spill_sorted_run()
+    Only one batch per run is held in memory at a time.
+    With more than fan_in runs, groups of fan_in runs are first merged into intermediate runs
+    (written next to them, the merged runs being deleted), so that at most fan_in files are open at once.
+    Runs are merged in order: records with the same key keep the order of the runs.
+    """
+    paths = list(paths)
+    while len(paths) > fan_in:
+        merged = []
+        for i in range(0, len(paths), fan_in):
+            group = paths[i : i + fan_in]
+            if len(group) == 1:
+                merged.append(group[0])
+                continue
+            merged.append(
+                spill_sorted_run(_merge_runs(group), os.path.dirname(group[0]))
+            )
+            for path in group:
+                os.remove(path)
+        paths = merged
+    return _merge_runs(paths)
+
+
+def join_columns(columns, sep):
+    """
+    Element-wise join of equally sized columns of strings (lists are fastest)
+    Returns a list with one joined string per row
+    """
+    return list(map(sep.join, zip(*columns)))
+
+
+def apply_helper_func(func, arg_columns, nrows):
+    """
+    Calls a HELPER_FUNCTION on every row of its argument columns
+    Returns a list of results
+    """
+    if len(arg_columns) == 0:
+        return [func() for i in range(nrows)]
+    return list(map(func, *arg_columns))
+
+
+def get_empty_sample_field(format_config):
+    """
+    <sample> field for samples that do not carry the variant
+    """
+    if "GT" in format_config:
+        if len(format_config) == 1:
+            # there's only GT. Avoid adding a trailing ":"
+            return "./."
+        return "./.:" + ":".join(["." for i in range(len(format_config) - 1)])
+    return ":".join(["." for i in range(len(format_config) - 1)])
+
+
+class FieldPlan:
+    """
+    Where the values of one output field come from:
+    a column of the input, a resolved HELPER_FUNCTION and its argument columns, or a constant
+    batch_func: optional batch version of func, see HelperFunctions.get_batch()
+    """
+
+    def __init__(self, column=None, func=None, args=None, value=None, batch_func=None):
+        self.column = column
+        self.func = func
+        self.batch_func = batch_func
+        self.args = args if args is not None else []
+        self.value = value
+
+    def is_helper(self):
+        return self.func is not None
+
+    def evaluate(self, df):
+        """
+        Returns the values of all rows of df, as a list
+        """
+        if self.func is not None and PROFILER.enabled:
+            PROFILER.count("helper_calls:" + self.func.__name__, len(df.index))
+            with PROFILER.span("helper:" + self.func.__name__):
+                return self._evaluate(df)
+        return self._evaluate(df)
+
+    def _evaluate(self, df):
+        if self.batch_func is not None and len(self.args) > 0:
+            result = self.batch_func(*[df[c] for c in self.args])
+            if hasattr(result, "tolist"):
+                result = result.tolist()
+            else:
+                result = list(result)
+            if len(result) != len(df.index):
+                raise ValueError(
+                    "Batch HELPER_FUNCTION returned "
+                    + str(len(result))
+                    + " values for "
+                    + str(len(df.index))
+                    + " rows"
+                )
+            return result
+        if self.func is not None:
+            args = [df[c].tolist() for c in self.args]
+            return apply_helper_func(self.func, args, len(df.index))
+        if self.column is not None:
+            return df[self.column].tolist()
+        return [self.value] * len(df.index)
+
+
+class ConversionPlan:
+    """
+    Config's VCF_COLUMNS compiled once per conversion, see compile_config()
+
+    main: FieldPlan of #CHROM, POS, ID, REF, ALT, QUAL, FILTER (in that order)
+    info: list of (INFO key, FieldPlan)
+    format_keys, format: FORMAT keys and their FieldPlan, when FORMAT is described key by key
+    format_column: name of a vcf-like FORMAT column, when FORMAT is given as a single column
+    """
+
+    def __init__(self, main, info, format_keys, format, format_column, sample_column):
+        self.main = main
+        self.info = info
+        self.format_keys = format_keys
+        self.format = format
+        self.format_string = ":".join(format_keys)
+        self.format_column = format_column
+        self.sample_column = sample_column
+        if format_keys:
+            self.empty_sample = get_empty_sample_field(format_keys)
+        else:
+            self.empty_sample = None
+
+
+def compile_field(config_value, helper, empty_value="."):
+    if is_helper_func(config_value):
+        # config_value[1] is a function name, config_value[2:] its list of args
+        # the function has to be registered in HelperFunctions
+        return FieldPlan(
+            func=helper.get(config_value[1]),
+            args=config_value[2:],
+            batch_func=helper.get_batch(config_value[1]),
+        )
+    if config_value == "":
+        return FieldPlan(value=empty_value)
+    return FieldPlan(column=config_value)
+
+
+def compile_config(config, helper):
+    """
+    Turns config["VCF_COLUMNS"] into a ConversionPlan so that converters
+    do not interpret the config again for each row
+    helper: HelperFunctions instance used to resolve HELPER_FUNCTION names
+    """
+    vcf_columns = config["VCF_COLUMNS"]
+
+    main = {}
+    for vcf_col in ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL"]:
+        main[vcf_col] = compile_field(vcf_columns[vcf_col], helper)
+    # Cutting-edge FILTER implementation
+    main["FILTER"] = compile_field(vcf_columns.get("FILTER", ""), helper, "PASS")
+
+    info = []
+    for key, val in vcf_columns.get("INFO", {}).items():
+        info.append((key, compile_field(val, helper)))
+
+    format_keys = []
+    format = []
+    format_column = None
+    if isinstance(vcf_columns.get("FORMAT", ""), dict):
+        for key, val in vcf_columns["FORMAT"].items():
+            format_keys.append(key)
+            if key == "GT" and val == "":
+                # no GT column: the variant is always heterozygous
+                format.append(FieldPlan(value="0/1"))
+            else:
+                format.append(compile_field(val, helper))
+    elif vcf_columns.get("FORMAT", "") != "":
+        format_column = vcf_columns["FORMAT"]
+
+    return ConversionPlan(
+        main,
+        info,
+        format_keys,
+        format,
+        format_column,
+        vcf_columns.get("SAMPLE", ""),
+    )
+
+
+def get_info_fields(df, plan):
+    """
+    One column of "key=value" strings per INFO key of the plan, values cleaned with clean_column()
+    Columns declared as numbers are cleaned too: they are often read as text (e.g. "5.7;3.1")
+    """
+    info_columns = []
+    for key, field in plan.info:
+        prefix = clean_string(key + "=")
+        info_columns.append([prefix + v for v in clean_column(field.evaluate(df))])
+    return info_columns
+
+
+def get_sample_fields(df, plan):
+    """
+    One <sample> field per dataframe row: FORMAT values joined with ':'
+    """
+    return join_columns([field.evaluate(df) for field in plan.format], ":")
+
+
+def get_multisample_fields(df, variant_ids, unique_id_col, sample_list, plan):
+    """
+    df: one line per variant-sample association
+    variant_ids: unique IDs of the variants to output, in output order
+    Returns, for each variant, the tab separated <sample> fields of all samples in sample_list
+
+    Fields are placed in a variants x samples matrix of copies of a row of empty sample fields,
+    then each row is joined at once
+    """
+    rows = pd.Index(variant_ids).get_indexer(df[unique_id_col]).tolist()
+    cols = pd.Categorical(df[plan.sample_column], categories=sample_list).codes.tolist()
+    empty_row = [plan.empty_sample] * len(sample_list)
+    matrix = [empty_row.copy() for _ in range(len(variant_ids))]
+    # with several lines for the same variant and sample, the last one is kept
+    for row, col, field in zip(rows, cols, get_sample_fields(df, plan)):
+        # -1: line of a variant or sample that is not output
+        if row >= 0 and col >= 0:
+            matrix[row][col] = field
+    return list(map("\t".join, matrix))
+
+
+OUTPUT_COMPRESSIONS = ("auto", "bgzf", "gzip", "none")
+
+
+class OutputSink:
+    """
+    Output of the converters. Text is gathered in a large buffer, then encoded
+    and written to the target in one call each time buffer_size characters are reached,
+    so the number of system calls does not depend on the number of records.
+
+    Targets: "-" for stdout, or a file, with compression:
+    - "auto": "bgzf" for paths ending with .gz or .bgz, "none" otherwise
+    - "bgzf": bgzip compatible, indexed on the fly when the records are sorted (see bgzf.BgzfWriter)
+    - "gzip": regular gzip, not indexable
+    - "none": plain text
+    Counters: bytes_written (after compression for files), records, flushes, flush_time (seconds)
+    """
+
+    def __init__(
+        self,
+        output_path,
+        compression="auto",
+        compression_threads=1,
+        index_format="auto",
+        buffer_size=1 << 22,
+    ):
+        if compression not in OUTPUT_COMPRESSIONS:
+            raise ValueError(
+                "Unknown output compression: "
+                + str(compression)
+                + ". Expected one of: "
+                + ", ".join(OUTPUT_COMPRESSIONS)
+            )
+        if compression == "auto":
+            compression = "bgzf" if output_path.endswith((".gz", ".bgz")) else "none"
+        self.output_path = output_path
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.index_path = None
+        self.bytes_written = 0
+        self.records = 0
+        self.flushes = 0
+        self.flush_time = 0.0
+        self._chunks = []
+        self._buffered = 0
+        self._stdout = output_path == "-"
+
+        if self._stdout:
+            if compression == "bgzf":
+                raise ValueError(
+                    "BGZF output needs a file: it can not be written to stdout"
+                )
+            self._target = sys.stdout.buffer
+            if compression == "gzip":
+                self._target = gzip.GzipFile(fileobj=sys.stdout.buffer, mode="wb")
+        elif compression == "bgzf":
+            self._target = BgzfWriter(output_path, compression_threads, index_format)
+        elif compression == "gzip":
+            self._target = gzip.open(output_path, "wb")
+        else:
+            self._target = open(output_path, "wb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, s):
+        self._chunks.append(s)
+        self._buffered += len(s)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+        return len(s)
+
+    def write_header(self, lines):
+        self.write("".join(l + "\n" for l in lines))
+
+    def write_lines(self, lines, block_size=100000):
+        """
+        Writes finished records (strings without end of line)
+        """
+        for i in range(0, len(lines), block_size):
+            self.write("\n".join(lines[i : i + block_size]) + "\n")
+        self.records += len(lines)
+
+    def write_block(self, text, records):
+        """
+        Writes <records> finished records already joined in text, each ending with a line break
+        (e.g. built by a worker process, see sharding.py)
+        """
+        self.write(text)
+        self.records += records
+
+    def flush(self):
+        if not self._chunks:
+            return
+        data = "".join(self._chunks).encode("utf-8")
+        self._chunks = []
+        self._buffered = 0
+        start = time.time()
+        self._target.write(data)
+        self.flush_time += time.time() - start
+        self.flushes += 1
+        if self.compression == "none":
+            self.bytes_written += len(data)
+
+    def close(self):
+        if self._target is None:
+            return
+        self.flush()
+        start = time.time()
+        if self._stdout and self.compression == "none":
+            self._target.flush()
+        else:
+            self._target.close()
+            if self._stdout:
+                sys.stdout.buffer.flush()
+        self.flush_time += time.time() - start
+        if self.compression == "bgzf":
+            self.index_path = self._target.index_path
+        if not self._stdout and self.compression != "none":
+            self.bytes_written = os.path.getsize(self.output_path)
+        self._target = None
+        PROFILER.count("output_records", self.records)
+        PROFILER.count("output_bytes", self.bytes_written)
+        PROFILER.count("output_flushes", self.flushes)
+        PROFILER.count("output_flush_seconds", self.flush_time)
+        log.debug(
+            "Wrote "
+            + str(self.records)
+            + " records, "
+            + str(self.bytes_written)
+            + " bytes to "
+            + self.output_path
+            + " in "
+            + str(self.flushes)
+            + " flushes ("
+            + str(round(self.flush_time, 3))
+            + "s)"
+        )
+
+
+def open_output(
+    output_path, compression_threads=1, index_format="auto", compression="auto"
+):
+    """
+    OutputSink for converters' output, see OutputSink for the compression options
+    With the default compression, paths ending with .gz or .bgz get BGZF (bgzip compatible) output,
+    indexed on the fly when the records are sorted (see bgzf.BgzfWriter)
+    """
+    return OutputSink(output_path, compression, compression_threads, index_format)
+
+
+def get_output_sample_name(output_path):
+    """
+    Sample name of mono-sample files without sample column: the output file name
+    (without .gz, so that compressed and plain outputs have the same sample)
+    """
+    name = os.path.basename(output_path)
+    for ext in (".gz", ".bgz"):
+        if name.endswith(ext):
+            return name[: -len(ext)]
+    return name
+
+
+def get_contig_order(vcf_header):
+    """
+    {contig: rank} from the ##contig=<ID=...> lines of a VCF header
+    (config["GENOME"]["vcf_header"]), in their order of appearance
+    """
+    order = {}
+    for line in vcf_header:
+        if line.startswith("##contig=<ID="):
+            contig = line[len("##contig=<ID=") :].split(",")[0].rstrip(">")
+            order.setdefault(contig, len(order))
+    return order
+
+
+# rank of missing contigs: after all others
+MISSING_CONTIG_RANK = numpy.iinfo(numpy.int64).max
+
+
+def _contig_name(contig):
+    # numeric CHROM columns are read as int, or float when they have missing values
+    if isinstance(contig, float) and contig.is_integer():
+        return str(int(contig))
+    return str(contig)
+
+
+def get_contig_ranks(contigs, contig_order, add_unknown=False):
+    """
+    contig_order: {contig: rank}, see get_contig_order()
+    Contigs are matched with or without their "chr" prefix (1 is chr1 in a chr1 header).
+    Contigs missing from contig_order rank after the known ones, in their order of first appearance
+    add_unknown: add those to contig_order, so that they keep the same rank in the next calls
+    (used to sort an input read by chunks)
+    Returns an int64 numpy array
+    """
+    codes, uniques = pd.factorize(pd.Series(contigs, dtype=object))
+    unique_ranks = numpy.empty(len(uniques) + 1, dtype=numpy.int64)
+    next_rank = len(contig_order)
+    for i, contig in enumerate(uniques):
+        name = _contig_name(contig)
+        rank = contig_order.get(name)
+        if rank is None:
+            rank = contig_order.get(
+                name[3:] if name.startswith("chr") else "chr" + name
+            )
+        if rank is None:
+            rank = next_rank
+            next_rank += 1
+            if add_unknown:
+                contig_order[name] = rank
+        unique_ranks[i] = rank
+    # missing values (code -1)
+    unique_ranks[-1] = MISSING_CONTIG_RANK
+    return unique_ranks[codes]
+
+
+def get_position_keys(positions):
+    """
+    float64 sort keys of a POS column: missing or non-numeric positions go last
+    """
+    if not isinstance(positions, pd.Series):
+        positions = pd.Series(list(positions), dtype=object)
+    keys = (
+        pd.to_numeric(positions, errors="coerce").astype("float64").to_numpy(copy=True)
+    )
+    keys[numpy.isnan(keys)] = numpy.inf
+    return keys
+
+
+def get_sort_order(contigs, positions, contig_order):
+    """
+    Indexes sorting records by contig rank (see get_contig_ranks()) then position,
+    with a single numeric sort. Records with the same contig and position keep their order
+    """
+    return numpy.lexsort(
+        (get_position_keys(positions), get_contig_ranks(contigs, contig_order))
+    )
+
+
+def sort_variants(df, chrom_col, pos_col, vcf_header):
+    """
+    Replaces df.sort_values([chrom_col, pos_col]): rows are sorted in VCF order,
+    i.e. in the contig order of vcf_header (config["GENOME"]["vcf_header"]) then by position,
+    instead of the lexical order of the CHROM strings
+    """
+    return df.iloc[
+        get_sort_order(df[chrom_col], df[pos_col], get_contig_order(vcf_header))
+    ]
 
 
 def create_vcf_header(input_path, config, sample_list, breakpoints=False):
@@ -117,7 +834,10 @@ def create_vcf_header(input_path, config, sample_list, breakpoints=False):
 
     # TODO: FILTER is not present in any tool implemented yet
     # so all variants are set to PASS
-    if config["VCF_COLUMNS"]["FILTER"] != "" and config["GENERAL"]["origin"] != "AnnotSV":
+    if (
+        config["VCF_COLUMNS"]["FILTER"] != ""
+        and config["GENERAL"]["origin"] != "AnnotSV"
+    ):
         raise ValueError(
             "Filters are not implemented yet. "
             'Leave config["COLUMNS_DESCRIPTION"]["FILTER"] empty '
@@ -135,9 +855,15 @@ def create_vcf_header(input_path, config, sample_list, breakpoints=False):
         info_dic = config["COLUMNS_DESCRIPTION"]["INFO"]
         if breakpoints:
             if "SVTYPE" not in info_dic.keys():
-                info_dic["SVTYPE"] = {"Type":"String", "Description":"Type of structural variant"}
+                info_dic["SVTYPE"] = {
+                    "Type": "String",
+                    "Description": "Type of structural variant",
+                }
             if "MATEDID" not in info_dic.keys():
-                info_dic["MATEID"] = {"Type":"String", "Description":"ID of mate breakends"}
+                info_dic["MATEID"] = {
+                    "Type": "String",
+                    "Description": "ID of mate breakends",
+                }
 
         for key, dic in info_dic.items():
             header.append(
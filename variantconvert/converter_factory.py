@@ -3,32 +3,67 @@
 from __future__ import division
 from __future__ import print_function
 
-from converters.vcf_from_annotsv import VcfFromAnnotsv
-from converters.vcf_from_bed import VcfFromBed
-from converters.vcf_from_breakpoints import VcfFromBreakpoints
-from converters.vcf_from_tsv import VcfFromTsv
-from converters.vcf_from_varank import VcfFromVarank
+import importlib
+
+# third-party packages can register converters under this entry point group, e.g. in setup.cfg:
+# [options.entry_points]
+# variantconvert.converters =
+#     myformat>vcf = mypackage.my_converter:VcfFromMyFormat
+ENTRY_POINT_GROUP = "variantconvert.converters"
+
+
+def _get_entry_points():
+    from importlib import metadata
+
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        return entry_points.select(group=ENTRY_POINT_GROUP)
+    # python < 3.10
+    return entry_points.get(ENTRY_POINT_GROUP, [])
 
 
 class ConverterFactory:
     """
     Factory pattern implementation
     To add new converters, use register_converter() or add them directly in __init__()
+
+    Converters are registered as "module:Class" paths and only imported when requested,
+    so that the CLI does not load pandas & co for converters it does not use.
+    Converters registered under the "variantconvert.converters" entry point group
+    (named "<source>><dest>") are looked up when no converter is registered for a key.
     """
 
     def __init__(self):
         self._converters = {}
-        self._converters["varank>vcf"] = VcfFromVarank
-        self._converters["annotsv>vcf"] = VcfFromAnnotsv
-        self._converters["bed>vcf"] = VcfFromBed
-        self._converters["tsv>vcf"] = VcfFromTsv
-        self._converters["breakpoints>vcf"] = VcfFromBreakpoints
+        self._converters["varank>vcf"] = "converters.vcf_from_varank:VcfFromVarank"
+        self._converters["annotsv>vcf"] = "converters.vcf_from_annotsv:VcfFromAnnotsv"
+        self._converters["bed>vcf"] = "converters.vcf_from_bed:VcfFromBed"
+        self._converters["tsv>vcf"] = "converters.vcf_from_tsv:VcfFromTsv"
+        self._converters["breakpoints>vcf"] = (
+            "converters.vcf_from_breakpoints:VcfFromBreakpoints"
+        )
 
     def register_converter(self, source_format, dest_format, converter):
+        """
+        converter: a converter class, or its "module:Class" path
+        """
         self._converters[source_format + ">" + dest_format] = converter
 
+    def get_converter_class(self, source_format, dest_format):
+        key = source_format + ">" + dest_format
+        converter = self._converters.get(key)
+        if converter is None:
+            for entry_point in _get_entry_points():
+                if entry_point.name == key:
+                    converter = entry_point.load()
+                    break
+        if converter is None:
+            raise ValueError("Unknown converter: " + key)
+        if isinstance(converter, str):
+            module_name, class_name = converter.split(":")
+            converter = getattr(importlib.import_module(module_name), class_name)
+        self._converters[key] = converter
+        return converter
+
     def get_converter(self, source_format, dest_format, config):
-        converter = self._converters.get(source_format + ">" + dest_format)
-        if not converter:
-            raise ValueError("Unknown converter: " + source_format + ">" + dest_format)
-        return converter(config)
+        return self.get_converter_class(source_format, dest_format)(config)
@@ -9,10 +9,59 @@ from abc import ABC, abstractmethod
 
 
 class AbstractConverter(ABC):
-    def __init__(self, config_filepath):
-        self.config_filepath = config_filepath
-        with open(config_filepath, "r") as f:
-            self.config = json.load(f)
+    def __init__(self, config, config_filepath=None):
+        """
+        config: path of a JSON config file, or the already parsed config (dict)
+        A parsed config is used as is, not copied: it can be shared by several converters
+        (e.g. loaded once per worker process). config_filepath is then only used in logs.
+        """
+        if isinstance(config, dict):
+            self.config_filepath = (
+                config_filepath if config_filepath else "<parsed config>"
+            )
+            self.config = config
+        else:
+            self.config_filepath = config
+            with open(config, "r") as f:
+                self.config = json.load(f)
+        # see set_output_options()
+        self.compression_threads = 1
+        self.index_format = "auto"
+        self.output_compression = "auto"
+        # see set_reader()
+        self.reader = self.config["GENERAL"].get("reader", "pandas")
+        # see set_processes()
+        self.processes = 1
+
+    def set_output_options(
+        self, compression_threads=1, index_format="auto", compression="auto"
+    ):
+        """
+        compression: "auto" (BGZF when the output path ends with .gz or .bgz), "bgzf", "gzip" or "none"
+        see commons.OutputSink
+        The other options are only used for BGZF output:
+        compression_threads: number of threads compressing BGZF blocks
+        index_format: "auto" (tbi, or csi for positions >= 2^29), "tbi", "csi" or "none"
+        The index is only written if the output records are sorted
+        """
+        self.compression_threads = compression_threads
+        self.index_format = index_format
+        self.output_compression = compression
+
+    def set_reader(self, engine):
+        """
+        engine: "pandas", "pyarrow" or "csv", see readers.read_tsv()
+        Overrides config["GENERAL"]["reader"] (default: "pandas")
+        """
+        self.reader = engine
+
+    def set_processes(self, processes):
+        """
+        processes > 1: VCF records are built by a pool of worker processes, from shards
+        of the input cut by contig (see sharding.py). The output is the same.
+        Only used by converters implementing convert_shard()
+        """
+        self.processes = processes
 
     @abstractmethod
     def convert(self, file, output_path):
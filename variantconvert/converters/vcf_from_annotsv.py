@@ -8,13 +8,24 @@ import os
 import pandas as pd
 import sys
 import time
-from natsort import index_natsorted
 
 from converters.abstract_converter import AbstractConverter
 
 sys.path.append("..")
-from commons import create_vcf_header, is_helper_func
+from commons import (
+    SEPARATOR_TABLE,
+    clean_dataframe,
+    compile_config,
+    create_vcf_header,
+    join_columns,
+    open_output,
+    sort_variants,
+    stringify_dataframe,
+)
 from helper_functions import HelperFunctions
+from profiling import PROFILER
+from readers import read_tsv
+from sharding import SHARDS_PER_PROCESS, convert_shards, get_shards
 
 
 class VcfFromAnnotsv(AbstractConverter):
@@ -31,19 +42,19 @@ class VcfFromAnnotsv(AbstractConverter):
     """
 
     def _build_input_dataframe(self):
-        df = pd.read_csv(
-            self.filepath,
-            skiprows=self.config["GENERAL"]["skip_rows"],
-            sep="\t",
-            low_memory=False,
-        )
-        df.sort_values(
-            [self.config["VCF_COLUMNS"]["#CHROM"], self.config["VCF_COLUMNS"]["POS"]],
-            inplace=True,
-        )
-        df.reset_index(drop=True, inplace=True)
+        with PROFILER.span("read_csv"):
+            df = read_tsv(self.filepath, self.config, self.reader)
+        PROFILER.count("input_rows", len(df.index))
+        with PROFILER.span("sort"):
+            df = sort_variants(
+                df,
+                self.config["VCF_COLUMNS"]["#CHROM"],
+                self.config["VCF_COLUMNS"]["POS"],
+                self.config["GENOME"]["vcf_header"],
+            )
+            df.reset_index(drop=True, inplace=True)
         df.fillna(".", inplace=True)
-        df = df.astype(str)
+        df = stringify_dataframe(df)
         log.debug(df)
         return df
 
@@ -62,9 +73,11 @@ class VcfFromAnnotsv(AbstractConverter):
         if self.config["VCF_COLUMNS"]["FORMAT"] == "FORMAT":
             if not set(sample_list).issubset(self.input_df.columns):
                 raise ValueError(
-                    "When using an AnnotSV file generated from a VCF, all samples in '" + samples_col + "' column are expected to "
+                    "When using an AnnotSV file generated from a VCF, all samples in '"
+                    + samples_col
+                    + "' column are expected to "
                     "have their own column in the input AnnotSV file"
-            )
+                )
         return sample_list
 
     def _build_input_annot_df(self):
@@ -82,77 +95,68 @@ class VcfFromAnnotsv(AbstractConverter):
                 df = self.input_df.drop([col], axis=1)
             except KeyError:
                 log.debug(f"Failed to drop column: {col}")
-        df = df.replace(
-            ";", ",", regex=True
-        )  # any ';' in annots will ruin the vcf INFO field
+        # any ';' in annots will ruin the vcf INFO field
+        with PROFILER.span("clean"):
+            df = clean_dataframe(df, SEPARATOR_TABLE)
 
-        #TODO: check if CHROM col is in compliance with config ref genome (chrX or X)
+        # TODO: check if CHROM col is in compliance with config ref genome (chrX or X)
         # if self.config["GENOME"]["vcf_header"][0].startswith("##contig=<ID=chr"):
-        #     if not chrom.startswith 
+        #     if not chrom.startswith
 
-        if self.config["VCF_COLUMNS"]["INFO"]["SV_type"] == "" or self.config["VCF_COLUMNS"]["INFO"]["SV_type"] not in df.columns:
+        if (
+            self.config["VCF_COLUMNS"]["INFO"]["SV_type"] == ""
+            or self.config["VCF_COLUMNS"]["INFO"]["SV_type"] not in df.columns
+        ):
             raise ValueError(
-                "SV_type column is required to turn an AnnotSV file into a VCF. Check if SV_type col is set in config or missing in your file.\n" \
+                "SV_type column is required to turn an AnnotSV file into a VCF. Check if SV_type col is set in config or missing in your file.\n"
                 + "If you generated your AnnotSV file from a bed, AnnotSV option -svtBEDcol is required."
             )
         return df
 
-    def _merge_full_and_split(self, df):
+    def _merge_full_and_split(self, input_annot_df):
         """
-        input: df of a single annotSV_ID ; containing only annotations (no sample/FORMAT data)
-        it can contain full and/or split annotations
-
-        returns a single line dataframe with all annotations merged properly
+        input: df containing only annotations (no sample/FORMAT data)
+        Each annotSV_ID can have one 'full' and zero to many 'split' annotation lines
+
+        returns a dataframe with one line per annotSV_ID (as index, sorted) with all annotations merged properly:
+        - the 'full' line is the base. Without one, all annotations start empty (".")
+        - empty annotations are filled with the 'split' values of the same column, joined by ','
+        - for variants with 'split' lines, the Annotation_mode column is set to the config mode,
+        and the annotations still empty are removed from the INFO field (see has_split column)
         """
         if self.config["GENERAL"]["mode"] != "full&split":
             raise ValueError(
                 "Unexpected value in json config['GENERAL']['mode']: "
                 "only 'full&split' mode is implemented yet."
             )
+        id_col = self.config["VCF_COLUMNS"]["INFO"]["AnnotSV_ID"]
+        mode_col = self.config["VCF_COLUMNS"]["INFO"]["Annotation_mode"]
+        modes = input_annot_df[mode_col]
+        if not modes.isin(("full", "split")).all():
+            raise ValueError("Annotation type is assumed to be only 'full' or 'split'")
+
+        is_full = (modes == "full").to_numpy()
+        full = input_annot_df[is_full]
+        if full[id_col].duplicated().any():
+            raise ValueError(
+                "Each variant is assumed to only have one single line of 'full' annotation"
+            )
+        variant_ids = pd.Index(input_annot_df[id_col].unique()).sort_values()
+        merged = full.set_index(full[id_col].to_numpy()).reindex(
+            variant_ids, fill_value="."
+        )
 
-        annots = {}
-        dfs = {}
-        for type, df_type in df.groupby(
-            self.config["VCF_COLUMNS"]["INFO"]["Annotation_mode"]
-        ):
-            if type not in ("full", "split"):
-                raise ValueError(
-                    "Annotation type is assumed to be only 'full' or 'split'"
-                )
-            dfs[type] = df_type
-
-        # deal with full
-        if "full" not in dfs.keys():
-            # still need to init columns
-            if "split" not in dfs.keys():
-                log.warning(
-                    "Input does not include AnnotSV's 'Annotation_mode' column. This is necessary to know how to deal with annotations. The INFO field will be empty."
-                )
-                return {}
-            for ann in dfs["split"].columns:
-                annots[ann] = "."
-        else:
-            if len(dfs["full"].index) > 1:
-                raise ValueError(
-                    "Each variant is assumed to only have one single line of 'full' annotation"
-                )
-            for ann in dfs["full"].columns:
-                annots[ann] = dfs["full"].loc[df.index[0], ann]
-
-        # deal with split
-        if "split" not in dfs.keys():
-            return annots
-        for ann in dfs["split"].columns:
-            if ann == self.config["VCF_COLUMNS"]["INFO"]["Annotation_mode"]:
-                annots[ann] = self.config["GENERAL"]["mode"]
-                continue
-            if annots[ann] != ".":
-                continue  #'full' annot is always prioritized
-            annots[ann] = ",".join(dfs["split"][ann].tolist())
-
-        # remove empty annots
-        annots = {k: v for k, v in annots.items() if v != "."}
-        return annots
+        split = input_annot_df[~is_full]
+        # a single grouped concatenation for all columns ; keeps the file order within each variant
+        split = (split + ",").groupby(split[id_col].to_numpy(), sort=True).sum()
+        split = split.apply(lambda col: col.str[:-1])
+        has_split = variant_ids.isin(split.index)
+
+        empty = (merged == ".").to_numpy() & has_split[:, None]
+        merged = merged.mask(empty, split.reindex(variant_ids))
+        merged.loc[has_split, mode_col] = self.config["GENERAL"]["mode"]
+        merged["has_split"] = has_split
+        return merged
 
     def _build_info_dic(self):
         """
@@ -161,13 +165,27 @@ class VcfFromAnnotsv(AbstractConverter):
         """
         input_annot_df = self._build_input_annot_df()
         # print(input_annot_df)
-        annots_dic = {}
         id_col = self.config["VCF_COLUMNS"]["INFO"]["AnnotSV_ID"]
-        for variant_id, df_variant in input_annot_df.groupby(id_col):
-            merged_annots = self._merge_full_and_split(df_variant)
-            annots_dic[variant_id] = merged_annots
-        print("annots_dic")
-        print(annots_dic)
+        if (
+            self.config["VCF_COLUMNS"]["INFO"]["Annotation_mode"]
+            not in input_annot_df.columns
+        ):
+            log.warning(
+                "Input does not include AnnotSV's 'Annotation_mode' column. This is necessary to know how to deal with annotations. The INFO field will be empty."
+            )
+            return {variant_id: {} for variant_id in input_annot_df[id_col].unique()}
+
+        merged = self._merge_full_and_split(input_annot_df)
+        keys = merged.columns[:-1].tolist()
+        annots_dic = {}
+        for variant_id, values in zip(merged.index, merged.to_numpy().tolist()):
+            if values.pop():  # has_split
+                annots_dic[variant_id] = {
+                    k: v for k, v in zip(keys, values) if v != "."
+                }
+            else:
+                annots_dic[variant_id] = dict(zip(keys, values))
+        PROFILER.debug("annots_dic:", annots_dic)
         return annots_dic
 
     # TODO: merge this with the other create_vcf_header method if possible
@@ -279,9 +297,32 @@ class VcfFromAnnotsv(AbstractConverter):
             else:
                 col = config_col
             cols.append(col)
-        print("main_cols:", cols)
+        log.debug("main_cols: " + str(cols))
         return cols
 
+    def _build_lines(self, plan, info_dic, id_col):
+        """
+        One VCF line per annotSV_ID, built from the first line of each ID (in input_df order)
+        All columns, including HELPER_FUNCTION ones, are computed at once for all variants
+        """
+        first_rows = self.input_df.drop_duplicates(id_col)
+        columns = [field.evaluate(first_rows) for field in plan.main.values()]
+        columns.append(
+            [
+                ";".join([k + "=" + v for k, v in info_dic[variant_id].items()])
+                for variant_id in first_rows[id_col].tolist()
+            ]
+        )
+        if plan.format_column is not None:
+            for col in [plan.format_column] + self.sample_list:
+                columns.append(first_rows[col].tolist())
+        else:
+            columns.append(
+                ["GT\t" + self.config["GENERAL"]["default_genotype"]]
+                * len(first_rows.index)
+            )
+        return join_columns(columns, "\t")
+
     def convert(self, tsv, output_path):
         """
         Creates and fill the output file.
@@ -298,60 +339,82 @@ class VcfFromAnnotsv(AbstractConverter):
         log.info("Converting to vcf from tsv using config: " + self.config_filepath)
 
         self.filepath = tsv
-        helper = HelperFunctions(self.config)
+        with PROFILER.span("compile_config"):
+            plan = compile_config(self.config, HelperFunctions(self.config))
+        for key, field in plan.info:
+            if field.is_helper():
+                raise ValueError(
+                    "HELPER_FUNCTIONS for INFO fields are not implemented yet for AnnotSV converter"
+                )
 
         self.input_df = self._build_input_dataframe()
         self.sample_list = self._get_sample_list()
         self.main_vcf_cols = self._get_main_vcf_cols()
 
-        info_dic = self._build_info_dic()
+        if self.processes > 1:
+            self._convert_sharded(tsv, output_path)
+            return
+
+        with PROFILER.span("merge_annotations"):
+            info_dic = self._build_info_dic()
         info_keys = set()
         for id, dic in info_dic.items():
             for k in dic:
                 info_keys.add(k)
 
         # create the vcf
-        with open(output_path, "w") as vcf:
+        with open_output(
+            output_path,
+            self.compression_threads,
+            self.index_format,
+            self.output_compression,
+        ) as vcf:
             vcf_header = create_vcf_header(tsv, self.config, self.sample_list)
-            for l in vcf_header:
-                vcf.write(l + "\n")
+            vcf.write_header(vcf_header)
 
             id_col = self.config["VCF_COLUMNS"]["INFO"]["AnnotSV_ID"]
-            self.input_df = self.input_df.iloc[index_natsorted(self.input_df[self.config["VCF_COLUMNS"]["#CHROM"]])]
-
-            for variant_id, df_variant in self.input_df.groupby(id_col, sort=False):
-
-                #fill columns that need a helper func
-                for config_key, config_val in self.config["VCF_COLUMNS"].items():
-                    if config_key == "INFO":
-                        for info_col in self.config["VCF_COLUMNS"][config_key].values():
-                            if is_helper_func(info_col):
-                                raise ValueError("HELPER_FUNCTIONS for INFO fields are not implemented yet for AnnotSV converter")
-                    elif config_key == "FILTER" and config_val == "":
-                        df_variant[config_key] = "PASS"
-                    elif is_helper_func(config_val):
-                        func = helper.get(config_val[1])
-                        args = [df_variant.iloc[0][c] for c in config_val[2:]]
-                        result = func(*args)
-                        df_variant[config_key] = result
-
-                main_cols = "\t".join(df_variant[self.main_vcf_cols].iloc[0].to_list())
-                vcf.write(main_cols + "\t")
-                vcf.write(
-                    ";".join([k + "=" + v for k, v in info_dic[variant_id].items()])
-                    + "\t"
-                )
+            with PROFILER.span("records"):
+                lines = self._build_lines(plan, info_dic, id_col)
+            with PROFILER.span("write"):
+                vcf.write_lines(lines)
 
-                if self.config["VCF_COLUMNS"]["FORMAT"] != "":
-                    sample_cols = "\t".join(
-                        df_variant[
-                            [self.config["VCF_COLUMNS"]["FORMAT"]] + self.sample_list
-                        ]
-                        .iloc[0]
-                        .to_list()
-                    )
-                else:
-                    sample_cols = "GT\t" + self.config["GENERAL"]["default_genotype"]
-
-                vcf.write(sample_cols)
-                vcf.write("\n")
+    def _convert_sharded(self, tsv, output_path):
+        """
+        Same as convert(), with annotations merged and records built by self.processes
+        worker processes: all lines of an annotSV_ID are in the same shard
+        """
+        id_col = self.config["VCF_COLUMNS"]["INFO"]["AnnotSV_ID"]
+        shards = get_shards(
+            self.input_df[self.config["VCF_COLUMNS"]["#CHROM"]],
+            self.input_df[id_col],
+            self.processes * SHARDS_PER_PROCESS,
+        )
+        with open_output(
+            output_path,
+            self.compression_threads,
+            self.index_format,
+            self.output_compression,
+        ) as vcf:
+            vcf_header = create_vcf_header(tsv, self.config, self.sample_list)
+            vcf.write_header(vcf_header)
+            with PROFILER.span("sharded_records"):
+                for text, records in convert_shards(
+                    self,
+                    self.input_df,
+                    shards,
+                    (self.sample_list, self.main_vcf_cols),
+                    self.processes,
+                ):
+                    vcf.write_block(text, records)
+
+    def convert_shard(self, df, plan, context):
+        """
+        VCF lines of a shard of the input, in a worker process (see sharding.py)
+        context: (sample list, main VCF columns) of the whole input
+        """
+        self.input_df = df
+        self.sample_list, self.main_vcf_cols = context
+        info_dic = self._build_info_dic()
+        return self._build_lines(
+            plan, info_dic, self.config["VCF_COLUMNS"]["INFO"]["AnnotSV_ID"]
+        )
@@ -4,36 +4,47 @@ from __future__ import division
 from __future__ import print_function
 
 import logging as log
+import numpy
 import os
-import pandas as pd
 import sys
 
 from converters.abstract_converter import AbstractConverter
 
 sys.path.append("..")
-from commons import create_vcf_header, is_helper_func, clean_string
+from commons import (
+    compile_config,
+    create_vcf_header,
+    get_info_fields,
+    get_multisample_fields,
+    get_contig_order,
+    get_output_sample_name,
+    get_sample_fields,
+    get_sort_order,
+    join_columns,
+    open_output,
+    stringify_dataframe,
+)
 from helper_functions import HelperFunctions
+from profiling import PROFILER
+from readers import read_tsv
 
 
 class VcfFromBreakpoints(AbstractConverter):
     """Made for file formats such as the TSV outputs of STAR-Fusion and ARRIBA.
     Other converters (for now) are not able to generate a VCF containing breakpoints.
-    
+
     Each input line will result in two VCF lines, one for each side of the breakpoint.
     """
+
     def _init_dataframe(self):
-        self.df = pd.read_csv(
-            self.filepath,
-            skiprows=self.config["GENERAL"]["skip_rows"],
-            sep="\t",
-            low_memory=False,
-        )
+        with PROFILER.span("read_csv"):
+            self.df = read_tsv(self.filepath, self.config, self.reader)
+        PROFILER.count("input_rows", len(self.df.index))
         self.df.reset_index(drop=True, inplace=True)
         self.df.fillna(".", inplace=True)
         log.debug(self.df)
-        self.df["__!UNIQUE_VARIANT_ID!__"] = self.df.apply(
-            lambda row: self._get_unique_variant_id(row), axis=1
-        )
+        with PROFILER.span("unique_id"):
+            self.df["__!UNIQUE_VARIANT_ID!__"] = self._get_unique_variant_id(self.df)
         log.debug(self.df)
 
     def _get_sample_list(self):
@@ -44,22 +55,16 @@ class VcfFromBreakpoints(AbstractConverter):
                 sample_list.append(sample)
             return sample_list
         else:
-            return [os.path.basename(self.output_path)]
+            return [get_output_sample_name(self.output_path)]
 
-    def _get_unique_variant_id(self, row):
-        id = []
+    def _get_unique_variant_id(self, df):
+        id = None
         for col in self.config["GENERAL"]["unique_variant_id"]:
-            id.append(str(row[col]))
-        return "_".join(id)
-
-    def _get_unique_id_to_index_list(self, data):
-        id_dic = {}
-        for k, v in data["__!UNIQUE_VARIANT_ID!__"].items():
-            if v not in id_dic:
-                id_dic[v] = [k]
+            if id is None:
+                id = df[col].astype(str)
             else:
-                id_dic[v].append(k)
-        return id_dic
+                id = id + "_" + df[col].astype(str)
+        return id
 
     def convert(self, tsv, output_path):
         log.info("Converting to vcf from annotSV using config: " + self.config_filepath)
@@ -68,144 +73,119 @@ class VcfFromBreakpoints(AbstractConverter):
         self.output_path = output_path
         self._init_dataframe()
         sample_list = self._get_sample_list()
-        helper = HelperFunctions(self.config)
-
-        with open(output_path, "w") as vcf:
+        with PROFILER.span("compile_config"):
+            plan = compile_config(self.config, HelperFunctions(self.config))
+
+        with open_output(
+            output_path,
+            self.compression_threads,
+            self.index_format,
+            self.output_compression,
+        ) as vcf:
             vcf_header = create_vcf_header(tsv, self.config, sample_list, True)
-            for l in vcf_header:
-                vcf.write(l + "\n")
-
-            data = self.df.astype(str).to_dict()
-            # In some variant callers, output files contain a list of variant-sample associations
-            # so the same variant can be on multiple lines
-            # __!UNIQUE_VARIANT_ID!__ allows to identify such variants and only add them to the VCF once
-            already_seen_variants = set()
-            unique_id_to_index_list = self._get_unique_id_to_index_list(data)
-            for i in range(len(data["__!UNIQUE_VARIANT_ID!__"])):
-                if data["__!UNIQUE_VARIANT_ID!__"][i] in already_seen_variants:
-                    continue
-
-                lines = [[], []] # left side of the breakpoint, right side of the breakpoint
-
-                for vcf_col in ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL"]:
-                    col = self.config["VCF_COLUMNS"][vcf_col]
-
-                    if vcf_col == "ID" and col == "":
-                        #special override to name breakends
-                        lines[0].append("bnd_" + str(i*2))
-                        lines[1].append("bnd_" + str(i*2+1))
-                        continue
-
-                    if is_helper_func(col):
-                        # col[1] is a function name, col[2] its list of args
-                        # the function named in col[1] has to be callable from this module
-                        func = helper.get(col[1])
-                        args = [data[c][i] for c in col[2:]]
-                        result = func(*args)
-                        if len(result) != 2:
-                            raise ValueError("HELPER_FUNCTIONS used with vcf_from_breakpoints.py are expected to return a tuple of len 2. Got instead:" + str(result))
-                        lines[0].append(result[0])
-                        lines[1].append(result[1])
-
-                    elif col == "":
-                        lines[0].append(".")
-                        lines[1].append(".")
-                    else:
-                        lines[0].append(data[col][i])
-                        lines[1].append(data[col][i])
-
-                # Cutting-edge FILTER implementation
-                lines[0].append("PASS")
-                lines[1].append("PASS")
-
-                left_info_field = ["SVTYPE=BND", "MATEID=" + "bnd_" + str(i*2+1)]
-                right_info_field = ["SVTYPE=BND", "MATEID=" + "bnd_" + str(i*2)]
-                for vcf_col, tsv_col in self.config["VCF_COLUMNS"]["INFO"].items():
-                    if is_helper_func(tsv_col):
-                        func = helper.get(tsv_col[1])
-                        args = [data[c][i] for c in tsv_col[2:]]
-                        s = vcf_col + "=" + func(*args)
-                    else:
-                        s = vcf_col + "=" + data[tsv_col][i]
-                    left_info_field.append(clean_string(s))
-                    right_info_field.append(clean_string(s))
-                lines[0].append(";".join(left_info_field))
-                lines[1].append(";".join(right_info_field))
-
-                vcf_format_fields = []
-                tsv_format_fields = []
-                for vcf_col, tsv_col in self.config["VCF_COLUMNS"]["FORMAT"].items():
-                    vcf_format_fields.append(vcf_col)
-                    tsv_format_fields.append(tsv_col)
-                lines[0].append(":".join(vcf_format_fields))
-                lines[1].append(":".join(vcf_format_fields))
-
-                # monosample input
-                if len(sample_list) == 1:
-                    sample_field = []
-                    for key, val in self.config["VCF_COLUMNS"]["FORMAT"].items():
-                        if key == "GT" and val == "":
-                            sample_field.append("0/1")
-                            continue
-                        sample_field.append(data[val][index])
-                    lines[0].append(":".join(sample_field))
-                    lines[1].append(":".join(sample_field))
-                # multisample input
-                else:
-                    sample_field_dic = {}
-                    # If the variant exists in other lines in the source file, fetch their sample data now
-                    for index in unique_id_to_index_list[
-                        data["__!UNIQUE_VARIANT_ID!__"][i]
-                    ]:
-                        sample_field = []
-                        for key, val in self.config["VCF_COLUMNS"]["FORMAT"].items():
-                            if key == "GT" and val == "":
-                                sample_field.append("0/1")
-                                continue
-                            sample_field.append(data[val][index])
-                        sample_field_dic[
-                            data[self.config["VCF_COLUMNS"]["SAMPLE"]][index]
-                        ] = ":".join(sample_field)
-
-                    for sample in sample_list:
-                        if sample in sample_field_dic:
-                            lines[0].append(sample_field_dic[sample])
-                            lines[1].append(sample_field_dic[sample])
-                        else:
-                            if "GT" in self.config["VCF_COLUMNS"]["FORMAT"]:
-                                if len(self.config["VCF_COLUMNS"]["FORMAT"]) == 1:
-                                    # there's only GT. Avoid adding a trailing ":"
-                                    empty = "./."
-                                else:
-                                    empty = "./.:" + ":".join(
-                                        [
-                                            "."
-                                            for i in range(
-                                                len(
-                                                    self.config["VCF_COLUMNS"]["FORMAT"]
-                                                )
-                                                - 1
-                                            )
-                                        ]
-                                    )
-                            else:
-                                empty = ":".join(
-                                    [
-                                        "."
-                                        for i in range(
-                                            len(self.config["VCF_COLUMNS"]["FORMAT"])
-                                            - 1
-                                        )
-                                    ]
-                                )
-                            lines[0].append(empty)
-                            lines[1].append(empty)
-                    already_seen_variants.add(data["__!UNIQUE_VARIANT_ID!__"][i])
-                
-                #sort by chr/pos
-                lines = sorted(lines, key=lambda x: (x[0], int(x[1])))
-                for line in lines:
-                    vcf.write("\t".join(line) + "\n")
+            vcf.write_header(vcf_header)
+            with PROFILER.span("records"):
+                lines = self._build_lines(
+                    stringify_dataframe(self.df), sample_list, plan
+                )
+            with PROFILER.span("write"):
+                vcf.write_lines(lines)
+
+    def _build_lines(self, df, sample_list, plan):
+        """
+        plan: ConversionPlan compiled from the config, see commons.compile_config()
+        Each VCF column is built at once for all breakpoints, for the left and right sides
+        Returns the VCF lines of all breakends, sorted by contig (in the order of
+        config["GENOME"]["vcf_header"]) then position: the output can be indexed as is
+        """
+        # In some variant callers, output files contain a list of variant-sample associations
+        # so the same variant can be on multiple lines
+        # __!UNIQUE_VARIANT_ID!__ allows to identify such variants and only add them to the VCF once
+        if len(sample_list) == 1:
+            keep = numpy.ones(len(df.index), dtype=bool)
+        else:
+            keep = ~df["__!UNIQUE_VARIANT_ID!__"].duplicated().values
+        variants = df[keep]
+        row_numbers = numpy.flatnonzero(keep).tolist()
+        nrows = len(row_numbers)
+        if nrows == 0:
+            return []
+
+        left_ids = ["bnd_" + str(i * 2) for i in row_numbers]
+        right_ids = ["bnd_" + str(i * 2 + 1) for i in row_numbers]
+
+        # left side of the breakpoint, right side of the breakpoint
+        left_columns = []
+        right_columns = []
+        for vcf_col, field in plan.main.items():
+            if vcf_col == "ID" and self.config["VCF_COLUMNS"]["ID"] == "":
+                # special override to name breakends
+                left_columns.append(left_ids)
+                right_columns.append(right_ids)
+            elif field.is_helper():
+                results = field.evaluate(variants)
+                for result in results:
+                    if len(result) != 2:
+                        raise ValueError(
+                            "HELPER_FUNCTIONS used with vcf_from_breakpoints.py are expected to return a tuple of len 2. Got instead:"
+                            + str(result)
+                        )
+                left_columns.append([r[0] for r in results])
+                right_columns.append([r[1] for r in results])
+            else:
+                values = field.evaluate(variants)
+                left_columns.append(values)
+                right_columns.append(values)
+
+        info_columns = get_info_fields(variants, plan)
+        svtype = ["SVTYPE=BND"] * nrows
+        left_columns.append(
+            join_columns(
+                [svtype, ["MATEID=" + i for i in right_ids]] + info_columns, ";"
+            )
+        )
+        right_columns.append(
+            join_columns(
+                [svtype, ["MATEID=" + i for i in left_ids]] + info_columns, ";"
+            )
+        )
+
+        format_fields = [plan.format_string] * nrows
+        left_columns.append(format_fields)
+        right_columns.append(format_fields)
+
+        # monosample input
+        if len(sample_list) == 1:
+            sample_fields = get_sample_fields(variants, plan)
+        # multisample input
+        else:
+            # If the variant exists in other lines in the source file, fetch their sample data now
+            sample_fields = get_multisample_fields(
+                df,
+                variants["__!UNIQUE_VARIANT_ID!__"].tolist(),
+                "__!UNIQUE_VARIANT_ID!__",
+                sample_list,
+                plan,
+            )
+        left_columns.append(sample_fields)
+        right_columns.append(sample_fields)
+
+        left_lines = join_columns(left_columns, "\t")
+        right_lines = join_columns(right_columns, "\t")
+
+        # global sort of all breakends, on compact (contig rank, position) keys
+        # breakends at the same position stay in input order, left side first
+        lines = [line for pair in zip(left_lines, right_lines) for line in pair]
+        contigs = [
+            chrom for pair in zip(left_columns[0], right_columns[0]) for chrom in pair
+        ]
+        positions = [
+            pos for pair in zip(left_columns[1], right_columns[1]) for pos in pair
+        ]
+        order = get_sort_order(
+            contigs, positions, get_contig_order(self.config["GENOME"]["vcf_header"])
+        )
+        return [lines[i] for i in order]
 
 
 if __name__ == "__main__":
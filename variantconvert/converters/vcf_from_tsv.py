@@ -7,36 +7,68 @@ import logging as log
 import os
 import pandas as pd
 import sys
+import tempfile
 
 from converters.abstract_converter import AbstractConverter
 
 sys.path.append("..")
-from commons import create_vcf_header, is_helper_func, clean_string
+from commons import (
+    compile_config,
+    create_vcf_header,
+    get_contig_order,
+    get_contig_ranks,
+    get_info_fields,
+    get_multisample_fields,
+    get_output_sample_name,
+    get_position_keys,
+    get_sample_fields,
+    join_columns,
+    merge_sorted_runs,
+    open_output,
+    scan_tsv_dtypes,
+    sort_variants,
+    spill_sorted_run,
+    stringify_dataframe,
+)
 from helper_functions import HelperFunctions
+from profiling import PROFILER
+from readers import read_tsv
+from sharding import SHARDS_PER_PROCESS, convert_shards, get_shards
 
 
 class VcfFromTsv(AbstractConverter):
+    def __init__(self, config, config_filepath=None):
+        super().__init__(config, config_filepath)
+        self.chunksize = 0
+        self.UNIQUE_ID = "__!UNIQUE_VARIANT_ID!__"
+
+    def set_chunksize(self, chunksize):
+        """
+        chunksize > 0 enables streaming mode: the input is read by chunks of
+        <chunksize> rows, sorted runs are spilled to disk and the VCF is written
+        from a k-way merge of those runs. Output is identical to the default mode.
+        """
+        self.chunksize = chunksize
 
     def _init_dataframe(self):
-        self.df = pd.read_csv(
-            self.filepath,
-            skiprows=self.config["GENERAL"]["skip_rows"],
-            sep="\t",
-            low_memory=False,
-        )
-        self.df.sort_values(
-            [self.config["VCF_COLUMNS"]["#CHROM"], self.config["VCF_COLUMNS"]["POS"]],
-            inplace=True,
-        )
-        self.df.reset_index(drop=True, inplace=True)
+        with PROFILER.span("read_csv"):
+            self.df = read_tsv(self.filepath, self.config, self.reader)
+        PROFILER.count("input_rows", len(self.df.index))
+        with PROFILER.span("sort"):
+            self.df = sort_variants(
+                self.df,
+                self.config["VCF_COLUMNS"]["#CHROM"],
+                self.config["VCF_COLUMNS"]["POS"],
+                self.config["GENOME"]["vcf_header"],
+            )
+            self.df.reset_index(drop=True, inplace=True)
         self.df.fillna(".", inplace=True)
         log.debug(self.df)
-        self.df[self.UNIQUE_ID] = self.df.apply(
-            lambda row: self._get_unique_variant_id(row), axis=1
-        )
+        with PROFILER.span("unique_id"):
+            self._add_unique_variant_id(self.df)
         if self.config["VCF_COLUMNS"]["SAMPLE"] != "":
-            self.df[self.config["VCF_COLUMNS"]["SAMPLE"]] = self.df.apply(
-                lambda row: self._bwamem_name_bugfix(row), axis=1
+            self.df[self.config["VCF_COLUMNS"]["SAMPLE"]] = self._bwamem_name_bugfix(
+                self.df[self.config["VCF_COLUMNS"]["SAMPLE"]]
             )
         log.debug(self.df)
 
@@ -48,153 +80,255 @@ class VcfFromTsv(AbstractConverter):
                 sample_list.append(sample)
             return sample_list
         else:
-            return [os.path.basename(self.output_path)]
+            return [get_output_sample_name(self.output_path)]
 
-    def _bwamem_name_bugfix(self, row):
+    def _bwamem_name_bugfix(self, samples):
         """remove .bwamem from the end of sample names if needed"""
-        name = row[self.config["VCF_COLUMNS"]["SAMPLE"]]
-        if name.endswith(".bwamem") and name != ".bwamem":
-            return name[0:-7]
-        else:
-            return name
+        samples = samples.astype(str)
+        bwamem = samples.str.endswith(".bwamem") & (samples != ".bwamem")
+        return samples.where(~bwamem, samples.str[:-7])
 
-    def _get_unique_variant_id(self, row):
-        var_id = []
+    def _add_unique_variant_id(self, df):
+        var_id = None
         for col in self.config["GENERAL"]["unique_variant_id"]:
-            var_id.append(str(row[col]))
-        return "_".join(var_id)
-
-    def _get_unique_id_to_index_list(self, data):
-        id_dic = {}
-        for k, v in data[self.UNIQUE_ID].items():
-            if v not in id_dic:
-                id_dic[v] = [k]
+            if var_id is None:
+                var_id = df[col].astype(str)
             else:
-                id_dic[v].append(k)
-        return id_dic
+                var_id = var_id + "_" + df[col].astype(str)
+        df[self.UNIQUE_ID] = var_id
+
+    def _spill_sorted_runs(self, tmp_dir):
+        """
+        Read the input by chunks ; each chunk is prepared like _init_dataframe() would,
+        sorted and written to disk as a run.
+        Returns the run paths, the column names and the sample list.
+        """
+        chrom_col = self.config["VCF_COLUMNS"]["#CHROM"]
+        pos_col = self.config["VCF_COLUMNS"]["POS"]
+        sample_col = self.config["VCF_COLUMNS"]["SAMPLE"]
+        dtypes = scan_tsv_dtypes(
+            self.filepath, self.config["GENERAL"]["skip_rows"], self.chunksize
+        )
+
+        # unknown contigs are added to it by get_contig_ranks(): same rank in all chunks
+        contig_order = get_contig_order(self.config["GENOME"]["vcf_header"])
+        runs = []
+        columns = None
+        sample_first_key = {}
+        row_offset = 0
+        for chunk in pd.read_csv(
+            self.filepath,
+            skiprows=self.config["GENERAL"]["skip_rows"],
+            sep="\t",
+            chunksize=self.chunksize,
+            dtype=dtypes,
+        ):
+            # (contig rank, position, global row index): same order as sort_variants(),
+            # the row index keeps the merge stable
+            keys = list(
+                zip(
+                    get_contig_ranks(
+                        chunk[chrom_col], contig_order, add_unknown=True
+                    ).tolist(),
+                    get_position_keys(chunk[pos_col]).tolist(),
+                    range(row_offset, row_offset + len(chunk.index)),
+                )
+            )
+            row_offset += len(chunk.index)
+
+            for col, dtype in dtypes.items():
+                if dtype == "boolean":
+                    chunk[col] = chunk[col].astype(object)
+            chunk = chunk.fillna(".").astype(str)
+            self._add_unique_variant_id(chunk)
+            if sample_col != "":
+                chunk[sample_col] = self._bwamem_name_bugfix(chunk[sample_col])
+                for key, sample in zip(keys, chunk[sample_col]):
+                    if sample not in sample_first_key or key < sample_first_key[sample]:
+                        sample_first_key[sample] = key
+
+            columns = list(chunk.columns)
+            records = list(zip(keys, chunk.itertuples(index=False, name=None)))
+            records.sort(key=lambda r: r[0])
+            runs.append(spill_sorted_run(records, tmp_dir))
+            del records, chunk
+
+        if sample_col != "":
+            sample_list = sorted(sample_first_key, key=sample_first_key.get)
+        else:
+            sample_list = [get_output_sample_name(self.output_path)]
+        return runs, columns, sample_list
+
+    def _iter_merged_blocks(self, runs, columns):
+        """
+        Yields dataframes of about self.chunksize rows, in global sorted order.
+        Blocks are only cut between two different (chrom, pos),
+        so all lines of a multisample variant end up in the same block.
+        """
+        block = []
+        last_position = None
+        for key, values in merge_sorted_runs(runs):
+            position = key[:2]
+            if len(block) >= self.chunksize and position != last_position:
+                yield pd.DataFrame(block, columns=columns)
+                block = []
+            block.append(values)
+            last_position = position
+        if block:
+            yield pd.DataFrame(block, columns=columns)
+
+    def _convert_streaming(self, plan):
+        # chunks are read with pandas and the dtypes of scan_tsv_dtypes(), see _spill_sorted_runs()
+        if self.reader != "pandas":
+            raise ValueError(
+                "Streaming the input (chunksize > 0) is only implemented with the pandas reader engine, not: "
+                + self.reader
+            )
+        if self.config["VCF_COLUMNS"]["SAMPLE"] != "":
+            for vcf_col in ("#CHROM", "POS"):
+                if (
+                    self.config["VCF_COLUMNS"][vcf_col]
+                    not in self.config["GENERAL"]["unique_variant_id"]
+                ):
+                    raise ValueError(
+                        "Streaming a multisample file requires "
+                        'config["GENERAL"]["unique_variant_id"] to contain the '
+                        + vcf_col
+                        + " column"
+                    )
+
+        tmp_dir = tempfile.mkdtemp(
+            prefix=".tsvtovcf.",
+            dir=os.path.dirname(os.path.abspath(self.output_path)),
+        )
+        try:
+            with PROFILER.span("spill_sorted_runs"):
+                runs, columns, sample_list = self._spill_sorted_runs(tmp_dir)
+            log.debug("Spilled " + str(len(runs)) + " sorted runs to " + tmp_dir)
+            with open_output(
+                self.output_path,
+                self.compression_threads,
+                self.index_format,
+                self.output_compression,
+            ) as vcf:
+                vcf_header = create_vcf_header(self.filepath, self.config, sample_list)
+                vcf.write_header(vcf_header)
+                for block in self._iter_merged_blocks(runs, columns):
+                    self._write_records(vcf, block, sample_list, plan)
+        finally:
+            for f in os.listdir(tmp_dir):
+                os.remove(os.path.join(tmp_dir, f))
+            os.rmdir(tmp_dir)
 
     def convert(self, tsv, output_path):
         log.info("Converting to vcf from annotSV using config: " + self.config_filepath)
 
-        self.UNIQUE_ID = "__!UNIQUE_VARIANT_ID!__"
         self.filepath = tsv
         self.output_path = output_path
+        with PROFILER.span("compile_config"):
+            plan = compile_config(self.config, HelperFunctions(self.config))
+
+        if self.chunksize > 0:
+            self._convert_streaming(plan)
+            return
+
         self._init_dataframe()
         sample_list = self._get_sample_list()
-        helper = HelperFunctions(self.config)
 
-        with open(output_path, "w") as vcf:
+        with open_output(
+            output_path,
+            self.compression_threads,
+            self.index_format,
+            self.output_compression,
+        ) as vcf:
             vcf_header = create_vcf_header(tsv, self.config, sample_list)
-            for l in vcf_header:
-                vcf.write(l + "\n")
-
-            data = self.df.astype(str).to_dict()
-            # In Decon (and maybe others), TSV are given as a list of variant-sample associations
-            # so the same variant can be on multiple TSV lines
-            # __!UNIQUE_VARIANT_ID!__ allows to identify variants and only add them to the VCF once
-            already_seen_variants = set()
-            unique_id_to_index_list = self._get_unique_id_to_index_list(data)
-            for i in range(len(data[self.config["VCF_COLUMNS"]["#CHROM"]])):
-                if data[self.UNIQUE_ID][i] in already_seen_variants:
-                    continue
-
-                line = ""
-
-                for vcf_col in ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL"]:
-                    col = self.config["VCF_COLUMNS"][vcf_col]
-                    if is_helper_func(col):
-                        # col[1] is a function name, col[2] its list of args
-                        # the function named in col[1] has to be callable from this module
-                        func = helper.get(col[1])
-                        args = [data[c][i] for c in col[2:]]
-                        line += func(*args) + "\t"
-                    elif col == "":
-                        line += ".\t"
-                    else:
-                        line += data[col][i] + "\t"
-
-                # Cutting-edge FILTER implementation
-                line += "PASS\t"
-
-                info_field = []
-                for vcf_col, tsv_col in self.config["VCF_COLUMNS"]["INFO"].items():
-                    if is_helper_func(tsv_col):
-                        func = helper.get(tsv_col[1])
-                        args = [data[c][i] for c in tsv_col[2:]]
-                        s = vcf_col + "=" + func(*args)
-                    else:
-                        s = vcf_col + "=" + data[tsv_col][i]
-                    info_field.append(clean_string(s))
-                line += ";".join(info_field) + "\t"
-
-                vcf_format_fields = []
-                tsv_format_fields = []
-                for vcf_col, tsv_col in self.config["VCF_COLUMNS"]["FORMAT"].items():
-                    vcf_format_fields.append(vcf_col)
-                    tsv_format_fields.append(tsv_col)
-                line += ":".join(vcf_format_fields) + "\t"
-
-                # monosample input
-                if len(sample_list) == 1:
-                    sample_field = []
-                    for key, val in self.config["VCF_COLUMNS"]["FORMAT"].items():
-                        if key == "GT" and val == "":
-                            sample_field.append("0/1")
-                            continue
-                        sample_field.append(data[val][index])
-                    line += ":".join(sample_field)
-
-                # multisample input
-                else:
-                    sample_field_dic = {}
-                    # If the variant exists in other lines in the source file, fetch their sample data now
-                    for index in unique_id_to_index_list[
-                        data[self.UNIQUE_ID][i]
-                    ]:
-                        sample_field = []
-                        for key, val in self.config["VCF_COLUMNS"]["FORMAT"].items():
-                            if key == "GT" and val == "":
-                                sample_field.append("0/1")
-                                continue
-                            sample_field.append(data[val][index])
-                        sample_field_dic[
-                            data[self.config["VCF_COLUMNS"]["SAMPLE"]][index]
-                        ] = ":".join(sample_field)
-
-                    for sample in sample_list:
-                        if sample in sample_field_dic:
-                            line += sample_field_dic[sample] + "\t"
-                        else:
-                            if "GT" in self.config["VCF_COLUMNS"]["FORMAT"]:
-                                if len(self.config["VCF_COLUMNS"]["FORMAT"]) == 1:
-                                    # there's only GT. Avoid adding a trailing ":"
-                                    empty = "./."
-                                else:
-                                    empty = "./.:" + ":".join(
-                                        [
-                                            "."
-                                            for i in range(
-                                                len(
-                                                    self.config["VCF_COLUMNS"]["FORMAT"]
-                                                )
-                                                - 1
-                                            )
-                                        ]
-                                    )
-                            else:
-                                empty = ":".join(
-                                    [
-                                        "."
-                                        for i in range(
-                                            len(self.config["VCF_COLUMNS"]["FORMAT"])
-                                            - 1
-                                        )
-                                    ]
-                                )
-                            line += empty + "\t"
-                    already_seen_variants.add(data[self.UNIQUE_ID][i])
-                    line = line.rstrip("\t")
-                    print("after", line.split("\t"))
-
-                vcf.write(line + "\n")
+            vcf.write_header(vcf_header)
+
+            if self.processes > 1:
+                self._write_sharded_records(
+                    vcf, stringify_dataframe(self.df), sample_list
+                )
+            else:
+                self._write_records(
+                    vcf, stringify_dataframe(self.df), sample_list, plan
+                )
+
+    def _get_variants(self, df, sample_list):
+        # In Decon (and maybe others), TSV are given as a list of variant-sample associations
+        # so the same variant can be on multiple TSV lines
+        # __!UNIQUE_VARIANT_ID!__ allows to identify variants and only add them to the VCF once
+        if len(sample_list) == 1:
+            return df
+        return df[~df[self.UNIQUE_ID].duplicated().values]
+
+    def _write_records(self, vcf, df, sample_list, plan):
+        """
+        df: sorted dataframe of strings
+        plan: ConversionPlan compiled from the config, see commons.compile_config()
+        Each VCF column is built at once for all variants, then lines are written by blocks
+        """
+        variants = self._get_variants(df, sample_list)
+        if len(variants.index) == 0:
+            return
+
+        with PROFILER.span("records"):
+            lines = self._build_lines(df, variants, sample_list, plan)
+        with PROFILER.span("write"):
+            vcf.write_lines(lines)
+
+    def _write_sharded_records(self, vcf, df, sample_list):
+        """
+        Same as _write_records(), with records built by self.processes worker processes
+        """
+        shards = get_shards(
+            df[self.config["VCF_COLUMNS"]["#CHROM"]],
+            None if len(sample_list) == 1 else df[self.UNIQUE_ID],
+            self.processes * SHARDS_PER_PROCESS,
+        )
+        with PROFILER.span("sharded_records"):
+            for text, records in convert_shards(
+                self, df, shards, sample_list, self.processes
+            ):
+                vcf.write_block(text, records)
+
+    def convert_shard(self, df, plan, sample_list):
+        """
+        VCF lines of a shard of the input, in a worker process (see sharding.py)
+        """
+        variants = self._get_variants(df, sample_list)
+        if len(variants.index) == 0:
+            return []
+        return self._build_lines(df, variants, sample_list, plan)
+
+    def _build_lines(self, df, variants, sample_list, plan):
+        """
+        variants: rows of df written to the VCF, one per unique variant
+        """
+        nrows = len(variants.index)
+        columns = [field.evaluate(variants) for field in plan.main.values()]
+
+        info_columns = get_info_fields(variants, plan)
+        if info_columns:
+            columns.append(join_columns(info_columns, ";"))
+        else:
+            columns.append([""] * nrows)
+
+        columns.append([plan.format_string] * nrows)
+
+        # monosample input
+        if len(sample_list) == 1:
+            columns.append(get_sample_fields(variants, plan))
+        # multisample input
+        else:
+            # If the variant exists in other lines in the source file, fetch their sample data now
+            columns.append(
+                get_multisample_fields(
+                    df,
+                    variants[self.UNIQUE_ID].tolist(),
+                    self.UNIQUE_ID,
+                    sample_list,
+                    plan,
+                )
+            )
 
+        return join_columns(columns, "\t")
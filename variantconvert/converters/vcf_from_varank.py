@@ -14,8 +14,32 @@ import time
 from converters.abstract_converter import AbstractConverter
 
 sys.path.append("..")
-from commons import clean_string, rename_duplicates_in_list, varank_to_vcf_coords
+from commons import (
+    clean_column,
+    clean_string,
+    join_columns,
+    open_output,
+    rename_duplicates_in_list,
+    sort_variants,
+    stringify_dataframe,
+    varank_to_vcf_coords,
+)
 from helper_functions import HelperFunctions
+from profiling import PROFILER
+from readers import read_tsv
+
+VCF_COLUMNS = [
+    "#CHROM",
+    "POS",
+    "ID",
+    "REF",
+    "ALT",
+    "QUAL",
+    "FILTER",
+    "INFO",
+    "FORMAT",
+    "SAMPLE",
+]
 
 
 class VcfFromVarank(AbstractConverter):
@@ -23,30 +47,41 @@ class VcfFromVarank(AbstractConverter):
     TODO: update vcffromvarank.py to fit the interface and import it instead
     """
 
+    def __init__(self, config, config_filepath=None):
+        super().__init__(config, config_filepath)
+        # column metadata computed once, the converter can be reused for several files
+        self.known_columns = set(self.get_known_columns())
+        self.float_columns = [
+            col
+            for col, desc in self.config["COLUMNS_DESCRIPTION"].items()
+            if desc["Type"] == "Float"
+        ]
+
     def _init_dataframe(self, filepath):
         self.filepath = filepath
-        self.df = pd.read_csv(
-            filepath,
-            skiprows=self.config["GENERAL"]["skip_rows"],
-            sep="\t",
-            low_memory=False,
-        )
-
-        self.df.sort_values(
-            [self.config["VCF_COLUMNS"]["#CHROM"], self.config["VCF_COLUMNS"]["POS"]],
-            inplace=True,
-        )
+        with PROFILER.span("read_csv"):
+            self.df = read_tsv(filepath, self.config, self.reader)
+        PROFILER.count("input_rows", len(self.df.index))
+
+        with PROFILER.span("sort"):
+            self.df = sort_variants(
+                self.df,
+                self.config["VCF_COLUMNS"]["#CHROM"],
+                self.config["VCF_COLUMNS"]["POS"],
+                self.config["GENOME"]["vcf_header"],
+            )
         self.df = self.df.drop_duplicates()  # varank files have duplicate lines!
         self.df.reset_index(drop=True, inplace=True)
         self.df.columns = rename_duplicates_in_list(self.df.columns)
 
-        # convert french commas to dot in floats
-        for col in self.config["COLUMNS_DESCRIPTION"]:
-            if self.config["COLUMNS_DESCRIPTION"][col]["Type"] == "Float":
-                if col in self.df.columns:
-                    self.df[col] = self.df.apply(
-                        lambda row: self.french_commas_to_dots(row[col]), axis=1
-                    )
+        # convert french commas to dot in floats (columns read as numbers have none)
+        for col in self.float_columns:
+            if col in self.df.columns and not pd.api.types.is_numeric_dtype(
+                self.df[col]
+            ):
+                self.df[col] = (
+                    self.df[col].astype(object).map(self.french_commas_to_dots)
+                )
 
         # request from Jean: remove the transcript part in cNomen columns
         if "cNomen" in self.df.columns:
@@ -64,12 +99,12 @@ class VcfFromVarank(AbstractConverter):
         log.debug(self.df)
 
     def remove_percent(self, val):
-        if not isinstance(val, float): #dirty way to check if value is not nan
+        if not isinstance(val, float):  # dirty way to check if value is not nan
             if val.endswith("%"):
                 return val.split("%")[0]
 
     def remove_transcript_from_cnomen(self, val):
-        if not isinstance(val, float): #dirty way to check if value is not nan
+        if not isinstance(val, float):  # dirty way to check if value is not nan
             if ":" in val:
                 return val.split(":")[1]
 
@@ -87,7 +122,9 @@ class VcfFromVarank(AbstractConverter):
         No need to check for genotype because Varank TSV files are a list of variants contained in one sample.
         There are no "0/0" or "./." in the output VCF made from a Varank TSV file.
         """
-        self.df["gene_mut_counts"] = self.df.groupby("genes")["genes"].transform("size")
+        self.df["gene_mut_counts"] = self.df.groupby("genes", observed=True)[
+            "genes"
+        ].transform("size")
         self.df["gene_mut_counts"] = self.df["gene_mut_counts"].fillna(-1)
         # pd.set_option('display.max_rows', None)
         # print(self.df["variantID"])
@@ -127,58 +164,123 @@ class VcfFromVarank(AbstractConverter):
         # No GQ, no PL, and apparently no multi allelic variants
         return known
 
-    def convert(self, varank_tsv, output_path):
-        log.info("Converting to vcf from varank using config: " + self.config_filepath)
+    def get_vcf_columns(self, varank_tsv):
+        """
+        Converts a Varank file without writing it (see convert())
+        Returns a dictionary of VCF columns, each a list with one string per variant:
+        "#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT", "SAMPLE"
+        and "variantID", the key of VCF_Coordinates_Conversion.tsv
+        """
         id_to_coords = varank_to_vcf_coords(self.coord_conversion_file)
+        columns = self.get_sample_records(varank_tsv)
+        with PROFILER.span("coords_lookup"):
+            columns.update(id_to_coords.get_columns(columns["variantID"]))
+        return columns
+
+    def get_sample_records(self, varank_tsv):
+        """
+        Same as get_vcf_columns(), without the coordinates: "variantID", "ID", "QUAL", "FILTER",
+        "INFO", "FORMAT" and "SAMPLE". See varank_batch.py and cohort.CohortBuilder
+        """
         self.sample_name = self.get_sample_name(varank_tsv)
-        self._init_dataframe(varank_tsv)
+        with PROFILER.span("prepare_dataframe"):
+            self._init_dataframe(varank_tsv)
 
-        with open(output_path, "w") as vcf:
-            vcf_header = self.create_vcf_header()
-            for l in vcf_header:
-                vcf.write(l + "\n")
-
-            data = self.df.fillna(".").astype(str).to_dict()
-            # "#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT", self.sample_name]
-            for i in range(len(data["variantID"])):
-                line = id_to_coords[data["variantID"][i]]["#CHROM"] + "\t"
-                line += id_to_coords[data["variantID"][i]]["POS"] + "\t"
-                line += data[self.config["VCF_COLUMNS"]["ID"]][i] + "\t"
-                line += id_to_coords[data["variantID"][i]]["REF"] + "\t"
-                line += id_to_coords[data["variantID"][i]]["ALT"] + "\t"
-                line += data[self.config["VCF_COLUMNS"]["QUAL"]][i] + "\t"
-                line += "PASS\t"
-
-                info_field = []
-                for key in data.keys():
-                    if key not in self.get_known_columns():
-                        s = key + "=" + data[key][i]
-                        s = clean_string(s)
-                        info_field.append(s)
-                line += ";".join(info_field) + "\t"
-
-                line += "GT:DP:AD:VAF:GMC\t"
-                gt_dic = {"hom": "1/1", "het": "0/1"}
-                sample_field = (
-                    gt_dic[data[self.config["VCF_COLUMNS"]["FORMAT"]["GT"]][i]] + ":"
-                )
-                sample_field += (
-                    data[self.config["VCF_COLUMNS"]["FORMAT"]["DP"]][i] + ":"
-                )
-                sample_field += (
-                    str(int(data["totalReadDepth"][i]) - int(data["varReadDepth"][i]))
-                    + ","
-                    + data["varReadDepth"][i]
-                    + ":"
+        str_df = stringify_dataframe(self.df.fillna("."))
+        variant_ids = str_df["variantID"].tolist()
+        nrows = len(variant_ids)
+        columns = {"variantID": variant_ids}
+        columns["ID"] = str_df[self.config["VCF_COLUMNS"]["ID"]].tolist()
+        columns["QUAL"] = str_df[self.config["VCF_COLUMNS"]["QUAL"]].tolist()
+        columns["FILTER"] = ["PASS"] * nrows
+
+        # INFO contains all columns that are not used anywhere specific
+        info_columns = []
+        for key in str_df.columns:
+            if key in self.known_columns:
+                continue
+            # Float columns are still text after french_commas_to_dots(): they are cleaned too
+            prefix = clean_string(key + "=")
+            info_columns.append(
+                [prefix + v for v in clean_column(str_df[key].tolist())]
+            )
+        if info_columns:
+            columns["INFO"] = join_columns(info_columns, ";")
+        else:
+            columns["INFO"] = [""] * nrows
+
+        columns["FORMAT"] = ["GT:DP:AD:VAF:GMC"] * nrows
+        columns["SAMPLE"] = join_columns(
+            [
+                self._get_genotypes(str_df),
+                str_df[self.config["VCF_COLUMNS"]["FORMAT"]["DP"]].tolist(),
+                self._get_allelic_depths(str_df),
+                self._get_vafs(str_df),
+                str_df["gene_mut_counts"].tolist(),
+            ],
+            ":",
+        )
+        return columns
+
+    def _get_genotypes(self, str_df):
+        zygosity = str_df[self.config["VCF_COLUMNS"]["FORMAT"]["GT"]]
+        genotypes = zygosity.map({"hom": "1/1", "het": "0/1"})
+        if genotypes.isna().any():
+            raise ValueError(
+                "Unexpected zygosity in Varank file: "
+                + str(zygosity[genotypes.isna()].iloc[0])
+                + ". Expected 'hom' or 'het'"
+            )
+        return genotypes.tolist()
+
+    def _get_allelic_depths(self, str_df):
+        """
+        AD: reference depth (totalReadDepth - varReadDepth), variant depth
+        """
+        total = self.df["totalReadDepth"]
+        variant = self.df["varReadDepth"]
+        if pd.api.types.is_integer_dtype(total) and pd.api.types.is_integer_dtype(
+            variant
+        ):
+            ref_depths = (total - variant).astype(str).tolist()
+        else:
+            ref_depths = [
+                str(int(t) - int(v))
+                for t, v in zip(
+                    str_df["totalReadDepth"].tolist(), str_df["varReadDepth"].tolist()
                 )
-                vaf = data[self.config["VCF_COLUMNS"]["FORMAT"]["VAF"]][i]
-                if vaf != ".":
-                    vaf = str(float(vaf) / 100)
-                sample_field += vaf + ":"
-                sample_field += str(data["gene_mut_counts"][i])
-                line += sample_field
+            ]
+        return join_columns([ref_depths, str_df["varReadDepth"].tolist()], ",")
+
+    def _get_vafs(self, str_df):
+        """
+        VAF: varReadPercent / 100, "." when missing
+        """
+        vafs = str_df[self.config["VCF_COLUMNS"]["FORMAT"]["VAF"]].to_numpy(
+            dtype=object, copy=True
+        )
+        known = vafs != "."
+        vafs[known] = [
+            str(vaf) for vaf in (vafs[known].astype(numpy.float64) / 100).tolist()
+        ]
+        return vafs.tolist()
 
-                vcf.write(line + "\n")
+    def convert(self, varank_tsv, output_path):
+        log.info("Converting to vcf from varank using config: " + self.config_filepath)
+        with PROFILER.span("records"):
+            columns = self.get_vcf_columns(varank_tsv)
+            lines = join_columns([columns[key] for key in VCF_COLUMNS], "\t")
+
+        with open_output(
+            output_path,
+            self.compression_threads,
+            self.index_format,
+            self.output_compression,
+        ) as vcf:
+            vcf_header = self.create_vcf_header()
+            vcf.write_header(vcf_header)
+            with PROFILER.span("write"):
+                vcf.write_lines(lines)
 
         log.debug("Wrote: " + output_path)
 
@@ -196,9 +298,9 @@ class VcfFromVarank(AbstractConverter):
         # INFO contains all columns that are not used anywhere specific
         # log.debug(dict(self.df.dtypes))
         for key in self.df.columns:
-            if key in self.get_known_columns():
+            if key in self.known_columns:
                 continue
-            if str(self.df[key].dtypes) in ("object", "O", "bool"):
+            if str(self.df[key].dtypes) in ("object", "O", "bool", "category"):
                 info_type = "String"
             elif str(self.df[key].dtypes) == "float64":
                 info_type = "Float"
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import logging as log
+import mmap
+import numpy
+import os
+import tempfile
+
+from array import array
+
+INDEX_SUFFIX = ".idx"
+_MAGIC = b"VCCIDX01"
+# magic, TSV size, TSV mtime_ns, number of variants
+_HEADER = numpy.dtype(
+    [("magic", "S8"), ("size", "<u8"), ("mtime_ns", "<i8"), ("count", "<u8")]
+)
+
+
+def hash_variant_id(variant_id):
+    """
+    Stable 64 bits hash (python's hash() changes from one process to another)
+    """
+    if isinstance(variant_id, str):
+        variant_id = variant_id.encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(variant_id, digest_size=8).digest(), "little")
+
+
+def _write_index(tsv_path, index_path, stat):
+    """
+    Index content: sorted variantID hashes, and for each hash
+    the offset of its line in the TSV. Lines with the same hash keep the file order.
+    """
+    hashes = array("Q")
+    offsets = array("Q")
+    with open(tsv_path, "rb") as f:
+        offset = len(f.readline())
+        for line in f:
+            variant_id = line.strip().split(b"\t", 1)[0]
+            if variant_id:
+                hashes.append(hash_variant_id(variant_id))
+                offsets.append(offset)
+            offset += len(line)
+    hashes = numpy.frombuffer(hashes, dtype=numpy.uint64).astype("<u8")
+    offsets = numpy.frombuffer(offsets, dtype=numpy.uint64).astype("<u8")
+    order = numpy.argsort(hashes, kind="stable")
+
+    header = numpy.array(
+        [(_MAGIC, stat.st_size, stat.st_mtime_ns, len(hashes))], dtype=_HEADER
+    )
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(index_path), prefix=".tmp_coords_index"
+    )
+    with os.fdopen(fd, "wb") as out:
+        out.write(header.tobytes())
+        out.write(hashes[order].tobytes())
+        out.write(offsets[order].tobytes())
+    # mkstemp files are private, but the index is meant to be shared
+    os.chmod(tmp_path, 0o644)
+    # atomic: concurrent workers may build the same index
+    os.replace(tmp_path, index_path)
+
+
+def _is_up_to_date(index_path, stat):
+    if not os.path.exists(index_path):
+        return False
+    with open(index_path, "rb") as f:
+        raw = f.read(_HEADER.itemsize)
+    if len(raw) < _HEADER.itemsize:
+        return False
+    header = numpy.frombuffer(raw, dtype=_HEADER)[0]
+    return (
+        header["magic"] == _MAGIC
+        and header["size"] == stat.st_size
+        and header["mtime_ns"] == stat.st_mtime_ns
+        and os.path.getsize(index_path) == _HEADER.itemsize + 16 * int(header["count"])
+    )
+
+
+def get_index_path(tsv_path):
+    """
+    The index is built next to the TSV if possible, in the temp directory otherwise
+    """
+    index_path = tsv_path + INDEX_SUFFIX
+    if os.access(os.path.dirname(os.path.abspath(tsv_path)), os.W_OK):
+        return index_path
+    name = hashlib.blake2b(
+        os.path.abspath(tsv_path).encode("utf-8"), digest_size=8
+    ).hexdigest()
+    return os.path.join(tempfile.gettempdir(), "coords_index_" + name + INDEX_SUFFIX)
+
+
+class CoordsIndex:
+    """
+    Read-only, memory-mapped view of a Varank VCF_Coordinates_Conversion.tsv file
+    Behaves like the {variantID: {"#CHROM", "POS", "REF", "ALT"}} dict it replaces,
+    but only the index arrays and the TSV pages actually read are loaded in memory,
+    and all processes using the same files share them through the OS page cache.
+
+    The index (<tsv>.idx) is rebuilt when the TSV size or modification time changes.
+    """
+
+    def __init__(self, tsv_path):
+        self.tsv_path = tsv_path
+        stat = os.stat(tsv_path)
+        self.index_path = get_index_path(tsv_path)
+        if not _is_up_to_date(self.index_path, stat):
+            log.debug("Building coordinates index: " + self.index_path)
+            _write_index(tsv_path, self.index_path, stat)
+
+        count = int(numpy.fromfile(self.index_path, dtype=_HEADER, count=1)[0]["count"])
+        if count == 0:
+            self.hashes = numpy.zeros(0, dtype="<u8")
+            self.offsets = numpy.zeros(0, dtype="<u8")
+        else:
+            self.hashes = numpy.memmap(
+                self.index_path,
+                dtype="<u8",
+                mode="r",
+                offset=_HEADER.itemsize,
+                shape=(count,),
+            )
+            self.offsets = numpy.memmap(
+                self.index_path,
+                dtype="<u8",
+                mode="r",
+                offset=_HEADER.itemsize + 8 * count,
+                shape=(count,),
+            )
+        with open(tsv_path, "rb") as f:
+            self._tsv = (
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if stat.st_size
+                else b""
+            )
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def _read_line(self, offset):
+        end = self._tsv.find(b"\n", offset)
+        if end == -1:
+            end = len(self._tsv)
+        return self._tsv[offset:end].decode("utf-8").strip().split("\t")
+
+    def _find(self, variant_id, first, last):
+        """
+        Returns the offset of the line of variant_id and its fields
+        """
+        # the last line wins when a variantID is duplicated, like in a dict
+        for i in range(last - 1, first - 1, -1):
+            offset = int(self.offsets[i])
+            line = self._read_line(offset)
+            if line[0] == variant_id:
+                return offset, line
+        raise KeyError(variant_id)
+
+    def _find_all(self, variant_ids):
+        hashes = numpy.fromiter(
+            (hash_variant_id(v) for v in variant_ids),
+            dtype="<u8",
+            count=len(variant_ids),
+        )
+        firsts = numpy.searchsorted(self.hashes, hashes, side="left")
+        lasts = numpy.searchsorted(self.hashes, hashes, side="right")
+        return [
+            self._find(v, int(f), int(l)) for v, f, l in zip(variant_ids, firsts, lasts)
+        ]
+
+    def __getitem__(self, variant_id):
+        h = numpy.uint64(hash_variant_id(variant_id))
+        first = int(numpy.searchsorted(self.hashes, h, side="left"))
+        last = int(numpy.searchsorted(self.hashes, h, side="right"))
+        line = self._find(variant_id, first, last)[1]
+        return {
+            "#CHROM": "chr" + line[1],
+            "POS": line[2],
+            "REF": line[3],
+            "ALT": line[4],
+        }
+
+    def __contains__(self, variant_id):
+        try:
+            self[variant_id]
+        except KeyError:
+            return False
+        return True
+
+    def get_columns(self, variant_ids):
+        """
+        Batch lookup: returns {"#CHROM": [...], "POS": [...], "REF": [...], "ALT": [...]}
+        in the order of variant_ids. Raises KeyError on unknown IDs.
+        """
+        lines = [line for offset, line in self._find_all(list(variant_ids))]
+        return {
+            "#CHROM": ["chr" + line[1] for line in lines],
+            "POS": [line[2] for line in lines],
+            "REF": [line[3] for line in lines],
+            "ALT": [line[4] for line in lines],
+        }
+
+    def get_offsets(self, variant_ids):
+        """
+        Offsets of the lines of variant_ids in the TSV, as a numpy array: sorting by offset
+        gives the order of the file. Raises KeyError on unknown IDs.
+        """
+        return numpy.array(
+            [offset for offset, line in self._find_all(list(variant_ids))],
+            dtype=numpy.int64,
+        )
@@ -3,7 +3,23 @@
 from __future__ import division
 from __future__ import print_function
 
-from commons import get_genome
+import numpy
+import pandas as pd
+
+from commons import fetch_reference_bases, open_genome
+from profiling import PROFILER
+
+
+def _map_column(values, mapping, error_message):
+    """
+    Batch equivalent of a dict lookup that raises on unexpected values
+    """
+    values = pd.Series(values)
+    result = values.map(mapping)
+    unexpected = result.isna()
+    if unexpected.any():
+        raise ValueError(error_message + str(values[unexpected].iloc[0]))
+    return result
 
 
 class HelperFunctions:
@@ -25,6 +41,16 @@ class HelperFunctions:
             self.dispatcher["get_length_from_special_format"]: get_length
     # in the JSON configfile
             LENGTH: [HELPER_FUNCTION, "get_length_from_special_format", START, END]
+
+    Optionally, a batch version of the function can be added to self.batch_dispatcher
+    under the same name. It receives whole columns (pandas Series or numpy arrays)
+    instead of single values and returns the whole output column.
+    Converters use it when it exists and fall back to the row by row function otherwise.
+    # somewhere in the module
+            def get_length_batch(start, end):
+                    return (numpy.asarray(end, dtype=int) - numpy.asarray(start, dtype=int)).astype(str)
+    #in this class __init__():
+            self.batch_dispatcher["get_length_from_special_format"]: get_length_batch
     """
 
     def __init__(self, config):
@@ -41,26 +67,66 @@ class HelperFunctions:
             "get_pos_from_breakpoint": self.get_pos_from_breakpoint,
             "get_ref_from_breakpoint": self.get_ref_from_breakpoint,
             "get_alt_from_breakpoint": self.get_alt_from_breakpoint,
-            "get_alt_from_arriba_breakpoint" : self.get_alt_from_arriba_breakpoint,
-            "readable_starfusion_annots" : self.readable_starfusion_annots,
-            "get_undefined_value": self.get_undefined_value
+            "get_alt_from_arriba_breakpoint": self.get_alt_from_arriba_breakpoint,
+            "readable_starfusion_annots": self.readable_starfusion_annots,
+            "get_undefined_value": self.get_undefined_value,
+        }
+        self.batch_dispatcher = {
+            "get_alt_from_decon": self.get_alt_from_decon_batch,
+            "get_svlen_from_decon": self.get_svlen_from_decon_batch,
+            "get_info_from_annotsv": self.get_info_from_annotsv_batch,
+            "get_alt_for_bed_based_annotsv": self.get_alt_for_bed_based_annotsv_batch,
+            "get_alt_from_canoes_bed": self.get_alt_from_canoes_bed_batch,
+            "get_chr_from_breakpoint": self.get_chr_from_breakpoint_batch,
+            "get_pos_from_breakpoint": self.get_pos_from_breakpoint_batch,
+            "get_ref_from_decon": self.get_ref_from_decon_batch,
+            "get_ref_from_canoes_bed": self.get_ref_from_canoes_bed_batch,
+            "get_ref_from_breakpoint": self.get_ref_from_breakpoint_batch,
+            "get_alt_from_breakpoint": self.get_alt_from_breakpoint_batch,
+            "get_alt_from_arriba_breakpoint": self.get_alt_from_arriba_breakpoint_batch,
         }
+        # last result of get_ref_from_breakpoint_batch(), see _get_breakpoint_refs()
+        self._breakpoint_refs = None
 
     def get(self, func_name):
         return self.dispatcher[func_name]
 
+    def get_batch(self, func_name):
+        """
+        returns None if func_name has no batch version
+        """
+        return self.batch_dispatcher.get(func_name)
+
     def get_ref_from_decon(self, chrom, start):
-        f = get_genome(self.config["GENOME"]["path"])
-        if self.config["GENOME"]["vcf_header"][0].startswith("##contig=<ID=chr") and not chrom.startswith("chr"):
+        f = open_genome(self.config["GENOME"])
+        if self.config["GENOME"]["vcf_header"][0].startswith(
+            "##contig=<ID=chr"
+        ) and not chrom.startswith("chr"):
             chrom = "chr" + str(chrom)
+        PROFILER.count("fasta_fetches")
         return f[chrom][int(start) - 1].seq
 
+    def get_ref_from_decon_batch(self, chrom, start):
+        chrom = pd.Series(chrom, dtype=object)
+        if self.config["GENOME"]["vcf_header"][0].startswith("##contig=<ID=chr"):
+            chrom = chrom.where(chrom.str.startswith("chr"), "chr" + chrom.astype(str))
+        return fetch_reference_bases(
+            open_genome(self.config["GENOME"]), chrom.tolist(), start
+        )
+
     def get_ref_from_canoes_bed(self, chr, start):
-        f = get_genome(self.config["GENOME"]["path"])
+        f = open_genome(self.config["GENOME"])
+        PROFILER.count("fasta_fetches")
         return f["chr" + str(chr)][int(start) - 1].seq
 
+    def get_ref_from_canoes_bed_batch(self, chr, start):
+        chrom = "chr" + pd.Series(chr, dtype=object).astype(str)
+        return fetch_reference_bases(
+            open_genome(self.config["GENOME"]), chrom.tolist(), start
+        )
+
     def get_ref_from_breakpoint(self, left_breakpoint, right_breakpoint):
-        f = get_genome(self.config["GENOME"]["path"])
+        f = open_genome(self.config["GENOME"])
 
         left_chr = left_breakpoint.split(":")[0]
         if not left_chr.startswith("chr"):
@@ -72,10 +138,62 @@ class HelperFunctions:
             right_chr = "chr" + right_chr
         right_start = right_breakpoint.split(":")[1]
 
-        return (f[left_chr][int(left_start) - 1].seq, f[right_chr][int(right_start) - 1].seq)
+        PROFILER.count("fasta_fetches", 2)
+        return (
+            f[left_chr][int(left_start) - 1].seq,
+            f[right_chr][int(right_start) - 1].seq,
+        )
+
+    def get_ref_from_breakpoint_batch(self, left_breakpoint, right_breakpoint):
+        """
+        Both sides of all breakpoints are fetched in a single sorted pass over the genome.
+        The result is kept: ALT helpers need the same bases and are
+        usually called right after on the same columns.
+        """
+        left_breakpoint = numpy.asarray(left_breakpoint, dtype=object)
+        right_breakpoint = numpy.asarray(right_breakpoint, dtype=object)
+        if self._breakpoint_refs is not None:
+            last_left, last_right, refs = self._breakpoint_refs
+            if (
+                len(last_left) == len(left_breakpoint)
+                and (last_left == left_breakpoint).all()
+                and (last_right == right_breakpoint).all()
+            ):
+                return refs
+
+        breakpoints = pd.Series(
+            numpy.concatenate([left_breakpoint, right_breakpoint]), dtype=object
+        ).str.split(":", n=2)
+        chrom = breakpoints.str[0]
+        chrom = chrom.where(chrom.str.startswith("chr"), "chr" + chrom)
+        bases = fetch_reference_bases(
+            open_genome(self.config["GENOME"]),
+            chrom.tolist(),
+            breakpoints.str[1].tolist(),
+        )
+        refs = list(zip(bases[: len(left_breakpoint)], bases[len(left_breakpoint) :]))
+        self._breakpoint_refs = (left_breakpoint, right_breakpoint, refs)
+        return refs
 
     def get_alt_from_breakpoint(self, left_breakpoint, right_breakpoint):
-        left_ref, right_ref = self.get_ref_from_breakpoint(left_breakpoint, right_breakpoint)
+        left_ref, right_ref = self.get_ref_from_breakpoint(
+            left_breakpoint, right_breakpoint
+        )
+        return self._get_breakpoint_alts(
+            left_breakpoint, right_breakpoint, left_ref, right_ref
+        )
+
+    def get_alt_from_breakpoint_batch(self, left_breakpoint, right_breakpoint):
+        refs = self.get_ref_from_breakpoint_batch(left_breakpoint, right_breakpoint)
+        return [
+            self._get_breakpoint_alts(left, right, left_ref, right_ref)
+            for left, right, (left_ref, right_ref) in zip(
+                left_breakpoint, right_breakpoint, refs
+            )
+        ]
+
+    @staticmethod
+    def _get_breakpoint_alts(left_breakpoint, right_breakpoint, left_ref, right_ref):
         left_chr, left_pos, left_orientation = left_breakpoint.split(":")
         right_chr, right_pos, right_orientation = right_breakpoint.split(":")
 
@@ -95,8 +213,43 @@ class HelperFunctions:
 
         return left_alt, right_alt
 
-    def get_alt_from_arriba_breakpoint(self, left_breakpoint, right_breakpoint, left_direction, right_direction):
-        left_ref, right_ref = self.get_ref_from_breakpoint(left_breakpoint, right_breakpoint)
+    def get_alt_from_arriba_breakpoint(
+        self, left_breakpoint, right_breakpoint, left_direction, right_direction
+    ):
+        left_ref, right_ref = self.get_ref_from_breakpoint(
+            left_breakpoint, right_breakpoint
+        )
+        return self._get_arriba_breakpoint_alts(
+            left_breakpoint,
+            right_breakpoint,
+            left_direction,
+            right_direction,
+            left_ref,
+            right_ref,
+        )
+
+    def get_alt_from_arriba_breakpoint_batch(
+        self, left_breakpoint, right_breakpoint, left_direction, right_direction
+    ):
+        refs = self.get_ref_from_breakpoint_batch(left_breakpoint, right_breakpoint)
+        return [
+            self._get_arriba_breakpoint_alts(
+                left, right, left_dir, right_dir, left_ref, right_ref
+            )
+            for left, right, left_dir, right_dir, (left_ref, right_ref) in zip(
+                left_breakpoint, right_breakpoint, left_direction, right_direction, refs
+            )
+        ]
+
+    @staticmethod
+    def _get_arriba_breakpoint_alts(
+        left_breakpoint,
+        right_breakpoint,
+        left_direction,
+        right_direction,
+        left_ref,
+        right_ref,
+    ):
         left_chr, left_pos = left_breakpoint.split(":")
         right_chr, right_pos = right_breakpoint.split(":")
 
@@ -128,6 +281,14 @@ class HelperFunctions:
             return "<DUP>"
         raise ValueError("Unexpected CNV.type value:" + str(cnv_type_field))
 
+    @staticmethod
+    def get_alt_from_decon_batch(cnv_type_field):
+        return _map_column(
+            cnv_type_field,
+            {"deletion": "<DEL>", "duplication": "<DUP>"},
+            "Unexpected CNV.type value:",
+        )
+
     @staticmethod
     def get_alt_from_canoes_bed(cnv_type_field):
         if cnv_type_field == "DEL":
@@ -136,10 +297,25 @@ class HelperFunctions:
             return "<DUP>"
         raise ValueError("Unexpected CNV.type value:" + str(cnv_type_field))
 
+    @staticmethod
+    def get_alt_from_canoes_bed_batch(cnv_type_field):
+        return _map_column(
+            cnv_type_field,
+            {"DEL": "<DEL>", "DUP": "<DUP>"},
+            "Unexpected CNV.type value:",
+        )
+
     @staticmethod
     def get_svlen_from_decon(start, end):
         return str(int(end) - int(start))
 
+    @staticmethod
+    def get_svlen_from_decon_batch(start, end):
+        # casting an object array to int64 calls int() on each value, like the scalar version
+        start = numpy.asarray(start, dtype=object).astype(numpy.int64)
+        end = numpy.asarray(end, dtype=object).astype(numpy.int64)
+        return (end - start).astype(str)
+
     @staticmethod
     def get_info_from_annotsv(info):
         """
@@ -147,19 +323,42 @@ class HelperFunctions:
         as if they were generic TSV (not recommended)
         """
         return "."
-    
+
+    @staticmethod
+    def get_info_from_annotsv_batch(info):
+        return ["."] * len(info)
+
     @staticmethod
     def get_alt_for_bed_based_annotsv(sv_type):
         return "<" + sv_type + ">"
 
+    @staticmethod
+    def get_alt_for_bed_based_annotsv_batch(sv_type):
+        return "<" + pd.Series(sv_type, dtype=object) + ">"
+
     @staticmethod
     def get_chr_from_breakpoint(left_breakpoint, right_breakpoint):
         return (left_breakpoint.split(":")[0], right_breakpoint.split(":")[0])
 
+    @staticmethod
+    def get_chr_from_breakpoint_batch(left_breakpoint, right_breakpoint):
+        """
+        breakpoint helpers return a column of (left, right) tuples, like their scalar version
+        """
+        left = pd.Series(left_breakpoint, dtype=object).str.split(":", n=1).str[0]
+        right = pd.Series(right_breakpoint, dtype=object).str.split(":", n=1).str[0]
+        return list(zip(left.tolist(), right.tolist()))
+
     @staticmethod
     def get_pos_from_breakpoint(left_breakpoint, right_breakpoint):
         return (left_breakpoint.split(":")[1], right_breakpoint.split(":")[1])
 
+    @staticmethod
+    def get_pos_from_breakpoint_batch(left_breakpoint, right_breakpoint):
+        left = pd.Series(left_breakpoint, dtype=object).str.split(":", n=2).str[1]
+        right = pd.Series(right_breakpoint, dtype=object).str.split(":", n=2).str[1]
+        return list(zip(left.tolist(), right.tolist()))
+
     @staticmethod
     def readable_starfusion_annots(annots):
         """
@@ -170,4 +369,4 @@ class HelperFunctions:
 
     @staticmethod
     def get_undefined_value():
-        return "."
\ No newline at end of file
+        return "."
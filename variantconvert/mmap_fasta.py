@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+from __future__ import print_function
+
+import mmap
+import numpy
+import os
+
+from collections import OrderedDict
+from pyfaidx import Faidx, FetchError
+
+
+class Sequence:
+    """
+    Minimal stand-in for pyfaidx.Sequence: converters only use .seq
+    """
+
+    __slots__ = ("seq",)
+
+    def __init__(self, seq):
+        self.seq = seq
+
+    def __str__(self):
+        return self.seq
+
+    def __len__(self):
+        return len(self.seq)
+
+
+class MmapFastaRecord:
+    """
+    One contig of a MmapFasta, indexed like a pyfaidx.FastaRecord:
+    record[i] and record[start:end] (0-based) return an object with a .seq attribute
+    """
+
+    def __init__(self, fasta, name, length, offset, linebases, linewidth):
+        self._fasta = fasta
+        self.name = name
+        self._length = length
+        self._offset = offset
+        self._linebases = linebases
+        self._linewidth = linewidth
+
+    def __len__(self):
+        return self._length
+
+    def __repr__(self):
+        return "MmapFastaRecord(" + self.name + ")"
+
+    def byte_offset(self, pos):
+        """
+        0-based position in the contig -> position of its base in the FASTA file
+        works on ints and numpy arrays alike
+        """
+        return (
+            self._offset
+            + (pos // self._linebases) * self._linewidth
+            + pos % self._linebases
+        )
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            start, end, step = n.start, n.stop, n.step
+            if start is None:
+                start = 0
+            elif start < 0:
+                start += self._length
+            if end is None or end > self._length:
+                end = self._length
+            elif end < 0:
+                end += self._length
+            if start < 0:
+                raise FetchError("Requested start coordinate must be greater than 1.")
+            seq = self._fasta.read(self, start, end)
+            return Sequence(seq[::step] if step else seq)
+        if n < 0:
+            n += self._length
+        if n < 0:
+            raise FetchError("Requested start coordinate must be greater than 1.")
+        if n >= self._length:
+            return Sequence("")
+        return Sequence(self._fasta.get_base(self, n))
+
+    def get_bases(self, positions):
+        """
+        Batch version of [self[pos].seq for pos in positions] (0-based numpy int array)
+        Bases are read straight from the mapped file, without going through the block cache
+        """
+        if len(positions) and positions.min() < 0:
+            raise FetchError("Requested start coordinate must be greater than 1.")
+        in_range = positions < self._length
+        codes = self._fasta.view[self.byte_offset(positions[in_range])]
+        if in_range.all():
+            return list(codes.tobytes().decode("ascii"))
+        bases = numpy.full(len(positions), "", dtype=object)
+        bases[in_range] = list(codes.tobytes().decode("ascii"))
+        return bases.tolist()
+
+
+class MmapFasta:
+    """
+    Read-only FASTA backend based on mmap and the .fai index (built with pyfaidx if missing)
+    Drop-in replacement for the parts of pyfaidx.Fasta used by the converters:
+    fasta[contig][pos].seq, fasta[contig][start:end].seq, len(fasta[contig])
+
+    Single bases are read at their computed offset in the mapped file.
+    Regions are decoded in blocks of block_size bases. The last cache_blocks
+    decoded blocks are kept in a LRU cache, so memory use is bounded
+    to about block_size * cache_blocks bytes, whatever the genome size.
+    """
+
+    def __init__(self, fasta_path, block_size=65536, cache_blocks=256):
+        if block_size < 1 or cache_blocks < 1:
+            raise ValueError("block_size and cache_blocks must be positive integers")
+        self.fasta_path = fasta_path
+        self.block_size = block_size
+        self.cache_blocks = cache_blocks
+        self._blocks = OrderedDict()
+
+        fai_path = fasta_path + ".fai"
+        if not os.path.exists(fai_path):
+            Faidx(fasta_path).close()
+        self.records = OrderedDict()
+        with open(fai_path, "r") as fai:
+            for line in fai:
+                if not line.strip():
+                    continue
+                name, length, offset, linebases, linewidth = line.rstrip("\r\n").split(
+                    "\t"
+                )[:5]
+                self.records[name] = MmapFastaRecord(
+                    self, name, int(length), int(offset), int(linebases), int(linewidth)
+                )
+
+        self._file = open(fasta_path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        # zero-copy byte view of the whole file, for vectorized lookups
+        self.view = numpy.frombuffer(self._mmap, dtype=numpy.uint8)
+
+    def __getitem__(self, name):
+        return self.records[name]
+
+    def __contains__(self, name):
+        return name in self.records
+
+    def keys(self):
+        return self.records.keys()
+
+    def _decode(self, record, start, end):
+        if start >= end:
+            return ""
+        raw = self._mmap[record.byte_offset(start) : record.byte_offset(end - 1) + 1]
+        return raw.translate(None, b"\r\n").decode("ascii")
+
+    def get_base(self, record, pos):
+        """
+        single base: taken from the cache if its block is there, otherwise read
+        directly at its computed offset in the file (no block decoding for random lookups)
+        """
+        block = self._blocks.get((record.name, pos // self.block_size))
+        if block is not None:
+            return block[pos % self.block_size]
+        return chr(self._mmap[record.byte_offset(pos)])
+
+    def get_block(self, record, block_index):
+        key = (record.name, block_index)
+        block = self._blocks.get(key)
+        if block is not None:
+            self._blocks.move_to_end(key)
+            return block
+        start = block_index * self.block_size
+        block = self._decode(record, start, min(start + self.block_size, len(record)))
+        self._blocks[key] = block
+        if len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
+        return block
+
+    def read(self, record, start, end):
+        """
+        record sequence between 0-based start (included) and end (excluded)
+        regions bigger than the cache are decoded directly
+        """
+        if start >= end:
+            return ""
+        first_block = start // self.block_size
+        last_block = (end - 1) // self.block_size
+        if last_block - first_block >= self.cache_blocks:
+            return self._decode(record, start, end)
+        seq = "".join(
+            self.get_block(record, i) for i in range(first_block, last_block + 1)
+        )
+        offset = first_block * self.block_size
+        return seq[start - offset : end - offset]
+
+    def close(self):
+        self._blocks.clear()
+        self.view = None
+        self._mmap.close()
+        self._file.close()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Timing spans and counters of a conversion, see convert --profile
+
+Converters wrap their stages in PROFILER.span("stage") and count events with
+PROFILER.count("counter", n). Both do nothing until PROFILER.enable() is called,
+so the instrumentation can stay in the hot path.
+
+With convert --processes, the spans and counters of each worker process are added to
+the report under the span converting the shards (see sharding.convert_shards()):
+their seconds are summed over the workers, so they can exceed the wall time of that span.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import cProfile
+import json
+import logging as log
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.spans = OrderedDict()  # "parent/child" name: [calls, seconds]
+        self.counters = OrderedDict()
+        self._stack = []
+        self._cprofile = None
+
+    def enable(self, cprofile=False):
+        self.enabled = True
+        if cprofile:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def reset(self):
+        """
+        Drops the spans and counters recorded so far, e.g. those inherited by a forked worker process
+        """
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile = None
+        self.spans = OrderedDict()
+        self.counters = OrderedDict()
+        self._stack = []
+
+    @contextmanager
+    def span(self, name):
+        """
+        Nested spans are reported as "parent/child"
+        """
+        if not self.enabled:
+            yield
+            return
+        self._stack.append(name)
+        full_name = "/".join(self._stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._stack.pop()
+            span = self.spans.setdefault(full_name, [0, 0.0])
+            span[0] += 1
+            span[1] += elapsed
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def debug(self, message, value=None):
+        """
+        Debug output of large objects: only formatted when profiling in debug verbosity
+        """
+        if self.enabled and log.getLogger().isEnabledFor(log.DEBUG):
+            log.debug(message if value is None else message + " " + str(value))
+
+    def get_report(self):
+        return {
+            "spans": [
+                {"name": name, "calls": calls, "seconds": seconds}
+                for name, (calls, seconds) in self.spans.items()
+            ],
+            "counters": dict(self.counters),
+        }
+
+    def pop_report(self):
+        """
+        get_report(), then drops the spans and counters it contains
+        """
+        report = self.get_report()
+        self.spans = OrderedDict()
+        self.counters = OrderedDict()
+        return report
+
+    def merge(self, report):
+        """
+        Adds the spans and counters of a get_report() (e.g. of a worker process),
+        its spans being nested in the current span
+        """
+        prefix = "".join(name + "/" for name in self._stack)
+        for span in report["spans"]:
+            merged = self.spans.setdefault(prefix + span["name"], [0, 0.0])
+            merged[0] += span["calls"]
+            merged[1] += span["seconds"]
+        for name, value in report["counters"].items():
+            self.count(name, value)
+
+    def write_report(self, path):
+        """
+        JSON if path ends with .json, TSV otherwise
+        """
+        report = self.get_report()
+        with open(path, "w") as f:
+            if path.endswith(".json"):
+                json.dump(report, f, indent=4)
+                f.write("\n")
+                return
+            f.write("type\tname\tcalls\tseconds\n")
+            for span in report["spans"]:
+                f.write(
+                    "span\t%s\t%d\t%.6f\n"
+                    % (span["name"], span["calls"], span["seconds"])
+                )
+            for name, value in report["counters"].items():
+                f.write("counter\t%s\t%s\t\n" % (name, value))
+
+    def dump_cprofile(self, path):
+        if self._cprofile is None:
+            return
+        self._cprofile.disable()
+        self._cprofile.dump_stats(path)
+
+
+PROFILER = Profiler()
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+Reader engines of the converters' TSV inputs, see read_tsv()
+
+- "pandas" (default): pandas.read_csv(), with the dtypes of get_read_dtypes()
+- "pyarrow": the multithreaded CSV reader of pyarrow, for large files (requires pyarrow)
+- "csv": the csv module of the standard library, in a single pass without parser setup,
+for small files
+
+All engines type the columns like pandas.read_csv() does, so the output VCF does not
+depend on the engine. Low-cardinality text columns are read as categoricals,
+with "." in their categories so that missing values can be filled with it.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import csv
+import numpy
+import pandas as pd
+import re
+
+READER_ENGINES = ("pandas", "pyarrow", "csv")
+
+# pandas.read_csv() defaults
+NA_VALUES = frozenset(
+    [
+        "",
+        "#N/A",
+        "#N/A N/A",
+        "#NA",
+        "-1.#IND",
+        "-1.#QNAN",
+        "-NaN",
+        "-nan",
+        "1.#IND",
+        "1.#QNAN",
+        "<NA>",
+        "N/A",
+        "NA",
+        "NULL",
+        "NaN",
+        "None",
+        "n/a",
+        "nan",
+        "null",
+    ]
+)
+TRUE_VALUES = ("True", "TRUE", "true")
+FALSE_VALUES = ("False", "FALSE", "false")
+
+# low-cardinality input columns, read as categoricals when the config maps them
+CATEGORICAL_VCF_COLUMNS = ("#CHROM", "FILTER", "SAMPLE")
+CATEGORICAL_INFO_COLUMNS = ("SV_type", "Annotation_mode")
+# COLUMNS_DESCRIPTION types of the other columns that can be categoricals (None: not described)
+TEXT_TYPES = (None, "String", "Character", "Flag")
+MAX_CATEGORY_RATIO = 0.5
+SAMPLE_ROWS = 10000
+
+_INTEGER = re.compile(r"\s*[+-]?[0-9]+\s*\Z")
+_FLOAT = re.compile(
+    r"\s*[+-]?(([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]+)?|inf|infinity)\s*\Z",
+    re.IGNORECASE,
+)
+_INT64_MIN = -(2**63)
+_INT64_MAX = 2**63 - 1
+
+
+def get_declared_types(config):
+    """
+    {input column: "Integer", "Float", "String"...} from config["COLUMNS_DESCRIPTION"]
+    Descriptions are keyed either by input column (Varank configs), or by INFO/FORMAT key:
+    those are mapped to their input column through config["VCF_COLUMNS"]
+    """
+    types = {}
+    for key, desc in config["COLUMNS_DESCRIPTION"].items():
+        if not isinstance(desc, dict):
+            continue
+        if isinstance(desc.get("Type"), str):
+            types[key] = desc["Type"]
+        elif key in ("INFO", "FORMAT") and isinstance(
+            config["VCF_COLUMNS"].get(key), dict
+        ):
+            for field, field_desc in desc.items():
+                col = config["VCF_COLUMNS"][key].get(field)
+                if isinstance(col, str) and col != "" and isinstance(field_desc, dict):
+                    types[col] = field_desc.get("Type")
+    return types
+
+
+def get_categorical_columns(config):
+    columns = [config["VCF_COLUMNS"].get(key) for key in CATEGORICAL_VCF_COLUMNS]
+    if isinstance(config["VCF_COLUMNS"].get("INFO"), dict):
+        columns += [
+            config["VCF_COLUMNS"]["INFO"].get(key) for key in CATEGORICAL_INFO_COLUMNS
+        ]
+    return set(col for col in columns if isinstance(col, str) and col != "")
+
+
+def is_categorical_column(col, n_distinct, n_values, declared, categorical):
+    """
+    For text columns: low-cardinality VCF columns (see get_categorical_columns()) are categoricals,
+    as well as columns that are not declared as numbers in config["COLUMNS_DESCRIPTION"]
+    and have few distinct values
+    declared, categorical: see get_declared_types() and get_categorical_columns()
+    """
+    if col in categorical:
+        return True
+    return (
+        declared.get(col) in TEXT_TYPES and n_distinct <= MAX_CATEGORY_RATIO * n_values
+    )
+
+
+def get_read_dtypes(filepath, config, sample_rows=SAMPLE_ROWS):
+    """
+    read_csv() dtypes of a converter input, from the first <sample_rows> rows and the config:
+    text columns are read as categoricals, see is_categorical_column().
+    Other columns are left to pandas' type inference, which keeps their string representation
+    as is (e.g "12.0" in an Integer column with missing values, "0,5" in a Varank Float column).
+    """
+    sample = pd.read_csv(
+        filepath,
+        skiprows=config["GENERAL"]["skip_rows"],
+        sep="\t",
+        nrows=sample_rows,
+        low_memory=False,
+    )
+    declared = get_declared_types(config)
+    categorical = get_categorical_columns(config)
+    dtypes = {}
+    for col in sample.columns:
+        # a text column in the sample is a text column in the whole file
+        if sample[col].dtype != object:
+            continue
+        values = sample[col].dropna()
+        if is_categorical_column(
+            col, values.nunique(), len(values.index), declared, categorical
+        ):
+            dtypes[col] = "category"
+    return dtypes
+
+
+def mangle_column_names(names):
+    """
+    Column names as pandas.read_csv() gives them: duplicates get a ".1", ".2"... suffix
+    and empty names are "Unnamed: <index>"
+    """
+    counts = {}
+    mangled = []
+    for i, name in enumerate(names):
+        if name == "":
+            name = "Unnamed: " + str(i)
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[name] = count + 1
+            name = name + "." + str(count)
+            count = counts.get(name, 0)
+        counts[name] = count + 1
+        mangled.append(name)
+    return mangled
+
+
+def _open_tsv(filepath, skip_rows):
+    """
+    Returns the file positioned after the skipped rows, and a csv reader of its remaining lines
+    """
+    # AnnotSV annotations can be larger than the default limit of 128 KB
+    csv.field_size_limit(2**31 - 1)
+    f = open(filepath, "r", newline="", encoding="utf-8")
+    for _ in range(skip_rows):
+        f.readline()
+    return f, csv.reader(f, delimiter="\t")
+
+
+def _convert_column(values):
+    """
+    values: strings of a column, None for missing values
+    Returns a numpy array typed like pandas.read_csv() infers it:
+    int64 (float64 with missing values), float64, bool (object with missing values) or object
+    """
+    present = [v for v in values if v is not None]
+    has_missing = len(present) < len(values)
+    if not present:
+        return numpy.full(len(values), numpy.nan)
+    if all(_INTEGER.match(v) for v in present):
+        integers = [int(v) for v in present]
+        if min(integers) >= _INT64_MIN and max(integers) <= _INT64_MAX:
+            if not has_missing:
+                return numpy.array(integers, dtype=numpy.int64)
+            return numpy.array([numpy.nan if v is None else float(v) for v in values])
+    elif all(_FLOAT.match(v) for v in present):
+        return numpy.array([numpy.nan if v is None else float(v) for v in values])
+    elif all(v in TRUE_VALUES or v in FALSE_VALUES for v in present):
+        if not has_missing:
+            return numpy.array([v in TRUE_VALUES for v in values], dtype=bool)
+        return numpy.array(
+            [numpy.nan if v is None else v in TRUE_VALUES for v in values], dtype=object
+        )
+    return numpy.array([numpy.nan if v is None else v for v in values], dtype=object)
+
+
+def _read_stdlib(filepath, config):
+    f, reader = _open_tsv(filepath, config["GENERAL"]["skip_rows"])
+    with f:
+        names = mangle_column_names(next(reader))
+        rows = [row for row in reader if row]  # pandas skips blank lines
+    for i, row in enumerate(rows):
+        if len(row) > len(names):
+            raise ValueError(
+                "Expected "
+                + str(len(names))
+                + " fields in data line "
+                + str(i + 1)
+                + " of "
+                + filepath
+                + ", saw "
+                + str(len(row))
+            )
+        if len(row) < len(names):
+            rows[i] = row + [""] * (len(names) - len(row))
+
+    declared = get_declared_types(config)
+    categorical = get_categorical_columns(config)
+    columns = {}
+    raw_columns = zip(*rows) if rows else [()] * len(names)
+    for name, raw in zip(names, raw_columns):
+        values = [None if v in NA_VALUES else v for v in raw]
+        column = _convert_column(values)
+        if column.dtype == object:
+            present = [v for v in values if v is not None]
+            if is_categorical_column(
+                name, len(set(present)), len(present), declared, categorical
+            ):
+                column = pd.Categorical(column)
+        columns[name] = column
+    return pd.DataFrame(columns, columns=names)
+
+
+def _read_pandas(filepath, config):
+    return pd.read_csv(
+        filepath,
+        skiprows=config["GENERAL"]["skip_rows"],
+        sep="\t",
+        low_memory=False,
+        dtype=get_read_dtypes(filepath, config),
+    )
+
+
+def _read_pyarrow(filepath, config):
+    try:
+        import pyarrow
+        import pyarrow.compute
+        from pyarrow import csv as pyarrow_csv
+    except ImportError:
+        raise ValueError(
+            "The pyarrow reader engine requires the pyarrow package: pip install pyarrow"
+        )
+
+    skip_rows = config["GENERAL"]["skip_rows"]
+    f, reader = _open_tsv(filepath, skip_rows)
+    with f:
+        names = mangle_column_names(next(reader))
+
+    def read(column_types):
+        return pyarrow_csv.read_csv(
+            filepath,
+            read_options=pyarrow_csv.ReadOptions(
+                skip_rows=skip_rows + 1, column_names=names, use_threads=True
+            ),
+            parse_options=pyarrow_csv.ParseOptions(delimiter="\t"),
+            convert_options=pyarrow_csv.ConvertOptions(
+                column_types=column_types,
+                null_values=list(NA_VALUES),
+                true_values=list(TRUE_VALUES),
+                false_values=list(FALSE_VALUES),
+                strings_can_be_null=True,
+                quoted_strings_can_be_null=True,
+            ),
+        )
+
+    table = read({})
+    # pandas keeps dates and times as text: read those columns again as strings
+    temporal = {
+        field.name: pyarrow.string()
+        for field in table.schema
+        if pyarrow.types.is_temporal(field.type)
+    }
+    if temporal:
+        table = read(temporal)
+
+    declared = get_declared_types(config)
+    categorical = get_categorical_columns(config)
+    for i, field in enumerate(table.schema):
+        column = table.column(i)
+        if pyarrow.types.is_null(field.type):
+            # empty columns are float64 in pandas
+            table = table.set_column(i, field.name, column.cast(pyarrow.float64()))
+        elif pyarrow.types.is_string(field.type) or pyarrow.types.is_large_string(
+            field.type
+        ):
+            n_distinct = pyarrow.compute.count_distinct(column).as_py()
+            if is_categorical_column(
+                field.name,
+                n_distinct,
+                len(column) - column.null_count,
+                declared,
+                categorical,
+            ):
+                table = table.set_column(i, field.name, column.dictionary_encode())
+    return table.to_pandas()
+
+
+_ENGINES = {"pandas": _read_pandas, "pyarrow": _read_pyarrow, "csv": _read_stdlib}
+
+
+def read_tsv(filepath, config, engine="pandas"):
+    """
+    Reads a converter input with one of the READER_ENGINES
+    engine: usually config["GENERAL"]["reader"] or the convert --reader option,
+    see AbstractConverter.set_reader()
+    """
+    if engine not in _ENGINES:
+        raise ValueError(
+            "Unknown reader engine: "
+            + engine
+            + ". Available engines: "
+            + ", ".join(READER_ENGINES)
+        )
+    df = _ENGINES[engine](filepath, config)
+    for col in df.columns:
+        if (
+            isinstance(df[col].dtype, pd.CategoricalDtype)
+            and "." not in df[col].cat.categories
+        ):
+            df[col] = df[col].cat.add_categories(".")
+    return df
+
+
+if __name__ == "__main__":
+    pass
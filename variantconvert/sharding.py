@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Conversion of a single input in several processes, see convert --processes
+
+The sorted input dataframe is cut into shards: one per contig, large contigs being split
+into position ranges. VCF records of different shards are independent: shards are converted
+by a pool of worker processes (see the convert_shard() method of converters),
+and their records written in shard order, so the output is the same as with one process.
+"""
+
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing
+import numpy
+import pandas as pd
+
+from commons import compile_config, get_genome
+from helper_functions import HelperFunctions
+from profiling import PROFILER
+
+# shards per worker process: smaller shards balance the load between workers
+SHARDS_PER_PROCESS = 4
+
+# state of the current worker process, see init_worker()
+_worker = {}
+
+
+def get_shard_bounds(contigs, n_shards):
+    """
+    contigs: CHROM of the sorted rows
+    Returns the first row of each shard: one shard per contig, contigs with more than
+    len(contigs) / n_shards rows being split in equal parts
+    """
+    codes = pd.factorize(pd.Series(contigs, dtype=object))[0]
+    nrows = len(codes)
+    if nrows == 0:
+        return [0]
+    starts = [0] + (numpy.flatnonzero(codes[1:] != codes[:-1]) + 1).tolist()
+    ends = starts[1:] + [nrows]
+    target = -(-nrows // n_shards)
+    bounds = []
+    for start, end in zip(starts, ends):
+        parts = -(-(end - start) // target)
+        bounds += [start + (end - start) * i // parts for i in range(parts)]
+    return bounds
+
+
+def get_shards(contigs, variant_keys, n_shards):
+    """
+    Returns the row numbers of each shard, see get_shard_bounds()
+    variant_keys: rows with the same key are lines of the same variant (e.g. one per sample):
+    they go to the shard of the first one. None if each row is a variant
+    """
+    bounds = numpy.asarray(get_shard_bounds(contigs, n_shards))
+    rows = numpy.arange(len(contigs))
+    if variant_keys is None:
+        first_rows = rows
+    else:
+        keys = numpy.asarray(variant_keys, dtype=object)
+        first_rows = (
+            pd.Series(rows)
+            .groupby(keys, sort=False, dropna=False)
+            .transform("min")
+            .to_numpy()
+        )
+    shard_of_rows = numpy.searchsorted(bounds, first_rows, side="right") - 1
+    order = numpy.argsort(shard_of_rows, kind="stable")
+    counts = numpy.bincount(shard_of_rows, minlength=len(bounds))
+    return [
+        shard for shard in numpy.split(order, numpy.cumsum(counts)[:-1]) if len(shard)
+    ]
+
+
+def init_worker(converter_class, config, df, context, profile):
+    """
+    Pool initializer: converter and conversion plan of the worker, and the input dataframe.
+    With fork, df is inherited from the parent process instead of being pickled.
+    profile: PROFILER.enabled in the parent process
+    """
+    # a FASTA file opened by the parent would share its file offset between all workers
+    get_genome.cache_clear()
+    # the worker only reports its own spans and counters, see convert_shards()
+    PROFILER.reset()
+    PROFILER.enabled = False
+    if profile:
+        PROFILER.enable()
+    _worker["converter"] = converter_class(config)
+    _worker["plan"] = compile_config(config, HelperFunctions(config))
+    _worker["df"] = df
+    _worker["context"] = context
+
+
+def shard_worker(rows):
+    """
+    Returns the records of a shard joined in a single string, their number,
+    and the PROFILER report of the shard (None when not profiling)
+    """
+    with PROFILER.span("shard"):
+        lines = _worker["converter"].convert_shard(
+            _worker["df"].iloc[rows], _worker["plan"], _worker["context"]
+        )
+    report = PROFILER.pop_report() if PROFILER.enabled else None
+    if not lines:
+        return "", 0, report
+    return "\n".join(lines) + "\n", len(lines), report
+
+
+def convert_shards(converter, df, shards, context, processes):
+    """
+    Yields (records text, number of records) of each shard, in shard order
+    converter: its class and config are used to create the converter of each worker
+    context: passed to converter.convert_shard(), with the rows and conversion plan
+    When profiling, the spans and counters of the workers are merged into PROFILER,
+    nested in the current span
+    """
+    with multiprocessing.Pool(
+        processes,
+        initializer=init_worker,
+        initargs=(type(converter), converter.config, df, context, PROFILER.enabled),
+    ) as pool:
+        for text, records, report in pool.imap(shard_worker, shards):
+            if report is not None:
+                PROFILER.merge(report)
+            yield text, records
@@ -12,45 +12,60 @@ import glob
 import logging as log
 import multiprocessing
 import os
-import subprocess
 import time
 
 from os.path import join as osj
 
-from commons import set_log_level
+from cohort import CohortBuilder
+from commons import open_output, set_log_level, varank_to_vcf_coords
 from converter_factory import ConverterFactory
 
+# converter of the current worker process, see init_worker()
+_worker_converter = None
 
-def conversion_worker(args):
+
+def get_coords_file(varank_tsv):
+    return osj(os.path.dirname(varank_tsv), "VCF_Coordinates_Conversion.tsv")
+
+
+def init_worker(config):
     """
-    args are contained in a tuple for ease of use with multiprocessing
+    Pool initializer: one converter per worker process, reused for all its files,
+    built from the config parsed once in the parent.
+    With fork, the config and the coordinates indexes opened by the parent
+    (see commons.varank_to_vcf_coords) are inherited without being reloaded.
     """
-    varank_tsv, bcftools, bgzip, tabix, json_config, tmp_dir = args
-    log.debug("###varank_tsv: " + varank_tsv)
-    factory = ConverterFactory()
-    converter = factory.get_converter("varank", "vcf", json_config)
+    global _worker_converter
+    _worker_converter = ConverterFactory().get_converter("varank", "vcf", config)
 
-    sample_name = converter.get_sample_name(varank_tsv)
-    log.debug("###sample_name: " + sample_name)
-    sample_output = osj(tmp_dir, sample_name + "_from_varank.vcf")
-    coords_file = osj(os.path.dirname(varank_tsv), "VCF_Coordinates_Conversion.tsv")
 
-    converter.set_coord_conversion_file(coords_file)
-    converter.convert(varank_tsv, sample_output)
-    del converter  # otherwise they accumulate in memory until the end of pool.map()
+def conversion_worker(varank_tsv):
+    """
+    Returns the converted sample instead of writing it:
+    (input file, sample name, VCF header, records, conversion time in seconds)
+    records: see VcfFromVarank.get_sample_records(). Coordinates are not looked up:
+    the parent adds them once per variant (see cohort.CohortBuilder)
+    """
+    start = time.time()
+    log.debug("###varank_tsv: " + varank_tsv)
+    converter = _worker_converter
+    records = converter.get_sample_records(varank_tsv)
+    log.debug("###sample_name: " + converter.sample_name)
+    header = converter.create_vcf_header()
+    converter.df = None  # not kept in memory until the next file
+    return varank_tsv, converter.sample_name, header, records, time.time() - start
 
-    subprocess.run(
-        bcftools + " sort " + sample_output + " > " + sample_output + ".sorted.vcf",
-        shell=True,
-    )
-    subprocess.run(bgzip + " " + sample_output + ".sorted.vcf", shell=True)
-    subprocess.run(tabix + " -p vcf " + sample_output + ".sorted.vcf.gz", shell=True)
+
+def schedule_largest_first(files):
+    """
+    Biggest inputs first: a large file started last would keep the batch
+    running long after the other workers are done
+    """
+    return sorted(files, key=lambda f: (-os.path.getsize(f), f))
 
 
 def main_varank_batch(args):
     set_log_level(args.verbosity)
-    tmp_dir = osj(os.path.dirname(args.outputFile), ".varanktovcf." + str(time.time()))
-    os.makedirs(tmp_dir)
     files_to_convert = glob.glob(
         osj(args.inputVarankDir, "*_allVariants.rankingByVar.tsv")
     )
@@ -60,46 +75,59 @@ def main_varank_batch(args):
             + args.inputVarankDir
         )
 
+    for option in ("bcftools", "bgzip", "tabix"):
+        if getattr(args, option) is not None:
+            log.warning(
+                "--"
+                + option
+                + " is deprecated and ignored: samples are merged, compressed and indexed natively"
+            )
+
+    files_to_convert = schedule_largest_first(files_to_convert)
+    config = ConverterFactory().get_converter("varank", "vcf", args.configFile).config
+    # all files come from the same directory: they share its coordinates index,
+    # built (if needed) and opened once, before the workers start
+    cohort = CohortBuilder(
+        config, varank_to_vcf_coords(get_coords_file(files_to_convert[0]))
+    )
+    start = time.time()
     # Without multiprocessing for easier debugging
-    # for varank_tsv in files_to_convert:
-    #     myargs = (
-    #         varank_tsv,
-    #         args.bcftools,
-    #         args.bgzip,
-    #         args.tabix,
-    #         args.configFile,
-    #         tmp_dir,
-    #     )
-    #     conversion_worker(myargs)
-
-    with multiprocessing.Pool(args.ncores) as pool:
-        pool.map(
-            conversion_worker,
-            [
-                (
-                    varank_tsv,
-                    args.bcftools,
-                    args.bgzip,
-                    args.tabix,
-                    args.configFile,
-                    tmp_dir,
-                )
-                for varank_tsv in files_to_convert
-            ],
-        )
-
-    cmd = (
-        args.bcftools
-        + " merge -m none "
-        + osj(tmp_dir, "*.vcf.gz")
-        + " -o "
-        + args.outputFile
-        + " --threads "
-        + str(args.ncores)
+    # init_worker(config)
+    # results = (conversion_worker(varank_tsv) for varank_tsv in files_to_convert)
+    # maxtasksperchild: workers are replaced regularly, so memory kept by pandas
+    # after a big file does not pile up. Samples are merged in memory as they complete:
+    # no temporary VCF, no bcftools merge
+    with multiprocessing.Pool(
+        args.ncores,
+        initializer=init_worker,
+        initargs=(config,),
+        maxtasksperchild=args.maxTasksPerChild,
+    ) as pool:
+        results = pool.imap_unordered(conversion_worker, files_to_convert)
+        for varank_tsv, sample_name, header, records, duration in results:
+            log.info(
+                "Converted "
+                + varank_tsv
+                + " ("
+                + str(round(os.path.getsize(varank_tsv) / 1e6, 1))
+                + " MB, "
+                + str(len(records["variantID"]))
+                + " variants) in "
+                + str(round(duration, 2))
+                + "s"
+            )
+            cohort.add_sample(sample_name, header, records)
+    log.info(
+        "Converted "
+        + str(len(files_to_convert))
+        + " files in "
+        + str(round(time.time() - start, 2))
+        + "s"
     )
-    print(cmd)
-    subprocess.run(cmd, shell=True)
-    # shutil.rmtree(tmp_dir)
+
+    with open_output(args.outputFile) as vcf:
+        cohort.write(vcf)
+    log.info("Wrote: " + args.outputFile)
 
 
 if __name__ == "__main__":